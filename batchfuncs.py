@@ -0,0 +1,192 @@
+import numpy as np
+
+# Template characters are stored as these codes in batch arrays
+OPEN, CLOSE, HAIRPIN = 0, 1, 2
+TEMPCHARS = np.frombuffer(b"()*", dtype=np.uint8)
+# Maps a step decision (1 = "(", 0 = ")", -1 = finished) to its code
+STEPCHARS = np.array([CLOSE, OPEN, -1], dtype=np.int8)
+
+def generatetemps(n: int, matrix: list, bias: float, maxlen=100, returnpos=True, rng=None, stepchunk=64):
+    '''
+    Generates n templates at once, exactly like n separate generatetemp(["("], ...) calls, by advancing them all in lockstep.
+    Returns (codes, offsets, complete, multipositions, multioffsets), or just (codes, offsets, complete) if returnpos is off:
+    codes holds every template back to back as OPEN/CLOSE/HAIRPIN codes, and template i is codes[offsets[i]:offsets[i+1]].
+    complete is True for every template that closed before reaching maxlen.
+    multipositions holds the multiloop "(" positions of every template, in the order generatetemp would return them, and
+    the ones for template i are multipositions[multioffsets[i]:multioffsets[i+1]]. (Each multiloop generatetemp returns only
+    ever holds one position, so they're stored flat.)
+    Parameters:
+    n (integer): The number of templates to generate
+    matrix (list): A matrix of probabilities for appending characters based on the previous one
+    bias (float): The bias towards ")" (subtracts from matrix[0])
+    maxlen (integer): The maximum a template can be before generation stops
+    returnpos (Boolean): Whether or not to find the multiloop positions
+    rng (numpy.random.Generator / integer): The generator (or seed) to draw from, None for a random one
+    stepchunk (integer): How many steps of uniforms to draw at a time
+    '''
+    rng = np.random.default_rng(rng)
+    # Every step adds at least one character, so no template can take more steps than this
+    maxsteps = max(int(maxlen), 0) + 1
+    # decisions[i, s] is 1 if template i appended a "(" at step s, 0 if it appended a ")", and -1 once it's finished
+    decisions = np.full((n, maxsteps), -1, dtype=np.int8)
+    flatdecisions = decisions.reshape(-1)
+    finaldepth = np.ones(n, dtype=np.int64)
+
+    # State of the templates still going (rows are retired from all of these together)
+    rows = np.arange(n)
+    length = np.ones(n, dtype=np.int64)
+    depth = np.ones(n, dtype=np.int64)
+    prevopen = np.ones(n, dtype=bool)
+    step = 0
+    while rows.size and length.min() <= maxlen:
+        # Draw a block of uniforms for the templates still going, and keep track of which column of the block each one uses
+        if step % stepchunk == 0:
+            uniforms = rng.random((stepchunk, rows.size))
+            slots = np.arange(rows.size)
+        choice = uniforms[step % stepchunk, slots]
+
+        p_open = np.where(prevopen, matrix[0], matrix[1]) - bias * depth
+        opens = choice < p_open
+        flatdecisions[rows * maxsteps + step] = opens
+        # A ")" straight after a "(" also adds a "*"
+        length += 1 + (prevopen & ~opens)
+        depth += 2 * opens - 1
+        prevopen = opens
+        step += 1
+
+        # Retire finished templates
+        alive = (depth > 0) & (length <= maxlen)
+        if not alive.all():
+            finaldepth[rows[~alive]] = depth[~alive]
+            rows, slots, length, depth, prevopen = rows[alive], slots[alive], length[alive], depth[alive], prevopen[alive]
+
+    # Turn the decisions into characters: the first "(", then per step an optional "*" and a "(" or ")"
+    decisions = decisions[:, :step]
+    tokens = np.full((n, step + 1, 2), -1, dtype=np.int8)
+    tokens[:, 0, 1] = OPEN
+    tokens[:, 1:, 1] = STEPCHARS[decisions]
+    tokens[:, 1:, 0] = np.where((tokens[:, :-1, 1] == OPEN) & (tokens[:, 1:, 1] == CLOSE), HAIRPIN, -1)
+    tokens = tokens.reshape(-1)
+    kept = tokens >= 0
+    codes = tokens[kept]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(kept.reshape(n, -1), axis=1), out=offsets[1:])
+    complete = finaldepth == 0
+    if not returnpos:
+        return codes, offsets, complete
+    multipositions, multioffsets = findtempmultis(codes, offsets)
+    return codes, offsets, complete, multipositions, multioffsets
+
+def findtempmultis(codes: np.ndarray, offsets: np.ndarray):
+    '''
+    Finds the multiloop positions of a batch of templates, in the same order generatetemp returns them:
+    every "(" straight after a ")", ordered by where it gets closed. Unclosed ones are left out, like generatetemp does.
+    Returns (multipositions, multioffsets) in the format generatetemps uses.
+    Parameters:
+    Codes (numpy array): The template codes, back to back
+    Offsets (numpy array): Where each template starts (plus the end of the last one)
+    '''
+    n = len(offsets) - 1
+    rowid = np.repeat(np.arange(n), np.diff(offsets))
+    pos = np.arange(len(codes)) - offsets[rowid]
+    delta = np.where(codes == OPEN, 1, np.where(codes == CLOSE, -1, 0))
+    total = np.cumsum(delta)
+    # Depth after each character, counted from the start of its own template
+    before = np.concatenate(([0], total))[offsets[:-1]]
+    depth = total - before[rowid]
+
+    # A "(" at some depth is closed by the next ")" at that depth in the same template, so sorting the brackets by
+    # (template, depth, position) puts every "(" right before its ")"
+    brackets = np.flatnonzero(codes != HAIRPIN)
+    level = np.where(codes[brackets] == OPEN, depth[brackets], depth[brackets] + 1)
+    # (Brackets are already in (template, position) order, so a stable sort on (template, depth) is enough)
+    order = brackets[np.argsort(rowid[brackets] * (int(level.max(initial=0)) + 1) + level, kind="stable")]
+    isopen = codes[order[:-1]] == OPEN
+    closed = isopen & (codes[order[1:]] == CLOSE) & (rowid[order[:-1]] == rowid[order[1:]])
+    opener = order[:-1][closed]
+    closer = order[1:][closed]
+
+    # Keep the "("s straight after a ")"
+    aftermulti = pos[opener] > 0
+    aftermulti[aftermulti] = codes[opener[aftermulti] - 1] == CLOSE
+    opener, closer = opener[aftermulti], closer[aftermulti]
+    closeorder = np.argsort(closer, kind="stable")
+    multipositions = pos[opener[closeorder]]
+    multioffsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rowid[opener], minlength=n), out=multioffsets[1:])
+    return multipositions, multioffsets
+
+def decodetemps(codes: np.ndarray, offsets: np.ndarray):
+    '''
+    Turns batch template codes back into a list of template lists, like the ones generatetemp makes.
+    Parameters:
+    Codes (numpy array): The template codes, back to back
+    Offsets (numpy array): Where each template starts (plus the end of the last one)
+    '''
+    flat = TEMPCHARS[codes].tobytes().decode()
+    return [list(flat[offsets[i]:offsets[i+1]]) for i in range(len(offsets) - 1)]
+
+def decodemultis(multipositions: np.ndarray, multioffsets: np.ndarray):
+    '''
+    Turns batch multiloop positions back into lists in the format generatetemp returns.
+    Parameters:
+    Multipositions (numpy array): The multiloop positions, back to back
+    Multioffsets (numpy array): Where each template's positions start (plus the end of the last one)
+    '''
+    return [[[int(pos)] for pos in multipositions[multioffsets[i]:multioffsets[i+1]]] for i in range(len(multioffsets) - 1)]
+
+def findbasesinpksbatch(structs: list):
+    '''
+    Runs findbasesinpks on a whole batch of structures (all lists or all strings) at once.
+    Returns (labels, offsets), where labels[offsets[i]:offsets[i+1]] is what findbasesinpks(structs[i]) returns.
+    Parameters:
+    Structs (list): The given structures
+    '''
+    n = len(structs)
+    islist = n > 0 and type(structs[0]) == list
+    flat = np.frombuffer("".join("".join(struct) for struct in structs).encode(), dtype=np.uint8)
+    charlengths = np.array([sum(map(len, struct)) if islist else len(struct) for struct in structs], dtype=np.int64)
+    charoffsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(charlengths, out=charoffsets[1:])
+
+    # Per base: a run of pseudoknot openers goes one deeper, a run of closers one shallower, and a base is affected if
+    # it's a pseudoknot bracket or anywhere inside one
+    isopen = np.isin(flat, np.frombuffer(b"[{<", dtype=np.uint8))
+    isclose = np.isin(flat, np.frombuffer(b"]}>", dtype=np.uint8))
+    startsstruct = np.zeros(len(flat), dtype=bool)
+    startsstruct[charoffsets[:-1][charlengths > 0]] = True
+    prevopen = np.concatenate(([False], isopen[:-1])) & ~startsstruct
+    prevclose = np.concatenate(([False], isclose[:-1])) & ~startsstruct
+    delta = (isopen & ~prevopen).astype(np.int64) - (isclose & ~prevclose)
+    total = np.cumsum(delta)
+    before = np.concatenate(([0], total))[charoffsets[:-1]]
+    pkdepth = total - np.repeat(before, charlengths)
+    labels = ((isopen | isclose) | (pkdepth > 0)).astype(np.int8)
+    if not islist:
+        return labels, charoffsets
+
+    # Per element: affected if any of its bases are, with empty elements following both their neighbours
+    elementlengths = np.array([len(element) for struct in structs for element in struct], dtype=np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(struct) for struct in structs], out=offsets[1:])
+    ends = np.cumsum(elementlengths)
+    starts = ends - elementlengths
+    totals = np.concatenate(([0], np.cumsum(labels)))
+    affected = totals[ends] > totals[starts]
+    elementlabels = affected.astype(np.int8)
+    empty = np.flatnonzero(elementlengths == 0)
+    if empty.size:
+        first = np.zeros(len(elementlengths), dtype=bool)
+        first[offsets[:-1][offsets[:-1] < offsets[1:]]] = True
+        last = np.zeros(len(elementlengths), dtype=bool)
+        last[offsets[1:][offsets[:-1] < offsets[1:]] - 1] = True
+        empty = empty[~first[empty] & ~last[empty]]
+        nextaffected = totals[starts[empty] + elementlengths[empty + 1]] > totals[starts[empty]]
+        # Runs of empty elements each depend on the one before, so settle them one step of the run at a time
+        elementlabels[elementlengths == 0] = 0
+        for _ in range(empty.size):
+            updated = (elementlabels[empty - 1] == 1) & nextaffected
+            if np.array_equal(updated, elementlabels[empty] == 1):
+                break
+            elementlabels[empty] = updated
+    return elementlabels, offsets
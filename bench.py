@@ -0,0 +1,238 @@
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import generator
+import helpers
+import stackfuncs
+import stats
+
+# Structure lengths (in bases) benchmarked by default
+SIZES = [20, 50, 100, 200, 500, 1000, 2000, 5000]
+# Every stage, in pipeline order
+STAGES = [
+    "generatetemp", "maketemplate", "findmultipositions", "insertpseudoknots", "convertstack", "findbasesinpks",
+    "structurestats", "pipeline",
+]
+
+def sizeparams(size: int, pseudoknots: bool, base=None, seed=0):
+    '''
+    Returns parameters whose structures are close to size bases long, by picking the template length from a short
+    pilot run. With pseudoknots on, there's one pseudoknot per 200 bases (at least one).
+    Parameters:
+    Size (integer): The structure length to aim for
+    Pseudoknots (Boolean): Whether to generate pseudoknots
+    Base (dict): The parameters to start from, None for the defaults
+    Seed (integer): The seed for the pilot run
+    '''
+    params = generator.makeparams(base, pseudoknots=pseudoknots, numpseudoknots=max(1, size // 200), temprange=[19, 21])
+    pilot = list(generator.generate_batch(params, 20, seed=seed, fields=["Length"], maxattempts=200))
+    basespertemp = sum(record["stats"]["Length"] for record in pilot) / sum(record["templatestats"]["Length"] for record in pilot)
+    # Template lengths are always even, so pick the nearest even one and make it the only one in range
+    templength = max(2, 2 * round(size / basespertemp / 2))
+    return generator.makeparams(params, temprange=[templength - 1, templength + 1])
+
+def makeinputs(params: dict, count: int, seed: int):
+    '''
+    Generates the inputs every stage needs, by running the pipeline one stage at a time.
+    Returns a list of dicts with the template, the working templates before and after pseudoknots, and the structure.
+    Parameters:
+    Params (dict): The generation parameters
+    Count (integer): The number of inputs to make
+    Seed (integer): The seed to generate from
+    '''
+    rng = random.Random(seed)
+    inputs = []
+    while len(inputs) < count:
+        template, nummultis = generator.maketemplate(params, rng)
+        looped = generator.insertloops(template, params, rng)
+        knotted = looped
+        if params["pseudoknots"] and looped.count("*") >= 2:
+            try:
+                knotted = generator.insertpseudoknots(looped, params, rng)[0]
+            except generator.PseudoknotError:
+                continue
+        structure = "".join(generator.insertstacks(knotted, params, rng)[0])
+        inputs.append({"template": template, "looped": looped, "knotted": knotted, "structure": structure})
+    return inputs
+
+def stagecall(stage: str, params: dict):
+    '''
+    Returns a function that runs one stage on one input (see makeinputs) with a given random number generator.
+    Parameters:
+    Stage (string): The stage (see STAGES)
+    Params (dict): The generation parameters
+    '''
+    matrix, bias = params["tempchances"], params["bias"]
+    maxlen = params["temprange"][1]
+    if stage == "generatetemp":
+        return lambda item, rng: stackfuncs.generatetemp(["("], matrix, bias, maxlen=maxlen, rng=rng)
+    if stage == "maketemplate":
+        return lambda item, rng: generator.maketemplate(params, rng)
+    if stage == "findmultipositions":
+        return lambda item, rng: helpers.findmultipositions(item["template"])
+    if stage == "insertpseudoknots":
+        return lambda item, rng: generator.insertpseudoknots(item["looped"], params, rng)
+    if stage == "convertstack":
+        # Every stack of a structure, which is where convertstack gets called
+        return lambda item, rng: generator.insertstacks(item["knotted"], params, rng)
+    if stage == "findbasesinpks":
+        return lambda item, rng: helpers.findbasesinpks(item["structure"])
+    if stage == "structurestats":
+        return lambda item, rng: stats.structurestats(item["structure"])
+    if stage == "pipeline":
+        return lambda item, rng: generator.generate_structure(params, rng)
+    raise ValueError(f'Unknown stage "{stage}"')
+
+def timestage(call, inputs: list, seed: int, mintime=0.2, repeats=3):
+    '''
+    Times a stage over the inputs, and returns (seconds per call, calls timed, peak traced memory in bytes).
+    The inputs are run through as many times as it takes to pass mintime, and the best of the repeats is kept.
+    Peak memory is measured in a separate pass with tracemalloc, so it doesn't slow down the timing.
+    Parameters:
+    Call (function): The stage (see stagecall)
+    Inputs (list): The inputs to run it on
+    Seed (integer): The seed for the random number generator the stage draws from
+    Mintime (float): The least time to spend on each repeat, in seconds
+    Repeats (integer): The number of repeats
+    '''
+    def run(loops):
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        for _ in range(loops):
+            for item in inputs:
+                try:
+                    call(item, rng)
+                except generator.PseudoknotError:
+                    # Pseudoknot settings that don't work with an input still cost their time
+                    pass
+        return time.perf_counter() - start
+
+    # Find how many passes it takes to reach mintime
+    loops = 1
+    while True:
+        elapsed = run(loops)
+        if elapsed >= mintime:
+            break
+        loops = max(loops * 2, int(loops * mintime / max(elapsed, 1e-9)) + 1)
+    best = min([elapsed] + [run(loops) for _ in range(repeats - 1)])
+
+    tracemalloc.start()
+    run(1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best / (loops * len(inputs)), loops * len(inputs), peak
+
+def gitversion():
+    '''
+    Returns the current git commit of the repo, or None if it can't be found.
+    '''
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runbenchmarks(sizes=SIZES, stages=STAGES, pseudoknotmodes=(False, True), count=20, seed=0, mintime=0.2, repeats=3, base=None, log=None):
+    '''
+    Runs every stage at every size, with pseudoknots off and on, and returns the results as a JSON-ready dict.
+    Every result has the seconds per call and calls per second, the mean structure length of its inputs, and the
+    peak memory of one pass over them.
+    Parameters:
+    Sizes (list): The structure lengths to aim for (see sizeparams)
+    Stages (list): The stages to time (see STAGES)
+    Pseudoknotmodes (list): Which pseudoknot settings to run
+    Count (integer): The number of inputs per size
+    Seed (integer): The seed for the inputs and the stages
+    Mintime (float): The least time to spend on each repeat, in seconds
+    Repeats (integer): The number of repeats (the best is kept)
+    Base (dict): The parameters to start from, None for the defaults
+    Log (file): Where to print progress, None for nowhere
+    '''
+    results = []
+    for pseudoknots in pseudoknotmodes:
+        for size in sizes:
+            params = sizeparams(size, pseudoknots, base, seed)
+            inputs = makeinputs(params, count, seed)
+            length = sum(len(item["structure"]) for item in inputs) / len(inputs)
+            for stage in stages:
+                if stage == "insertpseudoknots":
+                    # Only inputs with enough hairpins get pseudoknots
+                    stageinputs = [item for item in inputs if pseudoknots and item["looped"].count("*") >= 2]
+                    if not stageinputs:
+                        continue
+                else:
+                    stageinputs = inputs
+                seconds, calls, peak = timestage(stagecall(stage, params), stageinputs, seed, mintime, repeats)
+                results.append({
+                    "stage": stage,
+                    "size": size,
+                    "pseudoknots": pseudoknots,
+                    "length": round(length, 1),
+                    "calls": calls,
+                    "seconds_per_call": seconds,
+                    "per_second": round(1 / seconds, 2),
+                    "peak_bytes": peak,
+                })
+                if log is not None:
+                    print(f'{stage:>18} {size:>5} nt pk={int(pseudoknots)}: {1/seconds:>12.1f}/s  peak {peak/1024:.1f} KiB', file=log)
+    return {
+        "version": gitversion(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "count": count,
+        "results": results,
+    }
+
+def compare(old: dict, new: dict):
+    '''
+    Returns lines comparing two benchmark runs, with the speedup of every stage they both have (above 1 is faster).
+    Parameters:
+    Old (dict): The earlier run
+    New (dict): The later run
+    '''
+    key = lambda result: (result["stage"], result["size"], result["pseudoknots"])
+    oldresults = {key(result): result for result in old["results"]}
+    lines = [f'{old.get("version")} -> {new.get("version")}']
+    for result in new["results"]:
+        if key(result) in oldresults:
+            before = oldresults[key(result)]
+            speedup = before["seconds_per_call"] / result["seconds_per_call"]
+            memory = result["peak_bytes"] / before["peak_bytes"] if before["peak_bytes"] else 1
+            lines.append(f'{result["stage"]:>18} {result["size"]:>5} nt pk={int(result["pseudoknots"])}: {speedup:6.2f}x speed, {memory:6.2f}x memory')
+    return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks every generation stage across structure sizes")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Structure lengths to benchmark, comma separated")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Stages to benchmark, comma separated")
+    parser.add_argument("--pk", choices=["off", "on", "both"], default="both", help="Benchmark with pseudoknots off, on or both")
+    parser.add_argument("-n", "--count", type=int, default=20, help="Inputs per size")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Seed for the inputs and stages")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Least time per repeat, in seconds")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats per stage (the best is kept)")
+    parser.add_argument("-p", "--params", default=None, help="JSON or TOML preset to start from (temprange, pseudoknots and numpseudoknots get set per size)")
+    parser.add_argument("-o", "--output", default="-", help="File to write the JSON results to, - for stdout")
+    parser.add_argument("-c", "--compare", default=None, help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    stages = args.stages.split(",")
+    unknown = set(stages).difference(STAGES)
+    if unknown:
+        sys.exit(f'Unknown stage(s): {", ".join(sorted(unknown))}')
+    base = generator.loadparams(args.params) if args.params is not None else None
+    modes = {"off": (False,), "on": (True,), "both": (False, True)}[args.pk]
+    report = runbenchmarks([int(size) for size in args.sizes.split(",")], stages, modes, args.count, args.seed, args.min_time, args.repeats, base, log=sys.stderr)
+    text = json.dumps(report, indent=1)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if args.compare is not None:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), report)), file=sys.stderr)
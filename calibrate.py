@@ -0,0 +1,336 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import generator
+import instrument
+
+# Where estimates get cached, one JSON file per parameter hash, sample count, seed, generator.OUTPUTVERSION and CACHEFORMAT
+CACHEDIR = ".calibration"
+# Bump whenever estimate changes what it works out, so older cached estimates get redone
+CACHEFORMAT = 2
+
+def setparam(params: dict, name: str, value):
+    '''
+    Returns a copy of params with one parameter set by name.
+    Conversion variables can be named on their own (e.g. "dotratio"), and list elements by index (e.g. "tempchances.0").
+    Parameters:
+    Params (dict/generator.Params): The generation parameters
+    Name (string): The parameter to set
+    Value: The value to set it to
+    '''
+    values = generator.makeparams(params).todict()
+    path = name.split(".")
+    if path[0] in generator.DEFAULTPARAMS["conversionvars"]:
+        path = ["conversionvars"] + path
+    if path[0] not in generator.DEFAULTPARAMS:
+        raise ValueError(f'Unknown parameter "{name}"')
+    if len(path) == 1:
+        values[path[0]] = value
+        return generator.makeparams(values)
+    container = values[path[0]]
+    key = path[1]
+    if type(container) == list:
+        key = int(key)
+        if not -len(container) <= key < len(container):
+            raise ValueError(f'"{name}" is out of range')
+    elif key not in container:
+        raise ValueError(f'Unknown parameter "{name}"')
+    container[key] = value
+    return generator.makeparams(values)
+
+def summarize(values: list):
+    '''
+    Returns the mean, standard deviation, minimum, median and maximum of a list of values (all None if it's empty).
+    Parameters:
+    Values (list): The given values
+    '''
+    if not values:
+        return {"mean": None, "stdev": None, "min": None, "median": None, "max": None}
+    return {
+        "mean": round(statistics.fmean(values), 4),
+        "stdev": round(statistics.pstdev(values), 4),
+        "min": min(values),
+        "median": statistics.median(values),
+        "max": max(values),
+    }
+
+def estimate(params: dict, samples=500, seed=0):
+    '''
+    Generates a number of structures with one set of parameters, and returns how often they were accepted and the
+    distributions of their stats (see summarize).
+    Rejections are counted the same way generation counts them (see instrument.Metrics): templates thrown out by the
+    filters, templates the pseudoknot settings can't work with, structures scored above maxenergy, and structures
+    thrown out by the filters.
+    Parameters:
+    Params (dict): The generation parameters (see generator.makeparams)
+    Samples (integer): The number of structures to try to generate
+    Seed (integer): The seed to generate from
+    '''
+    params = generator.makeparams(params)
+    metrics = instrument.Metrics()
+    templatevalues = {}
+    structurevalues = {}
+    # Every attempt counts, accepted or not, so the acceptance rate is out of samples
+    for record in generator.generate_batch(params, samples, seed, maxattempts=samples, metrics=metrics):
+        for field, value in record["templatestats"].items():
+            templatevalues.setdefault(field, []).append(value)
+        for field, value in record["stats"].items():
+            structurevalues.setdefault(field, []).append(value)
+    counts = {name: metrics.counts[name] for name in ("accepted", "templaterejected", "pkerrors", "energyrejected", "structurerejected")}
+    result = {"paramhash": generator.paramhash(params), "samples": samples, "seed": seed, "version": generator.OUTPUTVERSION, "format": CACHEFORMAT}
+    result.update(counts)
+    result["acceptance"] = round(counts["accepted"]/samples, 4) if samples else 0
+    result["templatestats"] = {field: summarize(values) for field, values in templatevalues.items()}
+    result["stats"] = {field: summarize(values) for field, values in structurevalues.items()}
+    return result
+
+def cachepath(params: dict, samples: int, seed: int, cachedir=CACHEDIR):
+    '''
+    Returns the cache file for an estimate.
+    Parameters:
+    Params (dict): The generation parameters
+    Samples (integer): The number of structures in the estimate
+    Seed (integer): The seed of the estimate
+    Cachedir (string): The cache directory
+    '''
+    return os.path.join(cachedir, f'{generator.paramhash(params)}-{samples}-{seed}-v{generator.OUTPUTVERSION}.{CACHEFORMAT}.json')
+
+def loadcached(params: dict, samples: int, seed: int, cachedir=CACHEDIR):
+    '''
+    Returns a cached estimate, or None if there isn't one (or it was made by a different version of the generator or of estimate).
+    Parameters:
+    Params (dict): The generation parameters
+    Samples (integer): The number of structures in the estimate
+    Seed (integer): The seed of the estimate
+    Cachedir (string): The cache directory, None to not use the cache
+    '''
+    if cachedir is None:
+        return None
+    path = cachepath(params, samples, seed, cachedir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        result = json.load(f)
+    return result if result.get("version") == generator.OUTPUTVERSION and result.get("format") == CACHEFORMAT else None
+
+def savecached(params: dict, result: dict, cachedir=CACHEDIR):
+    '''
+    Saves an estimate to the cache.
+    Parameters:
+    Params (dict): The generation parameters
+    Result (dict): The estimate (see estimate)
+    Cachedir (string): The cache directory, None to not use the cache
+    '''
+    if cachedir is None:
+        return
+    os.makedirs(cachedir, exist_ok=True)
+    path = cachepath(params, result["samples"], result["seed"], cachedir)
+    # Write to a temporary file and swap it in, so a half written file is never read back
+    with open(path + ".tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(path + ".tmp", path)
+
+def estimateall(settings: list, base=None, samples=500, seed=0, workers=1, cachedir=CACHEDIR):
+    '''
+    Estimates every setting (see estimate), using cached estimates where there are any and spreading the rest over a
+    pool of processes. Returns a list of (setting, estimate) in the same order.
+    Every setting uses the same seed, so differences between them come from the parameters, not the draws.
+    Parameters:
+    Settings (list): Dicts of parameter name -> value (see setparam)
+    Base (dict): The parameters the settings are applied to, None for the defaults
+    Samples (integer): The number of structures per setting
+    Seed (integer): The seed to generate from
+    Workers (integer): The number of processes, 1 to estimate in this process, 0 for one per CPU
+    Cachedir (string): The cache directory, None to not use the cache
+    '''
+    allparams = []
+    for setting in settings:
+        params = generator.makeparams(base)
+        for name, value in setting.items():
+            params = setparam(params, name, value)
+        allparams.append(params)
+    results = [loadcached(params, samples, seed, cachedir) for params in allparams]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        if workers == 1:
+            computed = [estimate(allparams[i], samples, seed) for i in missing]
+        else:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+                computed = list(pool.map(estimate, [allparams[i] for i in missing], itertools.repeat(samples), itertools.repeat(seed)))
+        for i, result in zip(missing, computed):
+            savecached(allparams[i], result, cachedir)
+            results[i] = result
+    return list(zip(settings, results))
+
+def gridsettings(grid: dict):
+    '''
+    Returns every combination of a grid of parameter values, as a list of settings.
+    Parameters:
+    Grid (dict): Parameter name -> list of values
+    '''
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def randomsettings(space: dict, trials: int, rng=random):
+    '''
+    Returns settings drawn uniformly from ranges of parameter values.
+    Parameters:
+    Space (dict): Parameter name -> [low, high] (integers if both ends are integers)
+    Trials (integer): The number of settings to draw
+    Rng (random.Random): The random number generator to draw from
+    '''
+    settings = []
+    for _ in range(trials):
+        setting = {}
+        for name, (low, high) in space.items():
+            if type(low) == int and type(high) == int:
+                setting[name] = rng.randint(low, high)
+            else:
+                setting[name] = round(rng.uniform(low, high), 6)
+        settings.append(setting)
+    return settings
+
+def targetscore(result: dict, targets: dict):
+    '''
+    Returns how far an estimate's stat means are from the targets (0 is a perfect match), as the summed squared
+    relative errors. Settings that never make an accepted structure score infinity.
+    Parameters:
+    Result (dict): The estimate (see estimate)
+    Targets (dict): Structure stat name -> target mean
+    '''
+    score = 0
+    for field, target in targets.items():
+        if field not in result["stats"] or result["stats"][field]["mean"] is None:
+            return math.inf
+        scale = abs(target) or 1
+        score += ((result["stats"][field]["mean"] - target)/scale) ** 2
+    return score
+
+def search(space: dict, targets: dict, base=None, trials=20, rounds=3, samples=500, seed=0, workers=1, cachedir=CACHEDIR):
+    '''
+    Searches for the setting whose stat means come closest to the targets, and returns (setting, estimate, score).
+    Each round draws trials random settings, then the next round draws from half as wide a range around the best so far.
+    Parameters:
+    Space (dict): Parameter name -> [low, high] to search within
+    Targets (dict): Structure stat name -> target mean
+    Base (dict): The parameters the settings are applied to, None for the defaults
+    Trials (integer): The number of settings per round
+    Rounds (integer): The number of rounds
+    Samples (integer): The number of structures per setting
+    Seed (integer): The seed to generate from (and to draw the settings with)
+    Workers (integer): The number of processes, 1 to estimate in this process, 0 for one per CPU
+    Cachedir (string): The cache directory, None to not use the cache
+    '''
+    rng = random.Random(seed)
+    best = (None, None, math.inf)
+    current = dict(space)
+    for _ in range(rounds):
+        for setting, result in estimateall(randomsettings(current, trials, rng), base, samples, seed, workers, cachedir):
+            score = targetscore(result, targets)
+            if score < best[2]:
+                best = (setting, result, score)
+        if best[0] is None:
+            continue
+        # Shrink every range around the best setting, staying inside the original space
+        for name, (low, high) in space.items():
+            width = (current[name][1] - current[name][0]) / 4
+            centre = best[0][name]
+            newlow, newhigh = max(low, centre - width), min(high, centre + width)
+            if type(low) == int and type(high) == int:
+                newlow, newhigh = math.floor(newlow), math.ceil(newhigh)
+            current[name] = [newlow, newhigh]
+    return best
+
+def parsevalue(text: str):
+    '''
+    Parses a command line value as JSON if it can, otherwise keeps it as a string.
+    Parameters:
+    Text (string): The given value
+    '''
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def parseassignments(assignments: list, ranges=False):
+    '''
+    Parses "name=value,value,..." (or "name=low:high" if ranges is on) command line options into a dict.
+    Parameters:
+    Assignments (list): The given options
+    Ranges (Boolean): Whether the values are low:high ranges
+    '''
+    parsed = {}
+    for assignment in assignments:
+        name, sep, values = assignment.partition("=")
+        if not sep:
+            raise ValueError(f'"{assignment}" should look like name=value')
+        if ranges:
+            low, sep, high = values.partition(":")
+            if not sep:
+                raise ValueError(f'"{assignment}" should look like name=low:high')
+            parsed[name] = [parsevalue(low), parsevalue(high)]
+        else:
+            parsed[name] = [parsevalue(value) for value in values.split(",")]
+    return parsed
+
+def printtable(rows: list, fields: list):
+    '''
+    Prints a table of settings with their acceptance rates and stat means.
+    Parameters:
+    Rows (list): (setting, estimate) pairs
+    Fields (list): The structure stats to show the means of
+    '''
+    for setting, result in rows:
+        means = ", ".join(f'{field}: {result["stats"].get(field, {}).get("mean")}' for field in fields)
+        print(f'{json.dumps(setting)} -> Accepted: {result["acceptance"]}, {means}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimates the stats that generator parameters give, to tune them")
+    parser.add_argument("-p", "--params", default=None, help="JSON or TOML preset of base parameters (anything left out uses the defaults)")
+    parser.add_argument("-g", "--grid", action="append", default=[], help="Grid values to try, e.g. bias=0.02,0.025,0.03 (repeat for more parameters)")
+    parser.add_argument("-r", "--random", action="append", default=[], help="Range to draw from, e.g. dotratio=0.2:0.5 (repeat for more parameters)")
+    parser.add_argument("-t", "--target", action="append", default=[], help="Stat mean to search for, e.g. \"Pair Density=0.6\" (searches the --random ranges)")
+    parser.add_argument("--trials", type=int, default=20, help="Random settings to try (per round when searching)")
+    parser.add_argument("--rounds", type=int, default=3, help="Rounds of narrowing when searching")
+    parser.add_argument("-n", "--samples", type=int, default=500, help="Structures to generate per setting")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Seed for the structures (and random settings)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Number of processes, 0 for one per CPU")
+    parser.add_argument("-c", "--cache", default=CACHEDIR, help="Cache directory, \"\" to not cache")
+    parser.add_argument("-o", "--output", default=None, help="Also write every estimate to this file as JSON lines")
+    parser.add_argument("-f", "--fields", default="Length,Pair Density,Multiloops,Hairpins", help="Stat means to show, comma separated")
+    args = parser.parse_args()
+
+    base = None
+    if args.params is not None:
+        base = generator.loadparams(args.params)
+    cachedir = args.cache or None
+    space = parseassignments(args.random, ranges=True)
+    fields = args.fields.split(",")
+    if args.target:
+        targets = {name: values[0] for name, values in parseassignments(args.target).items()}
+        if not space:
+            sys.exit("Searching needs at least one --random range")
+        setting, result, score = search(space, targets, base, args.trials, args.rounds, args.samples, args.seed, args.workers, cachedir)
+        if setting is None:
+            sys.exit("No setting made any accepted structures")
+        rows = [(setting, result)]
+        fields = list(targets) + [field for field in fields if field not in targets]
+        print(f'Best setting (score {round(score, 6)}):')
+    else:
+        settings = gridsettings(parseassignments(args.grid))
+        if space:
+            # Grid and random together: every grid point with every random draw
+            draws = randomsettings(space, args.trials, random.Random(args.seed))
+            settings = [dict(point, **draw) for point in settings for draw in draws]
+        rows = estimateall(settings, base, args.samples, args.seed, args.workers, cachedir)
+    printtable(rows, fields)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            for setting, result in rows:
+                f.write(json.dumps({"setting": setting, "estimate": result}) + "\n")
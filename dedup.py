@@ -0,0 +1,99 @@
+import hashlib
+import os
+import numpy as np
+
+def structurehash(structure: str):
+    '''
+    Returns a 64 bit hash of a structure.
+    Parameters:
+    Structure (string): The given structure
+    '''
+    return int.from_bytes(hashlib.blake2b(structure.encode(), digest_size=8).digest(), "little")
+
+class SeenSet:
+    '''
+    Remembers the structures seen in one run (as hashes), to reject duplicates.
+    '''
+    def __init__(self):
+        self.hashes = set()
+
+    def add(self, structure: str):
+        '''
+        Adds a structure, and returns True if it hadn't been seen before.
+        Parameters:
+        Structure (string): The given structure
+        '''
+        key = structurehash(structure)
+        if key in self.hashes:
+            return False
+        self.hashes.add(key)
+        return True
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def close(self):
+        '''
+        Does nothing, so a SeenSet can be used anywhere a HashIndex can.
+        '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HashIndex(SeenSet):
+    '''
+    Remembers structures across runs in a file of sorted 64 bit hashes.
+    The file is memory-mapped and binary searched, and hashes added in this run are kept in memory and merged into it
+    when the index is saved or closed. Two runs shouldn't write to the same index at the same time.
+    Parameters:
+    Path (string): The index file (created if it doesn't exist)
+    '''
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.saved = np.memmap(path, dtype="<u8", mode="r")
+        else:
+            self.saved = np.zeros(0, dtype="<u8")
+
+    def add(self, structure: str):
+        '''
+        Adds a structure, and returns True if it hadn't been seen before, in this run or any saved one.
+        Parameters:
+        Structure (string): The given structure
+        '''
+        key = structurehash(structure)
+        if key in self.hashes:
+            return False
+        pos = np.searchsorted(self.saved, np.uint64(key))
+        if pos < len(self.saved) and self.saved[pos] == key:
+            return False
+        self.hashes.add(key)
+        return True
+
+    def __len__(self):
+        return len(self.saved) + len(self.hashes)
+
+    def save(self):
+        '''
+        Merges the hashes added in this run into the index file.
+        '''
+        if not self.hashes:
+            return
+        merged = np.union1d(np.asarray(self.saved), np.fromiter(self.hashes, dtype="<u8", count=len(self.hashes)))
+        # Write to a temporary file and swap it in, so the index is never left half written
+        temp = self.path + ".tmp"
+        merged.astype("<u8").tofile(temp)
+        self.saved = None
+        os.replace(temp, self.path)
+        self.saved = np.memmap(self.path, dtype="<u8", mode="r")
+        self.hashes = set()
+
+    def close(self):
+        '''
+        Saves the index.
+        '''
+        self.save()
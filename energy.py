@@ -0,0 +1,231 @@
+import argparse
+import functools
+import math
+import re
+import sys
+import helpers
+
+# A rough nearest-neighbor style free energy (kcal/mol at 37 C) for structures without a sequence: every loop gets the
+# sequence-averaged Turner value for its type and size, with no terminal mismatches, dangles or special hairpins.
+# It's only meant to tell plausible structures from hopeless ones, not to stand in for a real folding package.
+STACK = -2.0 # Average stacked pair
+# Loop initiation by size, past the end of a table they grow with the log of the size (see tableenergy)
+HAIRPIN = {3: 5.4, 4: 5.6, 5: 5.7, 6: 5.4, 7: 6.0, 8: 5.5, 9: 6.4}
+BULGE = {1: 3.8, 2: 2.8, 3: 3.2, 4: 3.6, 5: 4.0, 6: 4.4}
+INTERIOR = {2: 0.5, 3: 1.6, 4: 1.1, 5: 2.0, 6: 2.0, 7: 2.2, 8: 2.3, 9: 2.4, 10: 2.5}
+ASYMMETRY = 0.6 # Per unpaired base of difference between the sides of an interior loop
+EXTRAPOLATION = 1.0785 # 1.75 RT at 37 C
+MINHAIRPIN = 3 # Hairpins smaller than this can't form, and get an infinite energy
+# Multiloops: closing + per branch (the closing pair included) + per unpaired base
+MULTICLOSE = 3.4
+MULTIBRANCH = 0.4
+MULTIUNPAIRED = 0.0
+PSEUDOKNOT = 9.6 # Per pseudoknot stem, on top of its stacked pairs
+
+PKRUN = re.compile(r"\[+|\{+|<+")
+
+def tableenergy(table: dict, size: int):
+    '''
+    Looks a loop size up in an initiation table, extrapolating with the log of the size past its end.
+    Parameters:
+    Table (dict): Size -> energy (see HAIRPIN, BULGE and INTERIOR)
+    Size (integer): The number of unpaired bases in the loop
+    '''
+    if size in table:
+        return table[size]
+    largest = max(table)
+    return table[largest] + EXTRAPOLATION * math.log(size / largest)
+
+@functools.lru_cache(maxsize=None)
+def loopenergy(kind: str, size: int, other=0):
+    '''
+    Returns (and caches) the energy of one loop by its type and size.
+    Parameters:
+    Kind (string): "hairpin", "stack", "bulge", "interior" or "multiloop"
+    Size (integer): The unpaired bases in the loop (hairpins and bulges), on one side (interior loops), or the branches counting the closing pair (multiloops)
+    Other (integer): The unpaired bases on the other side (interior loops) or in the whole loop (multiloops)
+    '''
+    if kind == "hairpin":
+        return math.inf if size < MINHAIRPIN else tableenergy(HAIRPIN, size)
+    if kind == "stack":
+        return STACK
+    if kind == "bulge":
+        # A single bulged base leaves the pairs around it stacked
+        return tableenergy(BULGE, size) + (STACK if size == 1 else 0.0)
+    if kind == "interior":
+        return tableenergy(INTERIOR, size + other) + ASYMMETRY * abs(size - other)
+    if kind == "multiloop":
+        return MULTICLOSE + MULTIBRANCH * size + MULTIUNPAIRED * other
+    raise ValueError(f'Unknown loop type "{kind}"')
+
+def pairedloop(left: int, right: int):
+    '''
+    Returns the energy of the loop between two pairs with nothing else paired between them: a stack, bulge or interior loop.
+    Parameters:
+    Left, Right (integer): The unpaired bases on each side
+    '''
+    if left and right:
+        return loopenergy("interior", left, right)
+    if left or right:
+        return loopenergy("bulge", left + right)
+    return loopenergy("stack", 0)
+
+def closedloop(gaps: list):
+    '''
+    Returns the energy of the loop closed by a pair, from the unpaired bases between the pairs inside it.
+    Parameters:
+    Gaps (list): The unpaired bases before the first pair inside, between each of them, and after the last (one long for a hairpin)
+    '''
+    if len(gaps) == 1:
+        return loopenergy("hairpin", gaps[0])
+    if len(gaps) == 2:
+        return pairedloop(gaps[0], gaps[1])
+    return loopenergy("multiloop", len(gaps), sum(gaps))
+
+def pseudoknotenergy(structure: str):
+    '''
+    Returns the energy of the pseudoknot stems in a structure, counting each run of the same pseudoknot bracket as a stem
+    (like stats.structurestats). Pseudoknot bases count as unpaired in the loops around them.
+    Parameters:
+    Structure (string): The given structure
+    '''
+    return sum(PSEUDOKNOT + STACK * (len(run.group()) - 1) for run in PKRUN.finditer(structure))
+
+def structureenergy(structure: str):
+    '''
+    Estimates the free energy of a dot-bracket structure by breaking it into loops, in one pass over it.
+    Parameters:
+    Structure (string): The given structure
+    '''
+    # One list of gaps per open pair (the exterior loop first), the last gap is the one being counted
+    open_gaps = [[0]]
+    total = 0.0
+    for char in structure:
+        if char == "(":
+            open_gaps[-1].append(0)
+            open_gaps.append([0])
+        elif char == ")":
+            if len(open_gaps) == 1:
+                raise ValueError("Unbalanced structure")
+            total += closedloop(open_gaps.pop())
+        else:
+            open_gaps[-1][-1] += 1
+    if len(open_gaps) > 1:
+        raise ValueError("Unbalanced structure")
+    return round(total + pseudoknotenergy(structure), 2)
+
+@functools.lru_cache(maxsize=4096)
+def stackenergy(left: str, right: str):
+    '''
+    Returns (and caches) the energy of the loops inside one generated stack (its stacked pairs, bulges and internal loops).
+    Parameters:
+    Left, Right (string): The two sides of the stack (see generator.makestack)
+    '''
+    opens = [i for i, char in enumerate(left) if char == "("]
+    closes = [i for i, char in enumerate(right) if char == ")"]
+    if len(opens) != len(closes):
+        raise ValueError("The sides of the stack don't match")
+    closes.reverse()
+    return sum(pairedloop(opens[k] - opens[k - 1] - 1, closes[k - 1] - closes[k] - 1) for k in range(1, len(opens)))
+
+def regionenergy(template: list, elements: list, table, pair: list):
+    '''
+    Returns the energy of one template stack's region of a finished working template: the loops inside the stack,
+    and the loop its innermost pair closes.
+    Parameters:
+    Template (list/string): The template the structure was made from
+    Elements (list): The finished working template (a record's "elements")
+    Table (helpers.PairTable): The index of the template
+    Pair (list): The template stack, as [open pos, close pos]
+    '''
+    start, end = pair
+    left, right = elements[2 * start], elements[2 * end]
+    energy = stackenergy(left.strip("."), right.strip("."))
+    # Every template position became two elements, itself and the loop after it (see generator.rerollparts).
+    # Stack sides can start or end with unpaired bases, which belong to the loops next to them
+    gaps = [len(left) - len(left.rstrip("."))]
+    element = 2 * start + 1
+    while element < 2 * end:
+        if element % 2 == 0 and template[element // 2] == "(":
+            close = 2 * table.partner[element // 2]
+            gaps[-1] += len(elements[element]) - len(elements[element].lstrip("."))
+            gaps.append(len(elements[close]) - len(elements[close].rstrip(".")))
+            element = close + 1
+        else:
+            gaps[-1] += len(elements[element])
+            element += 1
+    gaps[-1] += len(right) - len(right.lstrip("."))
+    return energy + closedloop(gaps)
+
+@functools.lru_cache(maxsize=16)
+def templateindex(template: str):
+    '''
+    Returns (and caches, so re-rolling the same structure again doesn't redo it) the index of a template, its
+    stacks sorted by opening position, and opening position -> the stack's number.
+    Parameters:
+    Template (string): The given template
+    '''
+    table = helpers.PairTable(template)
+    pairs = table.pairs()
+    return table, pairs, {pair[0]: i for i, pair in enumerate(pairs)}
+
+def elementenergies(template, elements: list, structure=None):
+    '''
+    Scores a generated structure region by region, so it can be scored again after a re-roll by only redoing the
+    regions that changed (see rescore). Returns ([the energy of each template stack's region, by opening position], the pseudoknot energy).
+    Parameters:
+    Template (list/string): The template the structure was made from
+    Elements (list): The finished working template (a record's "elements")
+    Structure (string): The finished structure, joined from elements if not given
+    '''
+    template = template if isinstance(template, str) else "".join(template)
+    table, pairs = templateindex(template)[:2]
+    regions = [regionenergy(template, elements, table, pair) for pair in pairs]
+    return regions, pseudoknotenergy("".join(elements) if structure is None else structure)
+
+def totalenergy(energies: tuple):
+    '''
+    Adds up the parts from elementenergies into the structure's energy (the same as structureenergy gives).
+    Parameters:
+    Energies (tuple): The parts (see elementenergies)
+    '''
+    return round(sum(energies[0]) + energies[1], 2)
+
+def rescore(energies: tuple, template, elements: list, stacks=(), positions=()):
+    '''
+    Scores a re-rolled structure again from its old parts (see elementenergies), only redoing the regions that changed.
+    Parameters:
+    Energies (tuple): The parts from before the re-roll
+    Template (list/string): The template the structure was made from
+    Elements (list): The re-rolled working template
+    Stacks (list): The indexes of the re-rolled stacks (by opening position), which also change the loop around them
+    Positions (list): The elements of the re-rolled loops and hairpins
+    '''
+    template = template if isinstance(template, str) else "".join(template)
+    table, pairs, index = templateindex(template)
+    changed = set(stacks)
+    for i in stacks:
+        # Unpaired bases at the outer ends of a stack are in the loop around it
+        opener = table.parent[pairs[i][0]]
+        if opener != -1:
+            changed.add(index[opener])
+    for element in positions:
+        pos = element // 2
+        # A loop right after a "(" is inside that pair, anything else is inside the pair around it
+        opener = pos if element % 2 and template[pos] == "(" else table.parent[pos]
+        if opener != -1:
+            changed.add(index[opener])
+    regions = list(energies[0])
+    for i in changed:
+        regions[i] = regionenergy(template, elements, table, pairs[i])
+    return regions, energies[1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the free energy of dot-bracket structures (one per line)")
+    parser.add_argument("input", nargs="?", help="File with one structure per line (stdin if not given)")
+    args = parser.parse_args()
+    lines = open(args.input) if args.input else sys.stdin
+    for line in lines:
+        structure = line.strip()
+        if structure:
+            print(f'{structureenergy(structure)}\t{structure}')
@@ -0,0 +1,134 @@
+import gzip
+import io
+import json
+import sys
+
+def formatplain(record: dict, index: int, meta: dict):
+    '''
+    Formats a record as just its dot-bracket structure.
+    Parameters:
+    Record (dict): The record from generator.generate_structure
+    Index (integer): The position of the record in the run
+    Meta (dict): The run's metadata ("paramhash" and "seed")
+    '''
+    return record["structure"] + "\n"
+
+def formatjsonl(record: dict, index: int, meta: dict):
+    '''
+    Formats a record as one line of JSON with its template, stats, attempt and the run's parameter hash and seed.
+    Parameters:
+    Record (dict): The record from generator.generate_structure
+    Index (integer): The position of the record in the run
+    Meta (dict): The run's metadata ("paramhash" and "seed")
+    '''
+    return json.dumps({
+        "index": index,
+        "structure": record["structure"],
+        "template": record["template"],
+        "stats": record["stats"],
+        "templatestats": record["templatestats"],
+        "paramhash": meta["paramhash"],
+        "seed": meta["seed"],
+        "attempt": record.get("attempt"),
+    }, separators=(",", ":")) + "\n"
+
+def formatfasta(record: dict, index: int, meta: dict):
+    '''
+    Formats a record like FASTA, with a header line holding its index, length, attempt and the run's parameter hash and seed.
+    Parameters:
+    Record (dict): The record from generator.generate_structure
+    Index (integer): The position of the record in the run
+    Meta (dict): The run's metadata ("paramhash" and "seed")
+    '''
+    return f'>structure_{index} length={len(record["structure"])} params={meta["paramhash"]} seed={meta["seed"]} attempt={record.get("attempt")}\n{record["structure"]}\n'
+
+# Output formats, name -> function(record, index, meta) returning the text to write
+FORMATS = {
+    "plain": formatplain,
+    "jsonl": formatjsonl,
+    "fasta": formatfasta,
+}
+
+class StructureWriter:
+    '''
+    Streams records to one file (or stdout) through a single buffered handle, in any of the FORMATS.
+    Use it as a context manager, or call close() when done.
+    Parameters:
+    Path (string): The file to write to, "-" for stdout
+    Fmt (string): The output format (see FORMATS)
+    Mode (string): "a" to append, "w" to overwrite
+    Compress (Boolean): Gzip the output, None to gzip only if the path ends in .gz
+    Paramhash (string): The hash of the parameters that made the records (see generator.paramhash)
+    Seed (integer): The seed of the run
+    Flushevery (integer): Flush after this many records, 0 to only flush when the buffer fills
+    Buffersize (integer): The size of the write buffer in bytes
+    '''
+    def __init__(self, path="-", fmt="plain", mode="a", compress=None, paramhash=None, seed=None, flushevery=10000, buffersize=1 << 20):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown export format "{fmt}", use one of: {", ".join(FORMATS)}')
+        if mode not in ("a", "w"):
+            raise ValueError('mode must be "a" or "w"')
+        if compress is None:
+            compress = path.endswith(".gz")
+        self.formatter = FORMATS[fmt]
+        self.meta = {"paramhash": paramhash, "seed": seed}
+        self.flushevery = flushevery
+        self.count = 0
+        self.raw = None if path == "-" else open(path, mode + "b", buffering=buffersize)
+        base = sys.stdout.buffer if self.raw is None else self.raw
+        if compress:
+            self.gzip = gzip.GzipFile(fileobj=base, mode=mode + "b")
+            self.handle = io.BufferedWriter(self.gzip, buffer_size=buffersize)
+        else:
+            self.gzip = None
+            self.handle = base
+
+    def write(self, record: dict):
+        '''
+        Writes one record.
+        Parameters:
+        Record (dict): The record from generator.generate_structure
+        '''
+        self.handle.write(self.formatter(record, self.count, self.meta).encode())
+        self.count += 1
+        if self.flushevery and self.count % self.flushevery == 0:
+            self.flush()
+
+    def flush(self):
+        '''
+        Pushes everything written so far out to the file. With gzip, that includes what's waiting in the compressor
+        (a sync flush, so the file can be read up to here even if the run dies).
+        '''
+        self.handle.flush()
+        if self.gzip is not None:
+            self.gzip.flush()
+            (sys.stdout.buffer if self.raw is None else self.raw).flush()
+
+    def writeall(self, records):
+        '''
+        Writes every record from an iterable, and returns how many were written.
+        Parameters:
+        Records (iterable): The records from generator.generate_batch or generate_parallel
+        '''
+        start = self.count
+        for record in records:
+            self.write(record)
+        return self.count - start
+
+    def close(self):
+        '''
+        Flushes everything and closes the file (stdout is flushed but left open).
+        '''
+        self.handle.flush()
+        if self.gzip is not None:
+            self.gzip.close()
+        if self.raw is not None:
+            self.raw.close()
+        else:
+            sys.stdout.buffer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
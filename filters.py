@@ -0,0 +1,66 @@
+# Template stats, in the order they're documented in paramtype.md
+TEMPLATEFIELDS = ["Length", "Hairpins", "Stacks", "Multiloops"]
+
+def inrange(value, bounds):
+    '''
+    Returns whether a value is within [minimum, maximum], where either end can be None for no limit.
+    Parameters:
+    Value (integer/float): The given value
+    Bounds (list): The [minimum, maximum] to check against
+    '''
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value <= high)
+
+def passes(statdict: dict, ranges: dict):
+    '''
+    Returns whether every stat named in ranges is within its range.
+    Parameters:
+    Statdict (dict): The stats to check
+    Ranges (dict): Stat name -> [minimum, maximum]
+    '''
+    for field, bounds in ranges.items():
+        if not inrange(statdict[field], bounds):
+            return False
+    return True
+
+def checkranges(ranges: dict, fields: list, name: str):
+    '''
+    Raises a ValueError if ranges names a stat that isn't in fields, or isn't a [minimum, maximum] pair.
+    Parameters:
+    Ranges (dict): Stat name -> [minimum, maximum]
+    Fields (list): The stats that can be filtered on
+    Name (string): The name of the parameter, for the error message
+    '''
+    unknown = set(ranges).difference(fields)
+    if unknown:
+        raise ValueError(f'Unknown stat(s) in {name}: {", ".join(sorted(unknown))}')
+    for field, bounds in ranges.items():
+        if len(bounds) != 2:
+            raise ValueError(f'{name}["{field}"] must be [minimum, maximum]')
+        if bounds[0] is not None and bounds[1] is not None and bounds[0] > bounds[1]:
+            raise ValueError(f'{name}["{field}"] has a minimum above its maximum')
+
+def templateranges(params: dict):
+    '''
+    Returns the ranges a template has to be within, as template stat name -> [minimum, maximum].
+    This is templatefilters, plus the structure filters that the template already settles: a structure has exactly as
+    many multiloops as its template, and as many hairpins (pseudoknots can only take hairpins away, so with them on
+    only the minimum carries over). The filters have to be checked already (generator.Params works this out once).
+    Parameters:
+    Params (dict): The generation parameters
+    '''
+    ranges = {field: list(bounds) for field, bounds in params["templatefilters"].items()}
+    carried = {}
+    if "Multiloops" in params["filters"]:
+        carried["Multiloops"] = params["filters"]["Multiloops"]
+    if "Hairpins" in params["filters"]:
+        low, high = params["filters"]["Hairpins"]
+        carried["Hairpins"] = [low, None] if params["pseudoknots"] else [low, high]
+    # Narrow any range that's in both
+    for field, (low, high) in carried.items():
+        if field in ranges:
+            oldlow, oldhigh = ranges[field]
+            low = oldlow if low is None else low if oldlow is None else max(low, oldlow)
+            high = oldhigh if high is None else high if oldhigh is None else min(high, oldhigh)
+        ranges[field] = [low, high]
+    return ranges
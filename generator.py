@@ -0,0 +1,922 @@
+import hashlib
+import json
+import os
+import random
+import time
+from collections import deque
+from types import MappingProxyType
+from concurrent.futures import ProcessPoolExecutor
+import stackfuncs
+import energy
+import filters
+import helpers
+import instrument
+import samplers
+import stats
+import templatechain
+
+# Default parameters, mirroring the parameter block in revamped.py (see paramtype.md for explanations)
+DEFAULTPARAMS = {
+    # Template Generation
+    "tempchances": [0.85, 0.45],
+    "temprange": [18, 22],
+    "bias": 0.025,
+    "reroll_chance": 0.25,
+    "user_template": [],
+    "stitchlength": 0,
+    "stitchbranches": [2, 4],
+    "stitchexterior": False,
+    "uniformtemplates": False,
+    # Template Length Assignment
+    "assigntype": 0,
+    "mean": 7,
+    "stdev": 1.5,
+    "lengthrange": [3, 10],
+    "probabilities": [0.05, 0.05, 0.1, 0.3, 0.3, 0.1, 0.05, 0.05],
+    "min_stack_size": 2,
+    # Loop making
+    "looprange": [1, 2],
+    # Stack Generation
+    "conversionvars": {
+        "dotratio": 0.35, "maxcountdiff": 2, "maxposdiff": 1, "maxonesideposdiff": 1,
+        "onechance": 0.6, "twochance": 0.35, "minloopdots": 4, "maxloopdots": 5
+    },
+    # Pseudoknot Generation
+    "pseudoknots": False,
+    "numpseudoknots": 1,
+    "pkassigntype": 0,
+    "pkmean": 7,
+    "pkstdev": 1.5,
+    "pklengthrange": [3, 10],
+    "pkprobabilities": [0.05, 0.05, 0.1, 0.3, 0.3, 0.1, 0.05, 0.05],
+    "pkminsize": 2,
+    "surroundrange": [1, 2],
+    "hairpinmaxdiff": 1,
+    "maxpksfromhairpin": 2,
+    "maxpkgenatt": 1000,
+    "crossedmultiloops": False,
+    # Acceptance Filters
+    "templatefilters": {},
+    "filters": {},
+    "maxenergy": None,
+    # Other
+    "debug": False,
+}
+
+# Bump whenever the same parameters and seed would give different structures, stats or energies, so anything cached
+# from an older generator (see calibrate.py) gets made again
+OUTPUTVERSION = 1
+
+# Stages that draw from their own random number generator in a seeded run (see stagestreams)
+STREAMS = ["template", "loops", "pseudoknots", "stacks"]
+
+# Bracket types used for pseudoknots, cycled through in order
+PKBRACKETS = [
+    ("[", "]"),
+    ("{", "}"),
+    ("<", ">"),
+]
+
+class PseudoknotError(ValueError):
+    '''
+    Raised when the pseudoknot settings can't work with a template (crossedmultiloops can't be met).
+    Batch generation counts it as a rejected structure and carries on.
+    '''
+
+def freeze(value):
+    '''
+    Returns a read-only copy of a parameter value, with lists turned into tuples and dicts into read-only views.
+    Parameters:
+    Value: The given value
+    '''
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    return value
+
+def thaw(value):
+    '''
+    Returns a plain (JSON-ready) copy of a frozen parameter value.
+    Parameters:
+    Value: The given value
+    '''
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    return value
+
+def checkrange(params: dict, name: str, low=None, integer=True):
+    '''
+    Raises a ValueError if a parameter isn't a [minimum, maximum] pair with minimum <= maximum (and minimum >= low).
+    Parameters:
+    Params (dict): The generation parameters
+    Name (string): The parameter to check
+    Low (integer): The smallest the minimum can be, None for no limit
+    Integer (Boolean): Whether both ends have to be integers
+    '''
+    bounds = params[name]
+    if len(bounds) != 2 or (integer and not all(isinstance(end, int) for end in bounds)):
+        raise ValueError(f'{name} must be a [minimum, maximum] pair of {"integers" if integer else "numbers"}')
+    if bounds[0] > bounds[1]:
+        raise ValueError(f'{name} has a minimum above its maximum')
+    if low is not None and bounds[0] < low:
+        raise ValueError(f'{name} can\'t go below {low}')
+
+def checkparams(params: dict):
+    '''
+    Raises a ValueError if any of the parameters can't work (see paramtype.md).
+    Parameters:
+    Params (dict): The full generation parameters
+    '''
+    unknown = set(params).difference(DEFAULTPARAMS)
+    if unknown:
+        raise ValueError(f'Unknown parameter(s): {", ".join(sorted(unknown))}')
+    unknown = set(params["conversionvars"]).difference(DEFAULTPARAMS["conversionvars"])
+    if unknown:
+        raise ValueError(f'Unknown conversionvars: {", ".join(sorted(unknown))}')
+    if len(params["tempchances"]) != 2 or not all(0 <= chance <= 1 for chance in params["tempchances"]):
+        raise ValueError("tempchances must be two chances between 0 and 1")
+    checkrange(params, "temprange", 0)
+    checkrange(params, "stitchbranches", 2)
+    if not isinstance(params["stitchlength"], int) or params["stitchlength"] < 0:
+        raise ValueError("stitchlength must be an integer of at least 0")
+    for name in ("bias", "reroll_chance"):
+        if params[name] < 0:
+            raise ValueError(f'{name} can\'t be negative')
+    for name in ("assigntype", "pkassigntype"):
+        if params[name] not in (0, 1, 2):
+            raise ValueError(f'{name} must be 0, 1 or 2')
+    checkrange(params, "lengthrange")
+    checkrange(params, "pklengthrange")
+    checkrange(params, "looprange", 0)
+    checkrange(params, "surroundrange", 0)
+    conversionvars = params["conversionvars"]
+    if conversionvars["minloopdots"] > conversionvars["maxloopdots"] or conversionvars["minloopdots"] < 0:
+        raise ValueError("minloopdots must be between 0 and maxloopdots")
+    for name in ("numpseudoknots", "hairpinmaxdiff", "maxpksfromhairpin", "maxpkgenatt"):
+        if not isinstance(params[name], int) or params[name] < 0:
+            raise ValueError(f'{name} must be an integer of at least 0')
+    filters.checkranges(params["templatefilters"], filters.TEMPLATEFIELDS, "templatefilters")
+    filters.checkranges(params["filters"], stats.STATFIELDS, "filters")
+    if params["maxenergy"] is not None and (isinstance(params["maxenergy"], bool) or not isinstance(params["maxenergy"], (int, float))):
+        raise ValueError("maxenergy must be a number or None")
+
+class Params:
+    '''
+    A frozen set of generation parameters, checked once when it's made, with every length distribution compiled
+    into a sampler (see samplers.py). It reads like a dict (params["bias"]) and can't be changed; use makeparams to get
+    a changed copy. Make one with makeparams or loadparams.
+    Samplers:
+    stacklengths, pklengths: Stack and pseudoknot stem lengths, looplengths: Internal loop sizes,
+    hairpinlengths: Hairpin sizes, surroundlengths: Unpaired bases around a pseudoknot stem
+    Also templateranges: The ranges every drawn template is checked against (see filters.templateranges)
+    Parameters:
+    Values (dict): The full generation parameters (see DEFAULTPARAMS)
+    '''
+    __slots__ = tuple(DEFAULTPARAMS) + ("stacklengths", "pklengths", "looplengths", "hairpinlengths", "surroundlengths", "templateranges")
+
+    def __init__(self, values: dict):
+        checkparams(values)
+        for name in DEFAULTPARAMS:
+            object.__setattr__(self, name, freeze(values[name]))
+        conversionvars = self.conversionvars
+        object.__setattr__(self, "stacklengths", samplers.lengthsampler(self.assigntype, self.mean, self.stdev, self.lengthrange, self.probabilities, self.min_stack_size))
+        object.__setattr__(self, "pklengths", samplers.lengthsampler(self.pkassigntype, self.pkmean, self.pkstdev, self.pklengthrange, self.pkprobabilities, self.pkminsize))
+        object.__setattr__(self, "looplengths", samplers.uniformsampler(*self.looprange))
+        object.__setattr__(self, "hairpinlengths", samplers.uniformsampler(conversionvars["minloopdots"], conversionvars["maxloopdots"]))
+        object.__setattr__(self, "surroundlengths", samplers.uniformsampler(*self.surroundrange))
+        object.__setattr__(self, "templateranges", filters.templateranges(self))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Params can't be changed, use makeparams(params, name=value) for a changed copy")
+
+    def __getitem__(self, name: str):
+        if name not in DEFAULTPARAMS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in DEFAULTPARAMS
+
+    def __iter__(self):
+        return iter(DEFAULTPARAMS)
+
+    def __len__(self):
+        return len(DEFAULTPARAMS)
+
+    def keys(self):
+        return DEFAULTPARAMS.keys()
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in DEFAULTPARAMS]
+
+    def get(self, name: str, default=None):
+        return getattr(self, name) if name in DEFAULTPARAMS else default
+
+    def todict(self):
+        '''
+        Returns the parameters as a plain dict, e.g. to save as JSON.
+        '''
+        return {name: thaw(getattr(self, name)) for name in DEFAULTPARAMS}
+
+    def __eq__(self, other):
+        return isinstance(other, Params) and self.todict() == other.todict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Params({self.todict()!r})'
+
+    def __reduce__(self):
+        # Rebuilt (and recompiled) from the plain values, e.g. when sent to a worker process
+        return (Params, (self.todict(),))
+
+def makeparams(params=None, **overrides):
+    '''
+    Returns a full, checked Params (see Params), filling anything missing with the defaults.
+    Raises a ValueError if a parameter is unknown or can't work.
+    Parameters:
+    Params (dict/Params): The given parameters (can be partial)
+    Overrides: Any single parameters to replace
+    '''
+    full = dict(DEFAULTPARAMS)
+    full["conversionvars"] = dict(DEFAULTPARAMS["conversionvars"])
+    for source in (params or {}, overrides):
+        for key, value in source.items():
+            if key == "conversionvars":
+                full["conversionvars"].update(value)
+            else:
+                full[key] = value
+    return Params(full)
+
+def loadparams(path: str, **overrides):
+    '''
+    Loads parameters from a JSON or TOML preset (anything left out uses the defaults) and returns them as a Params.
+    In TOML, which has no None, use inf or -inf for an open end of a filter range.
+    Parameters:
+    Path (string): The preset file, .json or .toml
+    Overrides: Any single parameters to replace
+    '''
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            # Python 3.10 and older
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            values = tomllib.load(f)
+    elif path.endswith(".json"):
+        with open(path) as f:
+            values = json.load(f)
+    else:
+        raise ValueError(f'Presets have to be .json or .toml files, not {path}')
+    return makeparams(values, **overrides)
+
+def drawlength(assigntype: int, mean: float, stdev: float, lengthrange: list, probabilities: list, minsize: int, rng=random):
+    '''
+    Draws a stack length using the given assignment type. To draw many, compile the distribution once with
+    samplers.lengthsampler instead (Params does this for stacks and pseudoknots).
+    Parameters:
+    Assigntype (integer): 0 -> Normally distributed, 1 -> Uniformly distributed, 2 -> User-made probabilites
+    Mean, Stdev (float): The normal distribution to use (option 0)
+    Lengthrange (list): The range of lengths (option 1+2)
+    Probabilities (list): The probability of each length in lengthrange (option 2)
+    Minsize (integer): The minimum length
+    Rng (random.Random): The random number generator to draw from
+    '''
+    return samplers.lengthsampler(assigntype, mean, stdev, lengthrange, probabilities, minsize).draw(rng)
+
+def stitchtemplate(params: Params, rng=random):
+    '''
+    Builds a long template out of domains drawn from temprange, and returns it along with its number of multiloops.
+    Domains are drawn until their lengths add up to stitchlength, then grouped (stitchbranches at a time) under
+    junction stacks, level by level, until one is left. With stitchexterior on, the top level is left side by side in
+    the exterior loop instead. Every junction stack adds 2 to the length, so templates come out a bit over stitchlength.
+    Parameters:
+    Params (Params): The generation parameters
+    Rng (random.Random): The random number generator to draw from
+    '''
+    temprange = params["temprange"]
+    nodes = []
+    total = 0
+    while total < params["stitchlength"]:
+        if params["uniformtemplates"]:
+            domain = templatechain.sampleuniform(params["tempchances"], params["bias"], temprange[0], temprange[1], rng)[0]
+        else:
+            domain = stackfuncs.generatetempinrange(params["tempchances"], params["bias"], temprange[0], temprange[1], returnpos=False, rng=rng)
+        nodes.append(domain)
+        total += len(domain) - domain.count("*")
+    low, high = params["stitchbranches"]
+    while len(nodes) > 1 and not (params["stitchexterior"] and len(nodes) <= high):
+        grouped = []
+        pos = 0
+        while pos < len(nodes):
+            size = rng.randint(low, high)
+            # A lone leftover joins the junction before it, so every junction has at least two branches
+            if len(nodes) - pos - size < 2:
+                size = len(nodes) - pos
+            junction = ["("]
+            for node in nodes[pos:pos + size]:
+                junction += node
+            junction.append(")")
+            grouped.append(junction)
+            pos += size
+        nodes = grouped
+    template = [char for node in nodes for char in node]
+    # Counted the same way as for user templates (exterior branches included)
+    nummultis = len(helpers.PairTable(template).multiloops)
+    if params["debug"]:
+        print("Stitched:", len(nodes), "top level branch(es),", nummultis, "multiloop(s)")
+    return template, nummultis
+
+def maketemplate(params: Params, rng=random):
+    '''
+    Generates a template with a length inside temprange, and returns it along with its number of multiloops.
+    The length is conditioned on directly (see stackfuncs.generatetempinrange), so no templates are thrown away.
+    If stitchlength is set, the template is stitched together out of domains instead (see stitchtemplate), and with
+    uniformtemplates on every template generatetemp can make in the range is equally likely (see templatechain.py).
+    Parameters:
+    Params (Params): The generation parameters
+    Rng (random.Random): The random number generator to draw from
+    '''
+    if params["stitchlength"]:
+        return stitchtemplate(params, rng)
+    temprange = params["temprange"]
+    if params["uniformtemplates"]:
+        return templatechain.sampleuniform(params["tempchances"], params["bias"], temprange[0], temprange[1], rng)
+    template, multipositions = stackfuncs.generatetempinrange(params["tempchances"], params["bias"], temprange[0], temprange[1], debug=params["debug"], returnpos=True, rng=rng)
+    nummultis = len(multipositions)
+    if params["debug"]:
+        print("Generator:", nummultis)
+        print("Finder   :", helpers.findmultipositions(template))
+    return template, nummultis
+
+def templatestats(template: list, nummultis: int):
+    '''
+    Returns the stats of a template (see paramtype.md).
+    Parameters:
+    Template (list): The given template
+    Nummultis (integer): The number of multiloops in the template
+    '''
+    structure = "".join(template)
+    return {
+        "Length": len(structure.replace("*", "")),
+        "Hairpins": structure.count("*"),
+        "Stacks": structure.count("("),
+        "Multiloops": nummultis,
+    }
+
+def checktemplate(params: Params, tempstats: dict):
+    '''
+    Returns whether a template could make a structure that passes the filters in params, going by its stats.
+    Parameters:
+    Params (Params): The generation parameters
+    Tempstats (dict): The stats of the template (see templatestats)
+    '''
+    # Worked out once when params was made
+    return filters.passes(tempstats, params.templateranges)
+
+def insertloops(template: list, params: Params, rng=random):
+    '''
+    Inserts internal loops between every two adjacent stacks of a template and returns the working template.
+    Parameters:
+    Template (list): The given template
+    Params (Params): The generation parameters
+    Rng (random.Random): The random number generator to draw from
+    '''
+    looplist = []
+    for pos in range(len(template) - 1):
+        # If pos and pos+1 in the template are both stacks
+        if template[pos] in "()" and template[pos + 1] in "()":
+            # Add an internal loop to the looplist
+            looplist.append("." * params.looplengths.draw(rng))
+        else:
+            # Otherwise, add no loop
+            looplist.append("")
+    # Add 1 more no loop so template and looplist are the same size so zip(template,looplist) works.
+    looplist.append("")
+    return [item for pair in zip(template, looplist) for item in pair]
+
+def pseudoknotcandidates(working_template: list, params: Params):
+    '''
+    Lists every hairpin pair a pseudoknot can go between, and the multiloops each one would cross.
+    Returns (candidates, crosses, nummultis), where candidates are sorted [hairpin 1 loc, hairpin 2 loc] pairs within
+    hairpinmaxdiff of each other, and crosses[i] is the set of multiloops (indexes into findmultipositions) candidate i crosses.
+    Parameters:
+    Working_template (list): The template with loops inserted
+    Params (Params): The generation parameters
+    '''
+    hairpinpos = [pos for pos, char in enumerate(working_template) if char == "*"]
+    multiloops = helpers.PairTable(working_template).multiloops
+    candidates = []
+    crosses = []
+    for a in range(len(hairpinpos)):
+        for b in range(a + 1, min(a + params["hairpinmaxdiff"], len(hairpinpos) - 1) + 1):
+            candidates.append([a, b])
+            # A pseudoknot covers everything between its two hairpins, so it crosses any multiloop with a stack in there
+            crosses.append({m for m, multiloop in enumerate(multiloops)
+                            if any(hairpinpos[a] < pos < hairpinpos[b] for pos in multiloop)})
+    return candidates, crosses, len(multiloops)
+
+def choosepseudoknotpairs(candidates: list, crosses: list, nummultis: int, params: Params, rng=random):
+    '''
+    Picks up to numpseudoknots hairpin pairs from the candidates without replacement, keeping to maxpksfromhairpin.
+    If crossedmultiloops is on, pairs that cross a multiloop nothing crosses yet are picked first.
+    Returns the picked pairs and the set of multiloops they cross.
+    Parameters:
+    Candidates (list): The hairpin pairs to pick from (see pseudoknotcandidates)
+    Crosses (list): The multiloops each candidate crosses
+    Nummultis (integer): The number of multiloops
+    Params (Params): The generation parameters
+    Rng (random.Random): The random number generator to draw from
+    '''
+    hairpincounts = {}
+    available = list(range(len(candidates)))
+    uncrossed = set(range(nummultis)) if params["crossedmultiloops"] else set()
+    crossed = set()
+    pseudoknotpairs = []
+    while len(pseudoknotpairs) < params["numpseudoknots"]:
+        usable = [c for c in available
+                  if hairpincounts.get(candidates[c][0], 0) < params["maxpksfromhairpin"]
+                  and hairpincounts.get(candidates[c][1], 0) < params["maxpksfromhairpin"]]
+        if uncrossed:
+            usable = [c for c in usable if crosses[c] & uncrossed]
+        if not usable:
+            break
+        choice = rng.choice(usable)
+        available.remove(choice)
+        pseudoknotpairs.append(list(candidates[choice]))
+        for hairpin in candidates[choice]:
+            hairpincounts[hairpin] = hairpincounts.get(hairpin, 0) + 1
+        crossed |= crosses[choice]
+        uncrossed -= crosses[choice]
+    return pseudoknotpairs, crossed
+
+def insertpseudoknots(working_template: list, params: Params, rng=random, metrics=None):
+    '''
+    Inserts pseudoknots between hairpins of a working template.
+    Returns the new working template, the pseudoknot pairs and the number of crossed multiloops.
+    Each pseudoknot pair is [hairpin 1 loc, hairpin 2 loc, size, [ldots, rdots], [ldots, rdots]].
+    Raises a PseudoknotError if crossedmultiloops is on and the multiloops can't all be crossed.
+    Parameters:
+    Working_template (list): The template with loops inserted
+    Params (Params): The generation parameters
+    Rng (random.Random): The random number generator to draw from
+    Metrics (instrument.Metrics): Counts the tries at picking pseudoknots, None to skip that
+    '''
+    debug = params["debug"]
+    surroundlengths = params.surroundlengths
+    candidates, crosses, nummultis = pseudoknotcandidates(working_template, params)
+    if debug:
+        print(f'Pseudoknot candidates: {candidates}')
+        print(f'Multiloops crossed by each: {crosses}')
+
+    if params["crossedmultiloops"]:
+        # Check up front that every multiloop can be crossed at all
+        coverable = set().union(*crosses)
+        if len(coverable) < nummultis:
+            if metrics is not None:
+                metrics.count("pkerrors")
+            raise PseudoknotError(f'{nummultis - len(coverable)} multiloop(s) can\'t be crossed by any pseudoknot within hairpinmaxdiff')
+        # Picking greedily can still leave one uncrossed (e.g. not enough pseudoknots), so try a bounded number of times
+        for attempt in range(max(1, params["maxpkgenatt"])):
+            pseudoknotpairs, crossed = choosepseudoknotpairs(candidates, crosses, nummultis, params, rng)
+            if metrics is not None:
+                metrics.count("pkattempts")
+            if len(crossed) == nummultis:
+                break
+            if metrics is not None:
+                metrics.count("pkuncrossed")
+        else:
+            if metrics is not None:
+                metrics.count("pkerrors")
+            raise PseudoknotError(f'Could not cross all {nummultis} multiloops with {params["numpseudoknots"]} pseudoknot(s) in {params["maxpkgenatt"]} attempts')
+    else:
+        pseudoknotpairs, crossed = choosepseudoknotpairs(candidates, crosses, nummultis, params, rng)
+        if metrics is not None:
+            metrics.count("pkattempts")
+
+    for pair in pseudoknotpairs:
+        pair.append(params.pklengths.draw(rng))
+        pair.append([surroundlengths.draw(rng), surroundlengths.draw(rng)])
+        pair.append([surroundlengths.draw(rng), surroundlengths.draw(rng)])
+    hairpins = [""] * working_template.count("*")
+    parenthmod = 0
+    for pair in pseudoknotpairs:
+        hairpins[pair[0]] += "." * pair[3][0] + PKBRACKETS[parenthmod][0] * pair[2] + "." * pair[3][1]
+        hairpins[pair[1]] += "." * pair[4][0] + PKBRACKETS[parenthmod][1] * pair[2] + "." * pair[4][1]
+        parenthmod = (parenthmod + 1) % 3
+    working_template = working_template.copy()
+    count = 0
+    for pos, char in enumerate(working_template):
+        if char == "*":
+            if len(hairpins[count]) > 1:
+                working_template[pos] = hairpins[count]
+            count += 1
+    if debug:
+        print(f'Working template: {working_template}')
+        print(f'Crossed multiloops: {sorted(crossed)}')
+    return working_template, pseudoknotpairs, len(crossed)
+
+def makestack(params: Params, rng=random):
+    '''
+    Draws a stack length and generates a stack of it (see stackfuncs.convertstack).
+    Returns the stack length, its two sides and its bulge count.
+    Parameters:
+    Params (Params): The generation parameters
+    Rng (random.Random): The random number generator to draw from
+    '''
+    conversionvars = params["conversionvars"]
+    stacksize = params.stacklengths.draw(rng)
+    stack = stackfuncs.convertstack(stacksize,conversionvars["dotratio"],conversionvars["onechance"],conversionvars["twochance"],conversionvars["maxcountdiff"],conversionvars["maxposdiff"],conversionvars["maxonesideposdiff"],rng=rng)
+    return stacksize, stack[1], stack[2], stack[3]
+
+def insertstacks(working_template: list, params: Params, rng=random):
+    '''
+    Replaces every ( and ) in a working template with a generated stack and fills in the hairpins.
+    Returns the finished working template, the stack lengths, the hairpin sizes and the bulge count.
+    Parameters:
+    Working_template (list): The template with loops (and optionally pseudoknots) inserted
+    Params (Params): The generation parameters
+    Rng (random.Random): The random number generator to draw from
+    '''
+    working_template = working_template.copy()
+    # Find all the stacks and their pairs, sorted by the first position
+    pairslist = helpers.PairTable(working_template).pairs()
+    if params["debug"]:
+        print(pairslist)
+
+    bulgecount = 0
+    stacklengths = []
+    hairpinsizes = []
+    for pair in pairslist:
+        # Generate the stack and replace the template (s and )s with it
+        stacktoinsert = makestack(params, rng)
+        stacklengths.append(stacktoinsert[0])
+        working_template[pair[0]] = stacktoinsert[1]
+        working_template[pair[1]] = stacktoinsert[2]
+        bulgecount += stacktoinsert[3]
+        # If it's a hairpin, add that too
+        if pair[0] + 2 < len(working_template) and working_template[pair[0]+2] == "*":
+            working_template[pair[0]+2] = "." * params.hairpinlengths.draw(rng)
+            hairpinsizes.append(len(working_template[pair[0]+2]))
+    if params["debug"]:
+        print(working_template)
+    return working_template, stacklengths, hairpinsizes, bulgecount
+
+def makerecord(params: Params, structure: str, template: list, tempstats: dict, pseudoknotpairs: list, fields=None, dedup=None, metrics=None, start=None, energies=None):
+    '''
+    Runs a finished structure through dedup, the energy filter (if maxenergy is set), its stats and the filters in
+    params, and returns its record (see generate_structure, with "energy" if it was scored), or None if it was rejected.
+    Parameters:
+    Params (Params): The generation parameters
+    Structure (string): The finished structure
+    Template (list): Its template
+    Tempstats (dict): The stats of its template
+    Pseudoknotpairs (list): Its pseudoknot pairs (see insertpseudoknots)
+    Fields (list): The structure stats to compute, None for all of them (see stats.STATFIELDS)
+    Dedup (dedup.SeenSet): Rejects structures it has already seen, before any stats are computed
+    Metrics (instrument.Metrics): Counts and times the stages, None to skip that
+    Start (float): When the dedup stage started (from time.perf_counter), for the metrics
+    Energies (tuple): The structure's energy by region (see energy.elementenergies), to skip scoring all of it
+    '''
+    if metrics is not None and start is None:
+        start = time.perf_counter()
+    if dedup is not None:
+        seen = not dedup.add(structure)
+        if metrics is not None:
+            start = metrics.lap("dedup", start)
+        if seen:
+            if metrics is not None:
+                metrics.count("duplicates")
+            return None
+    score = None
+    if params["maxenergy"] is not None:
+        score = energy.structureenergy(structure) if energies is None else energy.totalenergy(energies)
+        if metrics is not None:
+            start = metrics.lap("energy", start)
+        if score > params["maxenergy"]:
+            if metrics is not None:
+                metrics.count("energyrejected")
+            return None
+    ranges = params["filters"]
+    statfields = fields
+    if ranges and fields is not None:
+        # The filtered stats are needed even if they weren't asked for
+        statfields = list(fields) + [field for field in ranges if field not in fields]
+    structurestats = stats.structurestats(structure, statfields)
+    if metrics is not None:
+        metrics.lap("stats", start)
+    if ranges:
+        if not filters.passes(structurestats, ranges):
+            if metrics is not None:
+                metrics.count("structurerejected")
+            return None
+        if statfields is not fields:
+            structurestats = {field: structurestats[field] for field in fields}
+    if metrics is not None:
+        metrics.count("accepted")
+    record = {
+        "structure": structure,
+        "template": "".join(template),
+        "templatestats": tempstats,
+        "stats": structurestats,
+        "pseudoknots": pseudoknotpairs,
+    }
+    if score is not None:
+        record["energy"] = score
+    return record
+
+def generate_structure(params: Params, rng=random, template=None, nummultis=None, fields=None, dedup=None, metrics=None, elements=False, rngs=None):
+    '''
+    Generates one structure without any prompts and returns a record of it, or None if it was rejected (by dedup or
+    the filters in params). Drawn templates are checked against the filters before anything else is done with them.
+    The record has the keys "structure", "template", "templatestats", "stats" and "pseudoknots" (and "elements").
+    Parameters:
+    Params (Params/dict): The generation parameters (see makeparams)
+    Rng (random.Random): The random number generator to draw from
+    Template (list): An already accepted template to reuse (not checked against the filters), otherwise user_template or a new one is used
+    Nummultis (integer): The number of multiloops in the given template (found if not given)
+    Fields (list): The structure stats to compute, None for all of them (see stats.STATFIELDS)
+    Dedup (dedup.SeenSet): Rejects structures it has already seen, before any stats are computed
+    Metrics (instrument.Metrics): Counts and times every stage, None to skip that
+    Elements (Boolean): Whether to keep the finished working template in the record as "elements", so parts of it can be re-rolled (see reroll)
+    Rngs (dict): Stage -> random number generator, used instead of rng for those stages (see stagestreams)
+    '''
+    if not isinstance(params, Params):
+        params = makeparams(params)
+    if rngs is None:
+        rngs = {}
+    start = None
+    if metrics is not None:
+        metrics.count("structures")
+        start = time.perf_counter()
+    drawn = False
+    if template is None:
+        template = list(params["user_template"])
+        if len(template) < 1:
+            template, nummultis = maketemplate(params, rngs.get("template", rng))
+            drawn = True
+            if metrics is not None:
+                metrics.count("templates")
+    if nummultis is None:
+        nummultis = len(helpers.findmultipositions(template))
+    tempstats = templatestats(template, nummultis)
+    if drawn and not checktemplate(params, tempstats):
+        # Thrown out before any loops or stacks are added
+        if metrics is not None:
+            metrics.count("templaterejected")
+            metrics.lap("template", start)
+        return None
+    if metrics is not None:
+        start = metrics.lap("template", start)
+    working_template = insertloops(template, params, rngs.get("loops", rng))
+    if metrics is not None:
+        start = metrics.lap("loops", start)
+    pseudoknotpairs = []
+    if params["pseudoknots"] and working_template.count("*") >= 2:
+        working_template, pseudoknotpairs = insertpseudoknots(working_template, params, rngs.get("pseudoknots", rng), metrics)[:2]
+        if metrics is not None:
+            start = metrics.lap("pseudoknots", start)
+    working_template = insertstacks(working_template, params, rngs.get("stacks", rng))[0]
+    structure = "".join(working_template)
+    if metrics is not None:
+        start = metrics.lap("stacks", start)
+    record = makerecord(params, structure, template, tempstats, pseudoknotpairs, fields, dedup, metrics, start)
+    if elements and record is not None:
+        record["elements"] = working_template
+    return record
+
+def rerollparts(template: list, working_template: list):
+    '''
+    Lists the parts of a finished working template that can be re-rolled, as (stacks, loops, hairpins).
+    Stacks are [open element, close element] pairs sorted by the open one (the order insertstacks draws them in),
+    loops are the elements of internal loops, and hairpins are the elements of hairpins (ones holding a pseudoknot aren't included).
+    Parameters:
+    Template (list): The template the structure was made from
+    Working_template (list): The finished working template (a record's "elements")
+    '''
+    # Every template position became two elements, itself and the loop after it
+    stacks = [[2 * pair[0], 2 * pair[1]] for pair in helpers.PairTable(template).pairs()]
+    loops = [2 * pos + 1 for pos in range(len(template) - 1) if template[pos] in "()" and template[pos + 1] in "()"]
+    hairpins = [2 * pos for pos, char in enumerate(template) if char == "*" and not working_template[2 * pos].strip(".")]
+    return stacks, loops, hairpins
+
+def reroll(record: dict, params: Params, rng=random, stacks=None, loops=None, hairpins=None, chance=None, fields=None, dedup=None):
+    '''
+    Re-rolls some of the stacks, internal loops and hairpins of a structure, keeping everything else (its template,
+    pseudoknots and the rest of its stacks and loops), and returns the new record (with "elements"), or None if it was
+    rejected by dedup or the filters in params, with the parts (see rerollparts) kept as "parts" so re-rolling it
+    again doesn't have to find them. Only the chosen parts are drawn again. With maxenergy set, only the regions
+    around them are scored again (see energy.rescore), and the energy by region is kept as "energies".
+    Without any stacks, loops or hairpins given, each one is re-rolled with the chance reroll_chance.
+    Parameters:
+    Record (dict): A record from generate_structure made with elements=True (or from reroll)
+    Params (Params/dict): The generation parameters (see makeparams)
+    Rng (random.Random): The random number generator to draw from
+    Stacks, Loops, Hairpins (list): The indexes of the stacks, internal loops and hairpins to re-roll, in the order they appear
+    Chance (float): The chance to re-roll each part if none are given, None for reroll_chance
+    Fields (list): The structure stats to compute, None for all of them (see stats.STATFIELDS)
+    Dedup (dedup.SeenSet): Rejects structures it has already seen
+    '''
+    if not isinstance(params, Params):
+        params = makeparams(params)
+    if "elements" not in record:
+        raise ValueError("Only records made with elements=True can be re-rolled")
+    template = list(record["template"])
+    working_template = list(record["elements"])
+    # Re-rolling never changes where the parts are, so they're found once and passed along
+    parts = record.get("parts") or rerollparts(template, working_template)
+    stackparts, loopparts, hairpinparts = parts
+    if stacks is None and loops is None and hairpins is None:
+        chance = params["reroll_chance"] if chance is None else chance
+        stacks = [i for i in range(len(stackparts)) if rng.random() < chance]
+        loops = [i for i in range(len(loopparts)) if rng.random() < chance]
+        hairpins = [i for i in range(len(hairpinparts)) if rng.random() < chance]
+    for name, chosen, found in (("stack", stacks, stackparts), ("loop", loops, loopparts), ("hairpin", hairpins, hairpinparts)):
+        for i in chosen or []:
+            if not 0 <= i < len(found):
+                raise ValueError(f'There\'s no {name} {i}, there are {len(found)}')
+    for i in stacks or []:
+        stack = makestack(params, rng)
+        working_template[stackparts[i][0]] = stack[1]
+        working_template[stackparts[i][1]] = stack[2]
+    for i in loops or []:
+        working_template[loopparts[i]] = "." * params.looplengths.draw(rng)
+    for i in hairpins or []:
+        working_template[hairpinparts[i]] = "." * params.hairpinlengths.draw(rng)
+    structure = "".join(working_template)
+    energies = None
+    if params["maxenergy"] is not None:
+        if "energies" in record:
+            changed = [loopparts[i] for i in loops or []] + [hairpinparts[i] for i in hairpins or []]
+            energies = energy.rescore(record["energies"], record["template"], working_template, stacks or [], changed)
+        else:
+            energies = energy.elementenergies(record["template"], working_template, structure)
+    new = makerecord(params, structure, template, record["templatestats"], record["pseudoknots"], fields, dedup, energies=energies)
+    if new is not None:
+        new["elements"] = working_template
+        new["parts"] = parts
+        if energies is not None:
+            new["energies"] = energies
+    return new
+
+def generate_batch(params: Params, n: int, seed=None, fields=None, dedup=None, maxattempts=None, metrics=None, start=0):
+    '''
+    Generates n structures without any prompts, yielding one record (see generate_structure) at a time.
+    Rejected structures (including templates the pseudoknot settings can't work with) don't count towards n.
+    Attempt i draws from its own streams (see stagestreams), so any structure can be made again on its own from the
+    seed and its "attempt", which is added to every record (see regenerate).
+    Parameters:
+    Params (Params/dict): The generation parameters (see makeparams)
+    N (integer): The number of structures to generate
+    Seed (integer): The seed for the batch, None for a random one
+    Fields (list): The structure stats to compute, None for all of them (see stats.STATFIELDS)
+    Dedup (dedup.SeenSet): Rejects structures it has already seen
+    Maxattempts (integer): Stop after this many structures have been generated (accepted or not), None for no limit
+    Metrics (instrument.Metrics): Counts and times every stage (and calls its callback), None to skip that
+    Start (integer): The attempt to start from
+    '''
+    if not isinstance(params, Params):
+        params = makeparams(params)
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    accepted = attempts = 0
+    while accepted < n and (maxattempts is None or attempts < maxattempts):
+        attempt = start + attempts
+        attempts += 1
+        try:
+            record = generate_structure(params, fields=fields, dedup=dedup, metrics=metrics, rngs=stagestreams(seed, attempt))
+        except PseudoknotError:
+            # Counted by the metrics as a pkerror
+            record = None
+        if metrics is not None:
+            metrics.tick()
+        if record is not None:
+            record["attempt"] = attempt
+            accepted += 1
+            yield record
+    if metrics is not None:
+        metrics.finish()
+
+def paramhash(params: dict):
+    '''
+    Returns a short hash that identifies a set of parameters.
+    Parameters:
+    Params (dict/Params): The generation parameters
+    '''
+    return hashlib.sha256(json.dumps(makeparams(params).todict(), sort_keys=True).encode()).hexdigest()[:16]
+
+def deriveseed(seed, *keys):
+    '''
+    Derives an independent 64 bit seed from a base seed and any number of keys (e.g. a batch index).
+    Parameters:
+    Seed (integer): The base seed
+    Keys: The keys that pick out the derived stream
+    '''
+    digest = hashlib.sha256(":".join(str(key) for key in (seed,) + keys).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+def stagestreams(seed: int, index: int):
+    '''
+    Returns the random number generators for one structure of a seeded run, one per stage (see STREAMS), each
+    derived from (seed, index, stage). Nothing depends on the structures before it, so any one can be made on its own.
+    Parameters:
+    Seed (integer): The seed of the run
+    Index (integer): The attempt the structure was made on
+    '''
+    return {stage: random.Random(deriveseed(seed, index, stage)) for stage in STREAMS}
+
+def regenerate(params: Params, seed: int, index: int, fields=None, elements=False):
+    '''
+    Makes structure `index` of a run (its "attempt", see generate_batch) again, without making the ones before it.
+    Returns its record, or None if that attempt was rejected.
+    Parameters:
+    Params (Params/dict): The generation parameters of the run
+    Seed (integer): The seed of the run
+    Index (integer): The attempt to make again
+    Fields (list): The structure stats to compute, None for all of them (see stats.STATFIELDS)
+    Elements (Boolean): Whether to keep the finished working template in the record (see reroll)
+    '''
+    try:
+        record = generate_structure(params, fields=fields, elements=elements, rngs=stagestreams(seed, index))
+    except PseudoknotError:
+        return None
+    if record is not None:
+        record["attempt"] = index
+    return record
+
+def generatechunk(params: Params, n: int, seed: int, fields=None, measure=False, start=0):
+    '''
+    Makes attempts start to start+n-1 of a run and returns a list of the ones that weren't rejected, along with the
+    chunk's metrics (see instrument.Metrics.asdict) if measure is on, otherwise None. Used by the workers in generate_parallel.
+    Parameters:
+    Params (Params): The generation parameters
+    N (integer): The number of structures to generate
+    Seed (integer): The seed of the run
+    Fields (list): The structure stats to compute, None for all of them
+    Measure (Boolean): Whether to count and time the stages
+    Start (integer): The first attempt
+    '''
+    metrics = instrument.Metrics() if measure else None
+    records = list(generate_batch(params, n, seed=seed, fields=fields, maxattempts=n, metrics=metrics, start=start))
+    return records, metrics.asdict() if measure else None
+
+def generate_parallel(params: Params, n: int, seed=None, workers=None, batchsize=1000, fields=None, dedup=None, maxattempts=None, metrics=None):
+    '''
+    Generates n structures across a pool of processes, yielding records (see generate_structure) in order.
+    The structures are generated in batches of batchsize, each attempt drawing from its own streams (see stagestreams),
+    so a given seed gives the same structures in the same order as generate_batch, whatever the workers and batchsize.
+    The filters run in the workers, and duplicates are rejected here, in order, as the batches come back.
+    Parameters:
+    Params (Params/dict): The generation parameters (see makeparams)
+    N (integer): The number of structures to generate
+    Seed (integer): The seed for the run, None for a random one
+    Workers (integer): The number of processes, None for one per CPU
+    Batchsize (integer): The number of structures each process generates at a time
+    Fields (list): The structure stats to compute, None for all of them (see stats.STATFIELDS)
+    Dedup (dedup.SeenSet): Rejects structures it has already seen
+    Maxattempts (integer): Stop after this many structures have been generated (accepted or not), None for no limit
+    Metrics (instrument.Metrics): Collects the counts and times from every batch (including structures past n in the
+    last one), None to skip that
+    '''
+    if not isinstance(params, Params):
+        params = makeparams(params)
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    workers = workers or os.cpu_count() or 1
+    accepted = done = submitted = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a couple of batches queued per worker (but no more than could still be needed), and yield them in order
+        pending = deque()
+        while accepted < n:
+            while (len(pending) < 2 * workers and submitted - done < n - accepted
+                   and (maxattempts is None or submitted < maxattempts)):
+                size = batchsize if maxattempts is None else min(batchsize, maxattempts - submitted)
+                pending.append((pool.submit(generatechunk, params, size, seed, fields, metrics is not None, submitted), size))
+                submitted += size
+            if not pending:
+                break
+            future, size = pending.popleft()
+            records, chunkmetrics = future.result()
+            if metrics is not None:
+                metrics.merge(chunkmetrics)
+                metrics.tick()
+            for record in records:
+                if dedup is not None and not dedup.add(record["structure"]):
+                    if metrics is not None:
+                        # The worker counted it as accepted
+                        metrics.count("accepted", -1)
+                        metrics.count("duplicates")
+                    continue
+                accepted += 1
+                yield record
+                if accepted == n:
+                    break
+            done += size
+        for future, size in pending:
+            future.cancel()
+    if metrics is not None:
+        metrics.finish()
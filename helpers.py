@@ -1,83 +1,164 @@
 def findbasesinpks(struct):
     '''
     Finds bases affected by pseudoknots and returns a matching list, where 0 = not affected, and 1 = at least one base in the correspoiding structure is affected.
+    For a list, an empty element (a loop with no bases) counts as affected if the elements on both sides of it are.
     Parameters:
     Struct (list/string): The given structure
     '''
     if type(struct) == list: temp_struct = "".join(struct)
     else: temp_struct = struct
     typelist = []
-    final_typelist = []
     pkdepth = 0
     OPEN_PK = {"[", "{", "<"}
     CLOSE_PK = {"]", "}", ">"}
-    for i in range(len(temp_struct)):
-        prev = temp_struct[i-1] if i > 0 else None
-        if temp_struct[i] in OPEN_PK and prev not in OPEN_PK:
+    ALL_PK = OPEN_PK | CLOSE_PK
+    prev = None
+    for char in temp_struct:
+        if char in OPEN_PK and prev not in OPEN_PK:
             pkdepth += 1
             typelist.append(1)
-        elif temp_struct[i] in CLOSE_PK and prev not in CLOSE_PK:
+        elif char in CLOSE_PK and prev not in CLOSE_PK:
             pkdepth -= 1
             typelist.append(1)
-        elif temp_struct[i] not in OPEN_PK | CLOSE_PK and pkdepth == 0:
+        elif char not in ALL_PK and pkdepth == 0:
             typelist.append(0)
-        elif pkdepth > 0 or temp_struct[i] in OPEN_PK | CLOSE_PK:
+        elif pkdepth > 0 or char in ALL_PK:
             typelist.append(1)
+        prev = char
     if type(struct) == list:
+        # Running totals of affected bases, so each element's count is one subtraction instead of slicing
+        totals = [0]
+        for value in typelist:
+            totals.append(totals[-1] + value)
+        final_typelist = []
+        prev_type = 0
+        start = 0
         for i in range(len(struct)):
-            if (sum(typelist[:(len(struct[i]))]) > 0 and len(struct[i]) > 0) or (len(struct[i]) == 0 and prev_type == 1 and sum(typelist[(len(struct[i])):(len(struct[i+1]))]) > 0): 
-                final_typelist.append(1) 
-                prev_type = 1
-            else: 
-                final_typelist.append(0) 
+            end = start + len(struct[i])
+            if end > start:
+                prev_type = 1 if totals[end] > totals[start] else 0
+            elif prev_type == 1 and i + 1 < len(struct):
+                # An empty element follows the previous one if the next one is affected too
+                nextend = start + len(struct[i+1])
+                prev_type = 1 if totals[nextend] > totals[start] else 0
+            else:
                 prev_type = 0
-            typelist = typelist[len(struct[i]):]
+            final_typelist.append(prev_type)
+            start = end
         return final_typelist
     else:
         return typelist
 
-def findpairedopen(struct: list, pos: int):
+OPENERS = "([{<"
+CLOSERS = ")]}>"
+BRACKETS = set(OPENERS + CLOSERS)
+MATCHING = dict(zip(CLOSERS, OPENERS))
+
+class PairTable:
+    '''
+    An index of a template (list) or a dot-bracket structure (string), built in one pass, that answers lookups in O(1).
+    For lists, each element is one position, and only elements that are exactly one bracket are paired.
+    Attributes:
+    partner (list): The position each bracket is paired with, -1 if unpaired
+    parent (list): The "(" of the innermost "()" pair around each position (not counting itself), -1 if there isn't one
+    depth (list): The number of "()" pairs around each position, counting the pair itself for "(" and ")"
+    hairpins (list): The "(" positions of every "()" pair with nothing paired inside
+    multiloops (list): The multiloop stacks, in the same format as findmultipositions
+    multiof (list): The index in multiloops each "(" belongs to, -1 if it isn't in one
+    '''
+    __slots__ = ("struct", "partner", "parent", "depth", "hairpins", "multiloops", "multiof")
+
+    def __init__(self, struct):
+        '''
+        Builds the index.
+        Parameters:
+        Struct (list/string): The given template or structure
+        '''
+        n = len(struct)
+        self.struct = struct
+        self.partner = partner = [-1] * n
+        self.parent = parent = [-1] * n
+        self.depth = depth = [0] * n
+        self.hairpins = hairpins = []
+        self.multiloops = multiloops = []
+        self.multiof = multiof = [-1] * n
+        stacks = {opener: [] for opener in OPENERS}
+        roundstack = stacks["("]
+        haspaired = [] # Whether each open "(" has anything paired inside it yet
+        multiopens = set() # "("s straight after a ")" (skipping anything else), which start a multiloop
+        lastround = None
+        for i, char in enumerate(struct):
+            if char == "(":
+                parent[i] = roundstack[-1] if roundstack else -1
+                if haspaired:
+                    haspaired[-1] = True
+                roundstack.append(i)
+                haspaired.append(False)
+                depth[i] = len(roundstack)
+                if lastround == ")":
+                    multiopens.add(i)
+                lastround = char
+            elif char == ")":
+                if not roundstack:
+                    raise ValueError("Unbalanced template")
+                opener = roundstack.pop()
+                partner[opener] = i
+                partner[i] = opener
+                depth[i] = len(roundstack) + 1
+                parent[i] = roundstack[-1] if roundstack else -1
+                if not haspaired.pop():
+                    hairpins.append(opener)
+                if opener in multiopens:
+                    multiloop = [opener] if parent[opener] == -1 else [parent[opener], opener]
+                    for pos in multiloop:
+                        multiof[pos] = len(multiloops)
+                    multiloops.append(multiloop)
+                lastround = char
+            else:
+                parent[i] = roundstack[-1] if roundstack else -1
+                depth[i] = len(roundstack)
+                if char in stacks:
+                    stacks[char].append(i)
+                elif char in MATCHING:
+                    opener = MATCHING[char]
+                    if not stacks[opener]:
+                        raise ValueError("Unbalanced template")
+                    other = stacks[opener].pop()
+                    partner[other] = i
+                    partner[i] = other
+                # Pseudoknot brackets (or template elements holding them) count as something paired
+                if haspaired and (char in BRACKETS or (len(char) > 1 and not BRACKETS.isdisjoint(char))):
+                    haspaired[-1] = True
+        if any(stacks.values()):
+            raise ValueError("Unbalanced template")
+
+    def pairs(self):
+        '''
+        Returns every "()" pair as [open pos, close pos], sorted by the open position.
+        '''
+        return [[i, j] for i, j in enumerate(self.partner) if j > i and self.struct[i] == "("]
+
+def findpairedopen(struct: list, pos: int, table=None):
     '''
     Finds the corresponding ( for a ) in a structure, given a position.
+    For any other position, finds the ( of the innermost pair around it. Returns None if there isn't one.
     Parameters:
     Struct (list): The given structure
     Pos (integer): The position within the structure
+    Table (PairTable): An already built index of the structure, to skip building one
     '''
-    count = 1
-    for i in range(pos):
-        if struct[pos-i-1] == "(":
-            count -= 1
-        elif struct[pos-i-1] == ")":
-            count += 1
-        if count == 0:
-            return pos - i - 1
+    if table is None:
+        table = PairTable(struct)
+    found = table.partner[pos] if struct[pos] == ")" else table.parent[pos]
+    return None if found == -1 else found
 
-def findmultipositions(struct: list):
+def findmultipositions(struct: list, table=None):
     '''
     Finds all positions of "("s in multiloops and returns a list of lists where each sublist corresponds to one singluar multiloop.
     Parameters:
     Struct (list): The given structure
+    Table (PairTable): An already built index of the structure, to skip building one
     '''
-    depth = 0
-    fulllist = []
-    active_multis = {}
-    for i, char in enumerate(struct):
-        prev = struct[i-2] if i > 1 else None
-        if char == "(":
-            depth += 1
-            if prev == ")":
-                if depth not in active_multis:
-                    active_multis[depth]=[i]
-                else:
-                    active_multis[depth].append(i)
-        elif char == ")":
-            if depth in active_multis:
-                fulllist.append(active_multis[depth])
-                active_multis.pop(depth)
-            depth -= 1
-    if depth != 0:
-        raise ValueError("Unbalanced template")
-    for multiloop in fulllist:
-        multiloop.append(findpairedopen(struct, multiloop[0]-1))
-        multiloop.sort()
-    return fulllist
\ No newline at end of file
+    if table is None:
+        table = PairTable(struct)
+    return [multiloop.copy() for multiloop in table.multiloops]
@@ -0,0 +1,108 @@
+import time
+
+# Counters, in the order they're reported
+COUNTERS = [
+    "structures", "accepted", "templates", "templaterejected", "pkattempts", "pkuncrossed", "pkerrors",
+    "duplicates", "energyrejected", "structurerejected",
+]
+# Timed stages, in pipeline order
+STAGES = ["template", "loops", "pseudoknots", "stacks", "dedup", "energy", "stats"]
+
+class Metrics:
+    '''
+    Counts and times what the generator does. Pass one as metrics= to generate_structure, generate_batch or
+    generate_parallel; without one nothing is counted or timed, so it costs nothing.
+    Counters (see COUNTERS):
+    structures: Structures attempted, accepted: Structures returned, templates: Templates drawn,
+    templaterejected: Templates thrown out by the filters, pkattempts: Tries at picking pseudoknots,
+    pkuncrossed: Tries that left a multiloop uncrossed (crossedmultiloops), pkerrors: Templates whose multiloops couldn't
+    all be crossed, duplicates: Structures thrown out by dedup, energyrejected: Structures scored above maxenergy,
+    structurerejected: Structures thrown out by the filters
+    Parameters:
+    Callback (function): Called with the Metrics after every `every` structures and at the end of a batch, None for none
+    Every (integer): How many structures between callbacks
+    '''
+    def __init__(self, callback=None, every=1000):
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.callback = callback
+        self.every = every
+        self.lastcallback = 0
+
+    def count(self, name: str, amount=1):
+        '''
+        Adds to a counter.
+        Parameters:
+        Name (string): The counter (see COUNTERS)
+        Amount (integer): How much to add
+        '''
+        self.counts[name] += amount
+
+    def lap(self, stage: str, start: float):
+        '''
+        Adds the time since start to a stage, and returns the current time so the next stage can start from it.
+        Parameters:
+        Stage (string): The stage (see STAGES)
+        Start (float): When the stage started (from time.perf_counter)
+        '''
+        now = time.perf_counter()
+        self.times[stage] += now - start
+        return now
+
+    def tick(self):
+        '''
+        Calls the callback if another `every` structures have been attempted since the last call.
+        '''
+        if self.callback is not None and self.counts["structures"] - self.lastcallback >= self.every:
+            self.lastcallback = self.counts["structures"]
+            self.callback(self)
+
+    def finish(self):
+        '''
+        Calls the callback one last time, if anything has happened since the last call.
+        '''
+        if self.callback is not None and self.counts["structures"] != self.lastcallback:
+            self.lastcallback = self.counts["structures"]
+            self.callback(self)
+
+    def asdict(self):
+        '''
+        Returns the counters and times as a plain dict (to send between processes or save as JSON).
+        '''
+        return {"counts": dict(self.counts), "times": dict(self.times)}
+
+    def merge(self, other: dict):
+        '''
+        Adds the counters and times of another run to this one.
+        Parameters:
+        Other (dict): The other run (see asdict)
+        '''
+        for name, amount in other["counts"].items():
+            self.counts[name] += amount
+        for stage, seconds in other["times"].items():
+            self.times[stage] += seconds
+
+    def report(self):
+        '''
+        Returns a short report of the run as text.
+        '''
+        counts = self.counts
+        lines = [f'Structures: {counts["structures"]} tried, {counts["accepted"]} accepted']
+        rejected = [f'{counts[name]} {label}' for name, label in [
+            ("templaterejected", "templates failed the filters"), ("pkerrors", "templates couldn't have every multiloop crossed"),
+            ("duplicates", "duplicates"), ("energyrejected", "structures scored above maxenergy"),
+            ("structurerejected", "structures failed the filters")] if counts[name]]
+        if rejected:
+            lines.append(f'Rejected: {", ".join(rejected)}')
+        if counts["templates"]:
+            kept = counts["templates"] - counts["templaterejected"]
+            lines.append(f'Templates per accepted template: {round(counts["templates"]/kept, 3) if kept else "-"}')
+        if counts["pkattempts"]:
+            lines.append(f'Pseudoknot attempts: {counts["pkattempts"]} ({counts["pkuncrossed"]} left a multiloop uncrossed)')
+        total = sum(self.times.values())
+        if total:
+            lines.append("Time per stage: " + ", ".join(
+                f'{stage} {round(seconds, 3)}s ({round(100*seconds/total)}%)' for stage, seconds in self.times.items() if seconds))
+            if counts["accepted"]:
+                lines.append(f'Structures per second: {round(counts["accepted"]/total, 1)}')
+        return "\n".join(lines)
@@ -0,0 +1,178 @@
+import mmap
+import os
+import struct
+import numpy as np
+
+# File layout: a 16 byte header, every structure packed two positions per byte (each starting on a new byte),
+# then the index (count+1 byte offsets and count lengths, all little-endian uint64), then a 24 byte footer.
+MAGIC = b"ETRNPACK"
+VERSION = 1
+HEADER = struct.Struct("<8sH6x")
+FOOTER = struct.Struct("<8sQQ") # magic, count, index offset
+
+# Each position is stored as its index in CHARS, and an odd-length structure is padded with PAD
+CHARS = np.frombuffer(b".()[]{}<>", dtype=np.uint8)
+PAD = 15
+ENCODE = np.full(256, 255, dtype=np.uint8)
+ENCODE[CHARS] = np.arange(len(CHARS), dtype=np.uint8)
+DECODE = np.zeros(16, dtype=np.uint8)
+DECODE[:len(CHARS)] = CHARS
+
+def packstructure(structure: str):
+    '''
+    Packs a dot-bracket structure into bytes, two positions per byte.
+    Parameters:
+    Structure (string): The given structure
+    '''
+    codes = ENCODE[np.frombuffer(structure.encode(), dtype=np.uint8)]
+    if (codes == 255).any():
+        raise ValueError(f'Structures can only hold the characters {CHARS.tobytes().decode()}')
+    if len(codes) % 2:
+        codes = np.append(codes, np.uint8(PAD))
+    return ((codes[0::2] << 4) | codes[1::2]).tobytes()
+
+def unpackcodes(data, length: int):
+    '''
+    Unpacks packed bytes back into an array of position codes (indexes into CHARS).
+    Parameters:
+    Data (bytes-like): The packed bytes
+    Length (integer): The number of positions
+    '''
+    packed = np.frombuffer(data, dtype=np.uint8)
+    codes = np.empty(len(packed) * 2, dtype=np.uint8)
+    codes[0::2] = packed >> 4
+    codes[1::2] = packed & 15
+    return codes[:length]
+
+class PackedWriter:
+    '''
+    Streams structures into a packed file. The index is written when the writer is closed.
+    Use it as a context manager, or call close() when done.
+    Parameters:
+    Path (string): The file to write to
+    Mode (string): "w" to overwrite, "a" to add to the end of an existing packed file
+    '''
+    def __init__(self, path: str, mode="w"):
+        if mode not in ("a", "w"):
+            raise ValueError('mode must be "a" or "w"')
+        self.offsets = []
+        self.lengths = []
+        if mode == "a" and os.path.exists(path) and os.path.getsize(path) > 0:
+            # Load the existing index, then cut it off so new structures go after the old ones
+            with PackedReader(path) as reader:
+                self.offsets = reader.offsets[:-1].tolist()
+                self.lengths = reader.lengths.tolist()
+                end = int(reader.offsets[-1])
+            self.handle = open(path, "r+b")
+            self.handle.truncate(end)
+            self.handle.seek(end)
+        else:
+            self.handle = open(path, "wb")
+            self.handle.write(HEADER.pack(MAGIC, VERSION))
+        self.position = self.handle.tell()
+        self.count = 0
+
+    def write(self, record):
+        '''
+        Writes one structure.
+        Parameters:
+        Record (dict/string): The record from generator.generate_structure, or just a structure
+        '''
+        structure = record["structure"] if type(record) == dict else record
+        data = packstructure(structure)
+        self.offsets.append(self.position)
+        self.lengths.append(len(structure))
+        self.handle.write(data)
+        self.position += len(data)
+        self.count += 1
+
+    def writeall(self, records):
+        '''
+        Writes every record from an iterable, and returns how many were written.
+        Parameters:
+        Records (iterable): The records (or structures) to write
+        '''
+        start = self.count
+        for record in records:
+            self.write(record)
+        return self.count - start
+
+    def close(self):
+        '''
+        Writes the index and footer and closes the file.
+        '''
+        indexoffset = self.position
+        self.handle.write(np.array(self.offsets + [self.position], dtype="<u8").tobytes())
+        self.handle.write(np.array(self.lengths, dtype="<u8").tobytes())
+        self.handle.write(FOOTER.pack(MAGIC, len(self.lengths), indexoffset))
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PackedReader:
+    '''
+    Reads a packed file through mmap, so only the parts that get used are loaded.
+    reader[i] gives structure i as a string, iterating gives every structure in order, and codes(i) / packed(i)
+    give it as position codes or as the raw packed bytes (a view into the file, without copying).
+    Parameters:
+    Path (string): The file to read
+    '''
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size + FOOTER.size or self.map[:8] != MAGIC:
+            raise ValueError(f'{path} is not a packed structure file')
+        magic, count, indexoffset = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f'{path} has no index (was the writer closed?)')
+        self.offsets = np.frombuffer(self.map, dtype="<u8", count=count + 1, offset=indexoffset)
+        self.lengths = np.frombuffer(self.map, dtype="<u8", count=count, offset=indexoffset + 8 * (count + 1))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def packed(self, i: int):
+        '''
+        Returns structure i as its packed bytes, as a memoryview into the file.
+        Parameters:
+        I (integer): The index of the structure
+        '''
+        return memoryview(self.map)[int(self.offsets[i]):int(self.offsets[i+1])]
+
+    def codes(self, i: int):
+        '''
+        Returns structure i as an array of position codes (indexes into CHARS).
+        Parameters:
+        I (integer): The index of the structure
+        '''
+        return unpackcodes(self.packed(i), int(self.lengths[i]))
+
+    def __getitem__(self, i: int):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("structure index out of range")
+        return DECODE[self.codes(i)].tobytes().decode()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        '''
+        Closes the file.
+        '''
+        # The index arrays are views into the map, so they have to go first
+        self.offsets = self.lengths = None
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
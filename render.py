@@ -0,0 +1,110 @@
+import importlib.util
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Image formats matplotlib can save drawings as
+FORMATS = ["svg", "png"]
+
+def renderstructure(structure: str, path: str, sequence=None):
+    '''
+    Draws a structure with draw_rna and saves it to an image file, without opening a window. Returns the path.
+    draw_rna and matplotlib are only imported here, so nothing else pays for them.
+    Parameters:
+    Structure (string): The dot-bracket structure (pseudoknots work too)
+    Path (string): The file to save to, the format comes from its extension (see FORMATS)
+    Sequence (string): The sequence to draw it with, None for all "A"s
+    '''
+    if sequence is None:
+        sequence = "A" * len(structure)
+    if len(sequence) != len(structure):
+        raise ValueError(f'The sequence is {len(sequence)} bases long but the structure is {len(structure)}')
+    import matplotlib
+    # Draw offscreen, so nothing waits for a window to be closed
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from draw_rna.ipynb_draw import draw_struct
+    fig, ax = plt.subplots()
+    try:
+        draw_struct(sequence, structure, ax=ax)
+        fig.savefig(path, bbox_inches="tight")
+    finally:
+        plt.close(fig)
+    return path
+
+def templatestructure(template: list):
+    '''
+    Turns a template into a structure that can be drawn, with stacks as two base pairs, internal loops as one pair of
+    unpaired bases and hairpins as tetraloops.
+    Parameters:
+    Template (list): The given template
+    '''
+    return "".join(template).translate(str.maketrans({"(": "((.", ")": ".))", "*": ".."}))
+
+class RenderPool:
+    '''
+    Renders structures to image files on a pool of background processes, so generation carries on while they draw.
+    Use it as a context manager, or call close() when done.
+    Parameters:
+    Outdir (string): The directory to save images in (created if it doesn't exist)
+    Fmt (string): The image format (see FORMATS)
+    Workers (integer): The number of processes to render with
+    Maxqueued (integer): The most images that can be waiting at once, after which submit waits for the oldest
+    '''
+    def __init__(self, outdir="renders", fmt="svg", workers=1, maxqueued=1000):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown image format "{fmt}", use one of: {", ".join(FORMATS)}')
+        if importlib.util.find_spec("draw_rna") is None or importlib.util.find_spec("matplotlib") is None:
+            raise ImportError("Rendering needs draw_rna and matplotlib (pip install draw_rna)")
+        os.makedirs(outdir, exist_ok=True)
+        self.outdir = outdir
+        self.fmt = fmt
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.futures = deque()
+        self.maxqueued = maxqueued
+        self.count = 0
+
+    def submit(self, structure: str, name=None, sequence=None):
+        '''
+        Queues a structure to be drawn, and returns the path its image will be saved to.
+        Parameters:
+        Structure (string): The dot-bracket structure
+        Name (string): The file name (without extension), None to number them
+        Sequence (string): The sequence to draw it with, None for all "A"s
+        '''
+        if name is None:
+            name = f'structure_{self.count}'
+        self.count += 1
+        path = os.path.join(self.outdir, f'{name}.{self.fmt}')
+        self.futures.append(self.pool.submit(renderstructure, structure, path, sequence))
+        # Drop the finished ones (raising if any of them failed), and wait if too many are queued
+        while self.futures and (self.futures[0].done() or len(self.futures) > self.maxqueued):
+            self.futures.popleft().result()
+        return path
+
+    def renderall(self, records):
+        '''
+        Queues every record from an iterable to be drawn, yielding each one straight back so it can be written out.
+        Parameters:
+        Records (iterable): The records from generator.generate_batch or generate_parallel
+        '''
+        for record in records:
+            self.submit(record["structure"])
+            yield record
+
+    def close(self):
+        '''
+        Waits for every queued image to be saved, then shuts down the pool. Raises the first error a render hit.
+        '''
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.pool.shutdown()
+            self.futures = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
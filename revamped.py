@@ -1,16 +1,12 @@
-import stackfuncs
-import helpers
+import argparse
 import random
-from draw_rna.ipynb_draw import draw_struct
-
-# Runtime variables (don't touch)
-generationContinueFlag = tempContinueFlag = stopFlag = pkcontinueflag = False
-looplist = []
-stack = []
-pairslist = []
-pseudoknotpairs = []
-crossedmultis = 0
-nummultis = 0
+import sys
+import dedup
+import export
+import generator
+import instrument
+import packed
+import render
 
 # Template Generation
 tempchances = [0.85, 0.45]
@@ -18,6 +14,10 @@ temprange = [18,22]
 bias = 0.025
 reroll_chance = 0.25
 user_template = []
+stitchlength = 0
+stitchbranches = [2,4]
+stitchexterior = False
+uniformtemplates = False
 
 # Template Length Assignment
 assigntype = 0
@@ -51,256 +51,250 @@ maxpksfromhairpin = 2
 maxpkgenatt = 1000
 crossedmultiloops = False
 
+# Acceptance Filters
+templatefilters = {}
+filters = {}
+maxenergy = None
+
 # Other
 debug = False
 visualize_template = True
 visualize_structure = True
+render_dir = "renders"
+render_format = "svg"
 template_stats = True
 full_stats = True
 export_file = "structure_export.txt"
 write_or_append = "a"
 seed = None
 
-# Intro
-if seed is not None:
-    random.seed(seed)
-print("-------RNA secondary structure generator by Calc4me-------")
-print("Read introduction.md and README.md if you haven't already!")
-print("")
 
-# Main Loop
-while not stopFlag:
-    # Reset vars
-    tempContinueFlag = False
-    generationContinueFlag = False
-    template = user_template.copy()
-    # Generate template list, first check if there is no user-made template
-    if len(template) < 1:
-        # While the user is unsatisfied
-        while not tempContinueFlag:
-            while True:
-                template = ["("]
-                nummultis = len(stackfuncs.generatetemp(template, tempchances, bias, debug=debug, maxlen=temprange[1]*1.5, returnpos=True))
-                if temprange[0] < len("".join(template).replace("*", "")) < temprange[1]:
-                    if debug:
-                        print("Generator:", nummultis)
-                        print("Finder   :", helpers.findmultipositions(template))
-                    break
-            structure = "".join(template)
-            if visualize_template:
-                visualize_temp = "".join(template.copy())
-                visualize_temp = visualize_temp.translate(str.maketrans({"(": "((.", ")": ".))", "*": ".."}))
-                draw_struct("".join(['A']*len(visualize_temp)),visualize_temp)
-            if template_stats:
-                fulltemplatestats = {
-                    "Length": len(structure.replace("*", "")),
-                    "Hairpins": structure.count("*"),
-                    "Stacks": structure.count("("),
-                    "Multiloops": nummultis,
-                    
-                }
-            print(f'Is {structure} acceptable?')
-            if full_stats:
-                print(f'Length: {fulltemplatestats["Length"]}, Hairpins: {fulltemplatestats["Hairpins"]}')
-                print(f'Stacks: {fulltemplatestats["Stacks"]}, Multiloops: {fulltemplatestats["Multiloops"]}')
-            answer = input("(Y/N) ")
-            # If it is acceptable, continue
-            if answer.lower() == "y": 
-                print("Continuing to loop and stack generation. \n")
-                tempContinueFlag = True
-            else: tempContinueFlag = False
-
-    # If the user is unsatisfied with the stacks and loops added
-    while not generationContinueFlag:
-        # Clear detritus in the vars
-        looplist.clear()
-        stack.clear()
-        pairslist.clear()
-        # Generate template to modify
-        working_template = template.copy()
+# Collect the parameters above for the generator (checked once, here)
+params = generator.makeparams({name: globals()[name] for name in generator.DEFAULTPARAMS})
+# How many templates in a row can fail the filters in interactive mode before asking whether to keep trying
+MAXREJECTIONS = 10000
+# How many structures (or re-rolls) in a row can fail the filters before giving up on the template (or the re-roll)
+MAXRETRIES = 100
 
-        # Insert loops:
-        for pos in range(len(working_template) - 1):
-            # If pos and pos+1 in the template are both stacks
-            if working_template[pos] in "()" and working_template[pos + 1] in "()":
-                # Add an internal loop to the looplist
-                looplist.append("." * random.randint(looprange[0], looprange[1]))
-            else:
-                # Otherwise, add no loop
-                looplist.append("")
-        # Add 1 more no loop so template and looplist are the same size so zip(template,looplist) works.
-        looplist.append("")
-        working_template = [item for pair in zip(working_template, looplist) for item in pair]
+def printtemplatestats(stats: dict):
+    '''
+    Prints the stats of a template.
+    Parameters:
+    Stats (dict): The template stats
+    '''
+    print(f'Length: {stats["Length"]}, Hairpins: {stats["Hairpins"]}')
+    print(f'Stacks: {stats["Stacks"]}, Multiloops: {stats["Multiloops"]}')
 
-        # Insert pseudoknots
-        if pseudoknots and working_template.count("*") >= 2:
-            backup_temp = working_template.copy()
-            pkcontinueflag = False
-            while not pkcontinueflag:
-                working_template = backup_temp.copy()
-                # Clear between tries
-                pseudoknotpairs.clear()
-                attemptcount = 0
-                # 
-                hairpincounts = [0] * working_template.count("*")
-                hairpins = [""] * working_template.count("*")
-                if assigntype == 2:
-                    # Generate lengths for option 2
-                    pklengths = list(range(lengthrange[0], lengthrange[1]+1))
-                while len(pseudoknotpairs) < numpseudoknots and attemptcount < maxpkgenatt:
-                    candidatepair = sorted([
-                                        random.randint(0, working_template.count("*") - 1),
-                                        random.randint(0, working_template.count("*") - 1)])
-                    attemptcount += 1
-                    if 0 != abs(candidatepair[1]-candidatepair[0]) <= hairpinmaxdiff and (candidatepair not in pseudoknotpairs) and (
-                        hairpincounts[candidatepair[0]] < maxpksfromhairpin and hairpincounts[candidatepair[1]] < maxpksfromhairpin): 
-                            pseudoknotpairs.append(candidatepair)
-                            hairpincounts[candidatepair[0]] += 1
-                            hairpincounts[candidatepair[1]] += 1
-                for i in range(len(pseudoknotpairs)):
-                    if assigntype == 0:
-                        pksize = max(pkminsize, round(random.gauss(pkmean, pkstdev)))
-                    elif assigntype == 1:
-                        pksize = max(pkminsize, random.randint(pklengthrange[0], pklengthrange[1]))
-                    elif assigntype == 2:
-                        pksize = max(pkminsize, random.choices(pklengths, weights=pkprobabilities, k=1)[0])
-                    pseudoknotpairs[i].append(pksize)
-                    pseudoknotpairs[i].append([random.randint(surroundrange[0], surroundrange[1]),random.randint(surroundrange[0], surroundrange[1])])
-                    pseudoknotpairs[i].append([random.randint(surroundrange[0], surroundrange[1]),random.randint(surroundrange[0], surroundrange[1])])
-                # Now the format for each one is [hairpin 1 loc, hairpin 2 loc, size, [ldots, rdots], [ldots, rdots]]
-                parenthmod = 0
-                parenth = [
-                    ("[", "]"),
-                    ("{", "}"),
-                    ("<", ">"),
-                ]
-                for i in range(len(pseudoknotpairs)):
-                    hairpins[pseudoknotpairs[i][0]] += "." * pseudoknotpairs[i][3][0] + parenth[parenthmod][0] * pseudoknotpairs[i][2] + "." * pseudoknotpairs[i][3][1]
-                    hairpins[pseudoknotpairs[i][1]] += "." * pseudoknotpairs[i][4][0] + parenth[parenthmod][1] * pseudoknotpairs[i][2] + "." * pseudoknotpairs[i][4][1]
-                    parenthmod = (parenthmod + 1) % 3            
-                count = 0
-                for pos, char in enumerate(working_template):
-                    if char == "*":
-                        if len(hairpins[count]) > 1:
-                            working_template[pos] = hairpins[count].replace("*", "")
-                        count += 1
-                # Check for validity
-                crossedmultis = 0
-                if crossedmultiloops:
-                    affectedstacks = helpers.findbasesinpks(working_template)
-                    stackstocheck = helpers.findmultipositions(working_template)
-                    if debug:
-                        print(f'Working template: {working_template}')
-                        print(f'Affected stacks: {affectedstacks}')
-                        print(f'Stacks to check: {stackstocheck}')
-                    for multiloop in stackstocheck:
-                        if sum(affectedstacks[pos] for pos in multiloop) != 0:
-                            if debug:
-                                print("MULTILOOP WAS FOUND WITH CROSSING PK")
-                            crossedmultis += 1
-                        elif debug:
-                            print("MULTILOOP WAS FOUND WITHOUT CROSSING PK")
-                    if crossedmultis != len(stackstocheck):
-                        pkcontinueflag = False
-                    else:
-                        pkcontinueflag = True
-                else:
-                    pkcontinueflag = True
-                            
+def printstructurestats(stats: dict):
+    '''
+    Prints the stats of a finished structure.
+    Parameters:
+    Stats (dict): The structure stats
+    '''
+    print(f'Stats: \nLength: {stats["Length"]}, Base Pairs: {stats["Base Pairs"]}')
+    print(f'Unpaired Bases: {stats["Unpaired Bases"]}, Average Stack Length: {stats["Average Stack Length"]}')
+    print(f'Smallest & Largest Stack: {stats["Smallest Stack"]}, {stats["Largest Stack"]}')
+    print(f'Hairpins: {stats["Hairpins"]}, Largest Hairpin: {stats["Largest Hairpin"]}')
+    print(f'Internal Loops: {stats["Internal Loops"]}, Bulges: {stats["Bulges"]}')
+    print(f'Pseudoknots: {stats["Pseudoknots"]}, Pseudoknot Density: {stats["Pseudoknot Density"]}')
+    print(f'Pair Density: {stats["Pair Density"]}, Proportion Involved in Pseudoknots: {stats["Percent Involved"]}')
+    print(f'Multiloops: {stats["Multiloops"]}, Proportion of Crossed Multiloops: {stats["Crossed Multiloop Proportion"]}')
 
-            print(f'Generated {len(pseudoknotpairs)}/{numpseudoknots} psuedoknots\n')
-        # Assign length values to them and generate stacks:
-        # Find all the stacks and their pairs and add them to a list
-        for pos, char in enumerate(working_template):
-            if char == "(":
-                stack.append(pos)
-            elif char == ")":
-                if not stack:
-                    raise ValueError("Unbalanced template")
-                open_pos = stack.pop()
-                pairslist.append([open_pos, pos])
-        # Sort the list by the first position
-        pairslist.sort(key=lambda pair: pair[0])
-        if debug:
-            print(pairslist)
+def interactive():
+    '''
+    Runs the interactive generator, asking whether each template and structure is acceptable.
+    '''
+    rng = random.Random(seed)
+    # Drawings are saved in the background, so they never hold up generation
+    renderer = render.RenderPool(render_dir, render_format) if visualize_template or visualize_structure else None
+    print("-------RNA secondary structure generator by Calc4me-------")
+    print("Read introduction.md and README.md if you haven't already!")
+    print("")
 
-        # For full stats
-        bulgecount = 0
-        stacklengths = []
-        hairpinsizes = []
+    stopFlag = False
+    while not stopFlag:
+        tempContinueFlag = False
+        generationContinueFlag = False
+        template = list(params["user_template"])
+        nummultis = None
+        # Generate template list, first check if there is no user-made template
+        if len(template) < 1:
+            rejected = 0
+            # While the user is unsatisfied
+            while not tempContinueFlag:
+                template, nummultis = generator.maketemplate(params, rng)
+                # Skip templates that can't pass the filters, and say so if the filters look impossible to meet
+                if not generator.checktemplate(params, generator.templatestats(template, nummultis)):
+                    rejected += 1
+                    if rejected % MAXREJECTIONS == 0:
+                        print(f'{rejected} templates in a row failed the filters, they might be impossible to meet (check templatefilters and filters).')
+                        if input("Keep trying? (Y/N) ").lower() != "y":
+                            print("\nBye! :)")
+                            if renderer is not None:
+                                renderer.close()
+                            return
+                    continue
+                if rejected:
+                    print(f'Skipped {rejected} template(s) that failed the filters.')
+                    rejected = 0
+                structure = "".join(template)
+                if visualize_template:
+                    print(f'Drawing it to {renderer.submit(render.templatestructure(template), f"template_{renderer.count}")}')
+                print(f'Is {structure} acceptable?')
+                if template_stats:
+                    printtemplatestats(generator.templatestats(template, nummultis))
+                answer = input("(Y/N) ")
+                # If it is acceptable, continue
+                if answer.lower() == "y":
+                    print("Continuing to loop and stack generation. \n")
+                    tempContinueFlag = True
 
-        if assigntype == 2:
-            # Generate lengths for option 2
-            lengths = list(range(lengthrange[0], lengthrange[1]+1))
-        for i in range(len(pairslist)):
-            # Normally distribute the stack sizes
-            if assigntype == 0:
-                stacksize = max(min_stack_size, round(random.gauss(mean, stdev)))
-            elif assigntype == 1:
-                stacksize = max(min_stack_size, random.randint(lengthrange[0], lengthrange[1]))
-            elif assigntype == 2:
-                stacksize = max(min_stack_size, random.choices(lengths, weights=probabilities, k=1)[0])
-            stacklengths.append(stacksize)
-            # Generate the stack and replate the template (s and )s with it
-            stacktoinsert = stackfuncs.convertstack(stacksize,conversionvars["dotratio"],conversionvars["onechance"],conversionvars["twochance"],conversionvars["maxcountdiff"],conversionvars["maxposdiff"],conversionvars["maxonesideposdiff"])
-            working_template[pairslist[i][0]] = stacktoinsert[1]
-            working_template[pairslist[i][1]] = stacktoinsert[2]
-            bulgecount += stacktoinsert[3]
-            # If it's a hairpin, add that too
-            if (pairslist[i][0] + 2 < len(working_template)
-                and working_template[pairslist[i][0]+2] == "*"):
-                working_template[pairslist[i][0]+2] = "." * random.randint(conversionvars["minloopdots"],conversionvars["maxloopdots"])
-                hairpinsizes.append(len(working_template[pairslist[i][0]+2]))
-        if debug:
-            print(working_template)
-        # Query
-        structure = "".join(working_template)
-        if visualize_structure:
-                draw_struct("".join(['A']*len(structure)),structure)
+        # If the user is unsatisfied with the stacks and loops added
+        record = None
+        rerolling = False
+        failed = 0
+        while not generationContinueFlag:
+            if rerolling:
+                # Only redraw some of the stacks, loops and hairpins (each with reroll_chance)
+                rerolled = generator.reroll(record, params, rng)
+                if rerolled is None:
+                    failed += 1
+                    if failed == 1:
+                        print("That structure didn't pass the filters, trying again.")
+                    if failed >= MAXRETRIES:
+                        print(f'{failed} re-rolls in a row failed the filters, making a whole new structure instead.')
+                        rerolling = False
+                        failed = 0
+                    continue
+                record = rerolled
+            else:
+                try:
+                    record = generator.generate_structure(params, rng, template=template, nummultis=nummultis, elements=True)
+                except generator.PseudoknotError as error:
+                    # The pseudoknot settings can't work with this template
+                    print(f'{error}, try another template.\n')
+                    break
+                if record is None:
+                    failed += 1
+                    if failed == 1:
+                        print("That structure didn't pass the filters, trying again.")
+                    if failed >= MAXRETRIES:
+                        print(f'{failed} structures in a row failed the filters, try another template.\n')
+                        break
+                    continue
+            failed = 0
+            structure = record["structure"]
+            if params["pseudoknots"] and template.count("*") >= 2:
+                print(f'Generated {len(record["pseudoknots"])}/{params["numpseudoknots"]} psuedoknots\n')
+            if visualize_structure:
+                print(f'Drawing it to {renderer.submit(structure)}')
+            print(f'Is {structure} acceptable?')
+            if full_stats:
+                printstructurestats(record["stats"])
+            answer = input("(Y/N, or R to only re-roll part of it) ")
+            rerolling = answer.lower() == "r"
+            # If it is acceptable, stop generation
+            if answer.lower() == "y":
+                print("")
+                generationContinueFlag = True
+                if export_file != "":
+                    with open(export_file, write_or_append) as f:
+                        f.write("\n" + structure)
 
-        # Stats
-        if hairpinsizes == []: hairpinsizes.append(0)
-        structurestats = {
-            "Length": len(structure),
-            "Base Pairs": structure.count("(")+structure.count("<")+structure.count("{")+structure.count("["),
-            "Unpaired Bases": len(structure)-(2*(structure.count("(")+structure.count("<")+structure.count("{")+structure.count("["))),
-            "Average Stack Length": round(sum(stacklengths)/len(stacklengths), 3),
-            "Largest Stack": max(stacklengths),
-            "Smallest Stack": min(stacklengths),
-            "Hairpins": (structure.replace(".","")).count("()"),
-            "Largest Hairpin": max(hairpinsizes),
-            "Internal Loops": len("".join(template).replace("*", ""))-template.count("*")-"".join(template).count(")(")-2*fulltemplatestats["Multiloops"]-1,
-            "Bulges": bulgecount,
-            "Pair Density": round((structure.count("(")+structure.count("<")+structure.count("{")+structure.count("["))*2/len(structure),3),
-            "Pseudoknot Density": round((structure.count("[")+structure.count("{")+structure.count("<"))*2/len(structure),3),
-            "Pseudoknots": len(pseudoknotpairs),
-            "Percent Involved": round(helpers.findbasesinpks(structure).count(1)/len(structure),3),
-            "Crossed Multiloop Proportion": round(crossedmultis/nummultis,3),
-            "Multiloops": fulltemplatestats["Multiloops"]
-        } 
-        print(f'Is {structure} acceptable?')
-        if full_stats:
-            print(f'Stats: \nLength: {structurestats["Length"]}, Base Pairs: {structurestats["Base Pairs"]}')
-            print(f'Unpaired Bases: {structurestats["Unpaired Bases"]}, Average Stack Length: {structurestats["Average Stack Length"]}')
-            print(f'Smallest & Largest Stack: {structurestats["Smallest Stack"]}, {structurestats["Largest Stack"]}')
-            print(f'Hairpins: {structurestats["Hairpins"]}, Largest Hairpin: {structurestats["Largest Hairpin"]}')
-            print(f'Internal Loops: {structurestats["Internal Loops"]}, Bulges: {structurestats["Bulges"]}')
-            print(f'Pseudoknots: {structurestats["Pseudoknots"]}, Pseudoknot Density: {structurestats["Pseudoknot Density"]}')
-            print(f'Pair Density: {structurestats["Pair Density"]}, Proportion Involved in Pseudoknots: {structurestats["Percent Involved"]}')
-            print(f'Multiloops: {structurestats["Multiloops"]}, Proportion of Crossed Multiloops: {structurestats["Crossed Multiloop Proportion"]}')
-        answer = input("(Y/N) ")
-        # If it is acceptable, stop generation
+        # If the user wants to stop, stop, otherwise go to start
+        answer = input(f'Stop? (y/n) ')
         if answer.lower() == "y":
-            print("")
-            generationContinueFlag = True
-            if export_file != "":
-                with open(export_file, write_or_append) as f:
-                    f.write("\n" + structure)
-        else: generationContinueFlag = False
-    
-    # If the user wants to stop, stop, otherwise go to start
-    answer = input(f'Stop? (y/n) ')
-    if answer.lower() == "y":
-        print("\nBye! :)")
-        stopFlag = True
-    else: print("")
\ No newline at end of file
+            print("\nBye! :)")
+            stopFlag = True
+            if renderer is not None:
+                renderer.close()
+        else: print("")
+
+def headless(count: int, batchseed=None, output="-", workers=1, batchsize=1000, fmt="plain", compress=None, flushevery=10000, unique=False, indexpath=None, maxattempts=None, report=False, renderdir=None, renderformat="svg", renderworkers=1):
+    '''
+    Generates structures without prompts or visualization and streams them to one file.
+    Parameters:
+    Count (integer): The number of structures to generate
+    Batchseed (integer): The seed for the batch, None for a random one
+    Output (string): The file to write to, "-" for stdout
+    Workers (integer): The number of processes to generate with, 1 to generate in this process
+    Batchsize (integer): The number of structures each process generates at a time
+    Fmt (string): The output format, "plain", "jsonl", "fasta" or "packed"
+    Compress (Boolean): Gzip the output, None to gzip only if the output ends in .gz
+    Flushevery (integer): Flush the output after this many structures
+    Unique (Boolean): Skip structures already generated in this run
+    Indexpath (string): A dedup index file to skip structures from earlier runs too (and to add this run's to), None for none
+    Maxattempts (integer): Give up after generating this many structures (accepted or not), None to keep going
+    Report (Boolean): Print counts and times for every stage when done
+    Renderdir (string): Also draw every structure into this directory (in the background), None to not draw them
+    Renderformat (string): The image format, "svg" or "png"
+    Renderworkers (integer): The number of processes to draw with
+    '''
+    if batchseed is None:
+        # Pick the seed here so it can be recorded with the structures
+        batchseed = random.SystemRandom().getrandbits(64)
+    seen = None
+    if indexpath is not None:
+        seen = dedup.HashIndex(indexpath)
+    elif unique:
+        seen = dedup.SeenSet()
+    metrics = instrument.Metrics() if report else None
+    if workers == 1:
+        records = generator.generate_batch(params, count, seed=batchseed, dedup=seen, maxattempts=maxattempts, metrics=metrics)
+    else:
+        records = generator.generate_parallel(params, count, seed=batchseed, workers=workers, batchsize=batchsize, dedup=seen, maxattempts=maxattempts, metrics=metrics)
+    renderer = None
+    if renderdir is not None:
+        renderer = render.RenderPool(renderdir, renderformat, renderworkers)
+        records = renderer.renderall(records)
+    if fmt == "packed":
+        if output == "-":
+            raise ValueError("The packed format needs an output file")
+        writer = packed.PackedWriter(output, write_or_append)
+    else:
+        writer = export.StructureWriter(output, fmt, write_or_append, compress=compress, paramhash=generator.paramhash(params), seed=batchseed, flushevery=flushevery)
+    with writer:
+        written = writer.writeall(records)
+    if written < count:
+        print(f'Only {written}/{count} structures were accepted in {maxattempts} attempts', file=sys.stderr)
+    if renderer is not None:
+        renderer.close()
+    if seen is not None:
+        seen.close()
+    if metrics is not None:
+        print(metrics.report(), file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RNA secondary structure generator by Calc4me")
+    parser.add_argument("-p", "--params", default=None, help="JSON or TOML preset to generate with, instead of the parameters above")
+    parser.add_argument("-n", "--count", type=int, default=None, help="Generate this many structures without any prompts")
+    parser.add_argument("-s", "--seed", type=int, default=seed, help="Seed for the run (overrides seed)")
+    parser.add_argument("-o", "--output", default="-", help="File to stream structures to in headless mode, - for stdout")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Number of processes to generate with in headless mode, 0 for one per CPU")
+    parser.add_argument("-b", "--batch-size", type=int, default=1000, help="Structures per process batch when using more than one worker")
+    parser.add_argument("-f", "--format", default="plain", choices=sorted(export.FORMATS) + ["packed"], help="Output format in headless mode")
+    parser.add_argument("-z", "--gzip", action="store_true", default=None, help="Gzip the output (on by default for .gz files)")
+    parser.add_argument("--flush-every", type=int, default=10000, help="Flush the output after this many structures")
+    parser.add_argument("-u", "--unique", action="store_true", help="Skip structures already generated in this run")
+    parser.add_argument("--dedup-index", default=None, help="Dedup index file, to also skip structures from earlier runs (implies -u)")
+    parser.add_argument("-m", "--max-attempts", type=int, default=None, help="Give up after generating this many structures, counting rejected ones")
+    parser.add_argument("--report", action="store_true", help="Print counts and times for every stage when done")
+    parser.add_argument("--render", default=None, help="Also draw every structure into this directory, in the background")
+    parser.add_argument("--render-format", default="svg", choices=render.FORMATS, help="Image format for --render")
+    parser.add_argument("--render-workers", type=int, default=1, help="Number of processes to draw with")
+    parser.add_argument("--regenerate", type=int, default=None, help="Make structure ATTEMPT of the run with seed -s again and print it as jsonl")
+    args = parser.parse_args()
+    if args.params is not None:
+        params = generator.loadparams(args.params)
+    if args.regenerate is not None:
+        if args.seed is None:
+            sys.exit("--regenerate needs the run's seed (-s)")
+        record = generator.regenerate(params, args.seed, args.regenerate)
+        if record is None:
+            sys.exit(f'Attempt {args.regenerate} of that run was rejected')
+        sys.stdout.write(export.formatjsonl(record, args.regenerate, {"paramhash": generator.paramhash(params), "seed": args.seed}))
+    elif args.count is None:
+        seed = args.seed
+        interactive()
+    else:
+        headless(args.count, args.seed, args.output, args.workers, args.batch_size, args.format, args.gzip, args.flush_every, args.unique, args.dedup_index, args.max_attempts, args.report, args.render, args.render_format, args.render_workers)
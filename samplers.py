@@ -0,0 +1,108 @@
+class AliasSampler:
+    '''
+    Draws from a fixed discrete distribution in constant time with Vose's alias method, using one rng.random() per draw.
+    Parameters:
+    Values (list): The values to draw from
+    Weights (list): The weight of each value (they don't need to add up to 1)
+    '''
+    __slots__ = ("values", "prob", "alias", "n")
+
+    def __init__(self, values: list, weights: list):
+        if len(values) != len(weights):
+            raise ValueError(f'{len(values)} values but {len(weights)} weights')
+        if not values:
+            raise ValueError("There has to be at least one value to draw from")
+        if any(weight < 0 for weight in weights):
+            raise ValueError("Weights can't be negative")
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError("At least one weight has to be above 0")
+        n = len(values)
+        scaled = [weight * n / total for weight in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        # Pair every underfull column with an overfull one that tops it up
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # Anything left over is full (up to rounding)
+        self.values = tuple(values)
+        self.prob = tuple(prob)
+        self.alias = tuple(alias)
+        self.n = n
+
+    def draw(self, rng):
+        '''
+        Draws one value.
+        Parameters:
+        Rng (random.Random): The random number generator to draw from
+        '''
+        # The whole part of the uniform picks a column, and the fractional part picks it or its alias
+        x = rng.random() * self.n
+        i = int(x)
+        return self.values[i] if x - i < self.prob[i] else self.values[self.alias[i]]
+
+class GaussSampler:
+    '''
+    Draws rounded normally distributed integers, no smaller than a minimum.
+    Parameters:
+    Mean, Stdev (float): The normal distribution to use
+    Minimum (integer): The smallest value to return
+    '''
+    __slots__ = ("mean", "stdev", "minimum")
+
+    def __init__(self, mean: float, stdev: float, minimum: int):
+        if stdev < 0:
+            raise ValueError("stdev can't be negative")
+        self.mean = mean
+        self.stdev = stdev
+        self.minimum = minimum
+
+    def draw(self, rng):
+        '''
+        Draws one value.
+        Parameters:
+        Rng (random.Random): The random number generator to draw from
+        '''
+        return max(self.minimum, round(rng.gauss(self.mean, self.stdev)))
+
+def uniformsampler(low: int, high: int, minimum=None):
+    '''
+    Returns an AliasSampler for the integers from low to high (inclusive), each raised to minimum if it's below it.
+    Parameters:
+    Low, High (integer): The range to draw from
+    Minimum (integer): The smallest value to return, None for no minimum
+    '''
+    if low > high:
+        raise ValueError(f'The range [{low}, {high}] is empty')
+    values = list(range(low, high + 1))
+    if minimum is not None:
+        values = [max(minimum, value) for value in values]
+    return AliasSampler(values, [1] * len(values))
+
+def lengthsampler(assigntype: int, mean: float, stdev: float, lengthrange: list, probabilities: list, minsize: int):
+    '''
+    Compiles a length distribution (see generator.drawlength) into a sampler.
+    Parameters:
+    Assigntype (integer): 0 -> Normally distributed, 1 -> Uniformly distributed, 2 -> User-made probabilites
+    Mean, Stdev (float): The normal distribution to use (option 0)
+    Lengthrange (list): The range of lengths (option 1+2)
+    Probabilities (list): The probability of each length in lengthrange (option 2)
+    Minsize (integer): The minimum length
+    '''
+    if assigntype == 0:
+        return GaussSampler(mean, stdev, minsize)
+    elif assigntype == 1:
+        return uniformsampler(lengthrange[0], lengthrange[1], minsize)
+    elif assigntype == 2:
+        lengths = range(lengthrange[0], lengthrange[1] + 1)
+        if len(probabilities) != len(lengths):
+            raise ValueError(f'There are {len(lengths)} lengths in {list(lengthrange)} but {len(probabilities)} probabilities')
+        return AliasSampler([max(minsize, length) for length in lengths], probabilities)
+    raise ValueError("assigntype must be 0, 1 or 2")
@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import filters
+import generator
+import stats
+
+class PresetQueue:
+    '''
+    A bounded queue of ready-made structures for one preset, kept full in the background.
+    Structures generated for a waiting request while the queue is full go to a small spare buffer instead of pushing
+    queued ones out, and the spares are dropped once nobody's waiting.
+    Parameters:
+    Name (string): The name of the preset
+    Params (generator.Params): The parameters to generate with
+    Size (integer): The most structures to keep queued
+    Batchsize (integer): The number of structures each refill generates
+    Seed (integer): The seed of the server, the queue's own seed is derived from it and its name
+    '''
+    def __init__(self, name: str, params, size=1000, batchsize=100, seed=0):
+        self.name = name
+        self.params = params
+        self.paramhash = generator.paramhash(params)
+        self.size = size
+        self.batchsize = min(batchsize, size)
+        self.seed = generator.deriveseed(seed, name)
+        self.records = deque()
+        # Structures made for waiting requests that didn't fit in the queue, newest kept
+        self.spare = deque(maxlen=self.batchsize)
+        self.pending = 0 # Structures being generated that already have room saved for them
+        self.changed = asyncio.Condition()
+        self.waiting = 0
+        self.batches = 0
+        self.served = 0
+        self.failures = 0
+        self.error = None
+
+    async def refill(self, pool, workers=1):
+        '''
+        Keeps the queue topped up from a process pool, forever, with up to workers batches being generated at once.
+        A batch is only started once there's room for it (or a request is waiting), so a queue nobody takes from costs nothing.
+        Parameters:
+        Pool (concurrent.futures.Executor): The pool to generate on
+        Workers (integer): The most batches to generate at once
+        '''
+        self.pending = 0
+        tasks = [asyncio.create_task(self.refillbatches(pool)) for _ in range(max(workers, 1))]
+        try:
+            done = (await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION))[0]
+            # They only stop by failing
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def refillbatches(self, pool):
+        '''
+        Generates one batch after another for refill.
+        Parameters:
+        Pool (concurrent.futures.Executor): The pool to generate on
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(self.records) + self.pending + self.batchsize <= self.size or self.waiting)
+                # Without room, the batch is only for the waiting requests and goes to the spares (see add)
+                reserved = self.batchsize if len(self.records) + self.pending + self.batchsize <= self.size else 0
+                self.pending += reserved
+                # Every attempt has its own streams, so any structure served can be made again with generator.regenerate
+                start = self.batches * self.batchsize
+                self.batches += 1
+            try:
+                records = (await loop.run_in_executor(pool, generator.generatechunk, self.params, self.batchsize, self.seed, None, False, start))[0]
+            finally:
+                self.pending -= reserved
+            async with self.changed:
+                self.add(records)
+                self.failures = 0
+                self.changed.notify_all()
+
+    def add(self, records: list):
+        '''
+        Queues new records, as many as there's room for. The rest are kept as spares if a request is waiting
+        (they might be what it's after), and thrown away otherwise. Queued records are never pushed out.
+        Parameters:
+        Records (list): The new records
+        '''
+        room = max(self.size - len(self.records) - self.pending, 0)
+        self.records.extend(records[:room])
+        if self.waiting:
+            self.spare.extend(records[room:])
+
+    def take(self, ranges: dict):
+        '''
+        Removes and returns the oldest queued (or spare) record whose stats are within the ranges, or None if there isn't one.
+        Parameters:
+        Ranges (dict): Stat name -> [minimum, maximum] (see filters.passes)
+        '''
+        for records in (self.records, self.spare):
+            if not ranges:
+                if records:
+                    return records.popleft()
+                continue
+            for i, record in enumerate(records):
+                if filters.passes(record["stats"], ranges):
+                    del records[i]
+                    return record
+        return None
+
+    async def get(self, ranges: dict, timeout: float):
+        '''
+        Returns a record whose stats are within the ranges, waiting for the queue to be refilled if none are queued.
+        Raises a TimeoutError if none turn up in time.
+        Parameters:
+        Ranges (dict): Stat name -> [minimum, maximum] (see filters.passes)
+        Timeout (float): The longest to wait, in seconds
+        '''
+        async with self.changed:
+            record = self.take(ranges)
+            if record is None:
+                deadline = asyncio.get_running_loop().time() + timeout
+                self.waiting += 1
+                self.changed.notify_all()
+                try:
+                    while record is None:
+                        remaining = deadline - asyncio.get_running_loop().time()
+                        if remaining <= 0:
+                            raise TimeoutError
+                        try:
+                            await asyncio.wait_for(self.changed.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            # Before Python 3.11 that isn't the builtin TimeoutError
+                            raise TimeoutError from None
+                        record = self.take(ranges)
+                finally:
+                    self.waiting -= 1
+                    if not self.waiting:
+                        self.spare.clear()
+            self.served += 1
+            # Taking one may have made room for a refill
+            self.changed.notify_all()
+            return record
+
+class StructureServer:
+    '''
+    Serves structures from prefilled queues, one per preset, refilled by a process pool.
+    A request is a dict with "preset" (the name of a preset, "default" if left out), optionally "filters"
+    (stat name -> [minimum, maximum], on top of the preset's own) and "count" (the number of structures, 1 if left out).
+    Parameters:
+    Presets (dict): Preset name -> parameters (dict or generator.Params)
+    Queuesize (integer): The most structures to keep queued per preset
+    Batchsize (integer): The number of structures each refill generates
+    Workers (integer): The number of processes to generate with, None for one per CPU
+    Seed (integer): The seed for the run, None for a random one
+    Timeout (float): The longest a request waits for a structure, in seconds
+    Maxcount (integer): The most structures one request can ask for
+    Retrydelay (float): How long to wait before restarting a preset's refill after it fails, in seconds (doubled for every failure in a row, up to a minute)
+    '''
+    def __init__(self, presets: dict, queuesize=1000, batchsize=100, workers=None, seed=None, timeout=10, maxcount=1000, retrydelay=1):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.presets = {name: generator.makeparams(params) for name, params in presets.items()}
+        self.queuesize = queuesize
+        self.batchsize = batchsize
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+        self.timeout = timeout
+        self.maxcount = maxcount
+        self.retrydelay = retrydelay
+        self.queues = {}
+        self.tasks = {}
+        self.restarts = {}
+        self.refillpools = {}
+        self.pool = None
+
+    async def start(self):
+        '''
+        Starts the process pool and the refills.
+        '''
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        for name, params in self.presets.items():
+            self.queues[name] = PresetQueue(name, params, self.queuesize, self.batchsize, self.seed)
+            self.startrefill(name)
+
+    def startrefill(self, name: str):
+        '''
+        Starts (or restarts) the refill of one preset, watched by refillstopped.
+        Parameters:
+        Name (string): The preset
+        '''
+        self.restarts.pop(name, None)
+        self.refillpools[name] = self.pool
+        task = asyncio.create_task(self.queues[name].refill(self.pool, self.workers))
+        task.add_done_callback(lambda task: self.refillstopped(name, task))
+        self.tasks[name] = task
+
+    def refillstopped(self, name: str, task):
+        '''
+        Called when a refill stops. Refills only stop by being cancelled or failing, so a failure is logged, kept for
+        status, and the refill is restarted after a delay (a new process pool is started if the old one broke).
+        Parameters:
+        Name (string): The preset
+        Task (asyncio.Task): The refill
+        '''
+        if task.cancelled() or self.tasks.get(name) is not task:
+            return
+        error = task.exception()
+        queue = self.queues[name]
+        queue.failures += 1
+        queue.error = repr(error)
+        delay = min(self.retrydelay * 2 ** (queue.failures - 1), 60)
+        print(f'[{time.strftime("%H:%M:%S")}] Refilling "{name}" failed ({queue.error}), retrying in {delay}s', file=sys.stderr)
+        # Only the first refill to notice a broken pool replaces it
+        if isinstance(error, BrokenProcessPool) and self.refillpools.get(name) is self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.restarts[name] = asyncio.get_running_loop().call_later(delay, self.startrefill, name)
+
+    async def stop(self):
+        '''
+        Stops the refills and shuts down the process pool.
+        '''
+        for handle in self.restarts.values():
+            handle.cancel()
+        self.restarts = {}
+        tasks = list(self.tasks.values())
+        self.tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def status(self):
+        '''
+        Returns every preset with its parameter hash, how many structures are queued and how many have been served,
+        and how many times in a row its refill has failed, with the last error (None if it never has).
+        '''
+        return {"presets": {name: {"paramhash": queue.paramhash, "queued": len(queue.records), "size": queue.size,
+                                   "served": queue.served, "failures": queue.failures, "error": queue.error}
+                            for name, queue in self.queues.items()}}
+
+    async def handle(self, request: dict):
+        '''
+        Answers one request (see StructureServer), and returns an HTTP status with a response dict: the record (see
+        generator.generate_structure, without "pseudoknots") plus "preset", "paramhash" and the "seed" and "attempt" to
+        make it again with generator.regenerate, or {"structures": [...]} if more than one was asked for.
+        A bad request gets {"error": message} instead, with 400 (or 404 for an unknown preset), and one that times out
+        gets 503 with the structures found in time as "structures".
+        Parameters:
+        Request (dict): The given request
+        '''
+        name = request.get("preset", "default")
+        if name not in self.queues:
+            return "404 Not Found", {"error": f'Unknown preset "{name}", use one of: {", ".join(self.queues)}'}
+        try:
+            ranges = request.get("filters") or {}
+            filters.checkranges(ranges, stats.STATFIELDS, "filters")
+            count = request.get("count", 1)
+            if not isinstance(count, int) or not 1 <= count <= self.maxcount:
+                raise ValueError(f'count must be between 1 and {self.maxcount}')
+        except (AttributeError, TypeError, ValueError) as error:
+            return "400 Bad Request", {"error": str(error)}
+        queue = self.queues[name]
+        structures = []
+        try:
+            for _ in range(count):
+                record = await queue.get(ranges, self.timeout)
+                structures.append({
+                    "structure": record["structure"],
+                    "stats": record["stats"],
+                    "template": record["template"],
+                    "templatestats": record["templatestats"],
+                    "preset": name,
+                    "paramhash": queue.paramhash,
+                    "seed": queue.seed,
+                    "attempt": record["attempt"],
+                })
+        except TimeoutError:
+            message = f'No structure from "{name}" passed the filters within {self.timeout}s'
+            if queue.failures:
+                message += f' (refilling it is failing: {queue.error})'
+            return "503 Service Unavailable", {"error": message, "structures": structures}
+        return "200 OK", structures[0] if count == 1 else {"structures": structures}
+
+    async def respond(self, line: bytes):
+        '''
+        Answers one request given as JSON, and returns an HTTP status with the response as JSON (see handle).
+        Parameters:
+        Line (bytes): The request
+        '''
+        try:
+            request = json.loads(line) if line.strip() else {}
+        except ValueError:
+            status, response = "400 Bad Request", {"error": "Requests have to be JSON"}
+        else:
+            if isinstance(request, dict):
+                status, response = await self.handle(request)
+            else:
+                status, response = "400 Bad Request", {"error": "Requests have to be JSON objects"}
+        return status, json.dumps(response, separators=(",", ":")).encode()
+
+    async def answer(self, line: bytes):
+        '''
+        Answers one request given as JSON, and returns just the response as JSON (for the line protocol).
+        Parameters:
+        Line (bytes): The request
+        '''
+        return (await self.respond(line))[1]
+
+    async def lineclient(self, reader, writer):
+        '''
+        Serves one Unix socket connection: one JSON request per line in, one JSON response per line out.
+        '''
+        try:
+            while line := await reader.readline():
+                writer.write(await self.answer(line) + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def httpclient(self, reader, writer):
+        '''
+        Serves one HTTP connection (with keep-alive). GET /structure takes the request as query parameters
+        (filters as JSON), POST /structure takes it as a JSON body, and GET /status gives the status.
+        '''
+        try:
+            while line := await reader.readline():
+                parts = line.decode("latin-1").split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                headers = {}
+                while (header := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = header.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                url = urllib.parse.urlsplit(target)
+                status = "200 OK"
+                if url.path == "/status" and method == "GET":
+                    payload = json.dumps(self.status()).encode()
+                elif url.path == "/structure" and method in ("GET", "POST"):
+                    payload = None
+                    if method == "GET":
+                        query = dict(urllib.parse.parse_qsl(url.query))
+                        try:
+                            for key in ("filters", "count"):
+                                if key in query:
+                                    query[key] = json.loads(query[key])
+                        except ValueError:
+                            status, payload = "400 Bad Request", b'{"error":"filters and count have to be JSON"}'
+                        body = json.dumps(query).encode()
+                    if payload is None:
+                        status, payload = await self.respond(body)
+                else:
+                    status, payload = "404 Not Found", b'{"error":"Use /structure or /status"}'
+                keepalive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n'
+                             f'Connection: {"keep-alive" if keepalive else "close"}\r\n\r\n'.encode() + payload)
+                await writer.drain()
+                if not keepalive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socketpath=None, host="127.0.0.1", port=None):
+        '''
+        Starts everything and serves until cancelled, on a Unix socket or over local HTTP.
+        Parameters:
+        Socketpath (string): The Unix socket to listen on (newline-delimited JSON)
+        Host (string): The address to serve HTTP on
+        Port (integer): The port to serve HTTP on, if there's no socketpath
+        '''
+        await self.start()
+        try:
+            if socketpath is not None:
+                if os.path.exists(socketpath):
+                    os.remove(socketpath)
+                server = await asyncio.start_unix_server(self.lineclient, path=socketpath)
+            else:
+                server = await asyncio.start_server(self.httpclient, host, port)
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+def loadpresets(directory=None):
+    '''
+    Returns every preset in a directory (JSON and TOML files, named after the file) as name -> generator.Params,
+    along with "default" for the default parameters (unless the directory has its own).
+    Parameters:
+    Directory (string): The preset directory, None for only the defaults
+    '''
+    presets = {"default": generator.makeparams()}
+    if directory is not None:
+        for filename in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(filename)
+            if extension in (".json", ".toml"):
+                presets[name] = generator.loadparams(os.path.join(directory, filename))
+    return presets
+
+def request(request: dict, socketpath=None, host="127.0.0.1", port=None):
+    '''
+    Sends one request to a running server and returns its response. Handy for scripts; tools that ask for lots of
+    structures should keep a connection open instead.
+    Parameters:
+    Request (dict): The request (see StructureServer)
+    Socketpath (string): The server's Unix socket
+    Host, Port: The server's HTTP address, if there's no socketpath
+    '''
+    if socketpath is not None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socketpath)
+            connection.sendall(json.dumps(request).encode() + b"\n")
+            with connection.makefile("rb") as responses:
+                return json.loads(responses.readline())
+    import http.client
+    connection = http.client.HTTPConnection(host, port)
+    try:
+        connection.request("POST", "/structure", json.dumps(request), {"Content-Type": "application/json"})
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves structures on demand from prefilled queues")
+    parser.add_argument("--presets", default=None, help="Directory of JSON/TOML presets to serve (the defaults are always served as \"default\")")
+    parser.add_argument("--socket", default=None, help="Unix socket to listen on (newline-delimited JSON)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to serve HTTP on, if there's no --socket")
+    parser.add_argument("--port", type=int, default=8765, help="Port to serve HTTP on, if there's no --socket")
+    parser.add_argument("-q", "--queue-size", type=int, default=1000, help="Structures to keep ready per preset")
+    parser.add_argument("-b", "--batch-size", type=int, default=100, help="Structures per refill")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="Number of processes to generate with, 0 for one per CPU")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="Seed for the run")
+    parser.add_argument("-t", "--timeout", type=float, default=10, help="Longest a request waits for a structure, in seconds")
+    args = parser.parse_args()
+    server = StructureServer(loadpresets(args.presets), args.queue_size, args.batch_size, args.workers, args.seed, args.timeout)
+    started = time.strftime("%H:%M:%S")
+    print(f'[{started}] Serving {", ".join(server.presets)} on {args.socket or f"http://{args.host}:{args.port}"}')
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nBye! :)")
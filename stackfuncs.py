@@ -1,6 +1,8 @@
+import functools
+import math
 import random
 
-def generatetemp(templa: list, matrix: list, bias: float, debug=False, maxlen=100, returnpos=True):
+def generatetemp(templa: list, matrix: list, bias: float, debug=False, maxlen=100, returnpos=True, rng=random):
     '''
     Generates an RNA secondary structure template using given parameters.
     Parameters:
@@ -9,6 +11,7 @@ def generatetemp(templa: list, matrix: list, bias: float, debug=False, maxlen=10
     bias (float): The bias towards ")" (subtracts from matrix[0])
     maxlen (integer): The maximum a template can be before generation restarts
     returnpos (Boolean): Whether or not to return the positions of all "("s involved in multiloops, packaged into lists for each one.
+    rng (random.Random): The random number generator to draw from (defaults to the global random module)
     '''
     depth = 1
     fulllist = []
@@ -19,7 +22,7 @@ def generatetemp(templa: list, matrix: list, bias: float, debug=False, maxlen=10
         if debug:
             print("Before:", templa, depth)
 
-        choice = random.random()
+        choice = rng.random()
         prev = templa[-1]
         p_open = matrix[0] if prev == "(" else matrix[1]
         p_open = max(0, p_open - bias * depth)
@@ -48,9 +51,229 @@ def generatetemp(templa: list, matrix: list, bias: float, debug=False, maxlen=10
     if returnpos:
         return fulllist
 
-def convertstack(size: int,dratio: float,onechance: float,twochance: float,maxcountdiff: int,maxposdiff: int, maxonesideposdiff: int):
+def openchance(matrix: tuple, bias: float, prev: str, depth: int):
+    '''
+    Returns the chance that generatetemp appends a "(" after prev at the given depth.
+    Parameters:
+    matrix (tuple): A matrix of probabilities for appending characters based on the previous one
+    bias (float): The bias towards ")" (subtracts from matrix[0])
+    prev (string): The previous character, "(" or ")"
+    depth (integer): The current depth
+    '''
+    p_open = matrix[0] if prev == "(" else matrix[1]
+    return min(1, max(0, p_open - bias * depth))
+
+@functools.lru_cache(maxsize=16)
+def templatetable(matrix: tuple, bias: float, maxsteps: int):
+    '''
+    Builds (and caches) the table used to sample templates of an exact length.
+    rows[r][p][d] is the chance that generatetemp, at depth d with previous character p (0 = "(", 1 = ")"),
+    closes the template in exactly r more steps. Each row is scaled so its largest value is 1, and logscales[r] holds the
+    log of the scale that was divided out of row r, so that rows can still be compared to each other.
+    Parameters:
+    matrix (tuple): A matrix of probabilities for appending characters based on the previous one
+    bias (float): The bias towards ")" (subtracts from matrix[0])
+    maxsteps (integer): The largest number of steps to build the table up to
+    '''
+    rows = [[[1.0] + [0.0] * (maxsteps + 1), [1.0] + [0.0] * (maxsteps + 1)]]
+    logscales = [0.0]
+    for r in range(1, maxsteps + 1):
+        prevrow = rows[-1]
+        row = [[0.0] * (maxsteps + 2), [0.0] * (maxsteps + 2)]
+        # Starting from depth 1, a depth above maxsteps-r+1 can't be reached with r steps left
+        for d in range(1, min(r, maxsteps - r + 1) + 1):
+            for p, prev in enumerate("()"):
+                p_open = openchance(matrix, bias, prev, d)
+                row[p][d] = p_open * prevrow[0][d + 1] + (1 - p_open) * prevrow[1][d - 1]
+        peak = max(max(row[0]), max(row[1]))
+        if peak > 0:
+            row = [[value / peak for value in row[0]], [value / peak for value in row[1]]]
+            logscales.append(logscales[-1] + math.log(peak))
+        else:
+            logscales.append(logscales[-1])
+        rows.append(row)
+    return rows, logscales
+
+def generatetempinrange(matrix: list, bias: float, minlen: int, maxlen: int, debug=False, returnpos=True, rng=random):
+    '''
+    Generates a template exactly like generatetemp would if it were retried until minlen < length < maxlen,
+    (length not counting "*"s) but without any retries, by conditioning every step on the length.
+    Returns the template, and if returnpos is on, the positions of the multiloops like generatetemp.
+    Parameters:
+    matrix (list): A matrix of probabilities for appending characters based on the previous one
+    bias (float): The bias towards ")" (subtracts from matrix[0])
+    minlen (integer): The template length must be more than this
+    maxlen (integer): The template length must be less than this
+    returnpos (Boolean): Whether or not to return the positions of all "("s involved in multiloops, packaged into lists for each one.
+    rng (random.Random): The random number generator to draw from (defaults to the global random module)
+    '''
+    matrix = tuple(matrix)
+    # A template of length L (always even) is the first "(" plus L-1 steps
+    lengths = [length for length in range(max(minlen + 1, 2), maxlen) if length % 2 == 0]
+    if not lengths:
+        raise ValueError("No template length fits in the given range")
+    rows, logscales = templatetable(matrix, bias, lengths[-1] - 1)
+    logweights = []
+    for length in lengths:
+        weight = rows[length - 1][0][1]
+        logweights.append(math.log(weight) + logscales[length - 1] if weight > 0 else -math.inf)
+    peak = max(logweights)
+    if peak == -math.inf:
+        raise ValueError("No template in the given range can be generated with these parameters")
+    length = rng.choices(lengths, weights=[math.exp(w - peak) for w in logweights], k=1)[0]
+
+    templa = ["("]
+    depth = 1
+    fulllist = []
+    active_multis = {}
+    for r in range(length - 1, 0, -1):
+        if debug:
+            print("Before:", templa, depth)
+
+        prev = templa[-1]
+        p_open = openchance(matrix, bias, prev, depth)
+        # Weigh each choice by the chance of still closing in exactly the remaining steps
+        openweight = p_open * rows[r - 1][0][depth + 1]
+        closeweight = (1 - p_open) * rows[r - 1][1][depth - 1]
+
+        if rng.random() * (openweight + closeweight) < openweight:
+            templa.append("(")
+            depth += 1
+            if prev == ")":
+                if depth not in active_multis:
+                    active_multis[depth]=[len(templa)-1]
+                else:
+                    active_multis[depth].append(len(templa)-1)
+        else:
+            if prev == "(":
+                templa.append("*")
+            templa.append(")")
+            if depth in active_multis:
+                fulllist.append(active_multis[depth])
+                active_multis.pop(depth)
+            depth -= 1
+
+        if debug:
+            print("After:", templa, depth)
+
+    if returnpos:
+        return templa, fulllist
+    return templa
+
+def convertstack(size: int,dratio: float,onechance: float,twochance: float,maxcountdiff: int,maxposdiff: int, maxonesideposdiff: int, rng=random, legacy=False):
     '''
     Generates a stack from given parameters.
+    Gives exactly the same stacks as legacyconvertstack for the same random state, but in linear time.
+    Parameters:
+    Size (integer): The number of paired bases in the stack.
+    Dratio (float): The ratio of paired bases to the number of the positions of unpaired bases
+    Onechance (float): The chance for an unpaired base position to be "."
+    Twochance (float): The chance for an unpaired base position to be "..", the remaining probability is for "..."
+    Maxcountdiff (integer): The largest the difference in number of positions of unpaired bases can be from each stack side in order to not warrant rebalancing
+    Maxposdiff (integer): The largest the difference in the position of two unpaired bases that is forbidden
+    Rng (random.Random): The random number generator to draw from (defaults to the global random module)
+    Legacy (Boolean): Use legacyconvertstack instead
+    '''
+    if legacy:
+        return legacyconvertstack(size, dratio, onechance, twochance, maxcountdiff, maxposdiff, maxonesideposdiff, rng=rng)
+
+    # Variables
+    if size < 1:
+        raise ValueError("size must be positive")
+    dellist = set() # To store all the position of the unpaired bases to delete from dotpos
+    numdots = min(round(dratio * size), 2 * size) # The number of unpaired bases to add (capped at 2*size)
+
+    # Generate a sample of unpaired base positions
+    dotpos = sorted(rng.sample(range(2*size), numdots))
+    numpos = len(dotpos)
+
+    # Make counts on each side
+    counts = [0,0]
+    for pos in dotpos:
+        if pos < size:
+            counts[0] += 1
+        elif pos > size:
+            counts[1] += 1
+
+    # Dotpos cleaning
+    # Mirroring dotpos[k] gives 2*size-1-dotpos[k], so the dots whose mirror is within maxposdiff of dotpos[i] are a run of
+    # dotpos that only moves left as i goes up. window is the start of that run.
+    window = numpos
+    for i in range(numpos):
+        # Add for removal dots that are 1 position away from either end of the stack
+        if dotpos[i] <= 2 or dotpos[i] >= 2*size-1 or dotpos[i]==size-1 or dotpos[i]==size+1:
+            dellist.add(dotpos[i])
+        if numpos-1 > i > 0:
+            if abs(dotpos[i]-dotpos[i-1]) <= maxonesideposdiff:
+                c = rng.choice([0,1])
+                dellist.add([dotpos[i], dotpos[i-1]][c])
+                if i < size:
+                    counts[0] -= 1
+                elif i > size:
+                    counts[1] -= 1
+            elif abs(dotpos[i]-dotpos[i+1]) <= maxonesideposdiff:
+                c = rng.choice([0,1])
+                dellist.add([dotpos[i], dotpos[i+1]][c])
+                if i < size:
+                    counts[0] -= 1
+                elif i > size:
+                    counts[1] -= 1
+        # Check the dots after this one whose mirror is within maxposdiff
+        low = 2*size-1-dotpos[i]-maxposdiff
+        high = 2*size-1-dotpos[i]+maxposdiff
+        while window > 0 and dotpos[window-1] >= low:
+            window -= 1
+        k = max(window, i+1)
+        while k < numpos and dotpos[k] <= high:
+            # Check to see if the counts are winthin maxcountdiff of eachother
+            if abs(counts[0]-counts[1]) <= maxcountdiff:
+                # If they are, randomly select one to remove
+                c = rng.choice([0,1])
+                dellist.add([dotpos[i], dotpos[k]][c])
+            elif counts[0] > counts[1]:
+                # Otherwise try to balance them
+                dellist.add(dotpos[i])
+            else:
+                dellist.add(dotpos[k])
+            k += 1
+
+    # Add either ., .., or ... based on random chance
+    dotchoice = rng.random()
+    if dotchoice < onechance:
+        dots = "."
+    elif dotchoice < onechance + twochance:
+        dots = ".."
+    else:
+        dots = "..."
+
+    # Build each half directly, with the dots going before the base at each remaining position
+    halves = [[], []]
+    last = 0
+    bulges = 0
+    for pos in dotpos:
+        if pos in dellist:
+            continue
+        half = 0 if pos < size else 1
+        if half == 1 and last < size:
+            halves[0].append("(" * (size - last))
+            last = size
+        halves[half].append(("(" if half == 0 else ")") * (pos - last))
+        halves[half].append(dots)
+        last = pos
+        bulges += 1
+    if last < size:
+        halves[0].append("(" * (size - last))
+        last = size
+    halves[1].append(")" * (2*size - last))
+    left = "".join(halves[0])
+    right = "".join(halves[1])
+
+    # Return the full stack and its two halves and the bulge count
+    return [left + right, left, right, bulges]
+
+def legacyconvertstack(size: int,dratio: float,onechance: float,twochance: float,maxcountdiff: int,maxposdiff: int, maxonesideposdiff: int, rng=random):
+    '''
+    Generates a stack from given parameters. (The original O(k^2) version of convertstack, kept for comparison)
     Parameters:
     Size (integer): The number of paired bases in the stack.
     Dratio (float): The ratio of paired bases to the number of the positions of unpaired bases
@@ -58,6 +281,7 @@ def convertstack(size: int,dratio: float,onechance: float,twochance: float,maxco
     Twochance (float): The chance for an unpaired base position to be "..", the remaining probability is for "..."
     Maxcountdiff (integer): The largest the difference in number of positions of unpaired bases can be from each stack side in order to not warrant rebalancing
     Maxposdiff (integer): The largest the difference in the position of two unpaired bases that is forbidden
+    Rng (random.Random): The random number generator to draw from (defaults to the global random module)
     '''
 
 
@@ -72,7 +296,7 @@ def convertstack(size: int,dratio: float,onechance: float,twochance: float,maxco
     split = None # Runtime var
 
     # Generate a sample of unpaired base positions
-    dotpos = sorted(random.sample(range(2*size), numdots))
+    dotpos = sorted(rng.sample(range(2*size), numdots))
 
     # Make counts on each side
     for pos in dotpos:
@@ -88,14 +312,14 @@ def convertstack(size: int,dratio: float,onechance: float,twochance: float,maxco
             dellist.add(dotpos[i])
         if len(dotpos)-1 > i > 0:
             if abs(dotpos[i]-dotpos[i-1]) <= maxonesideposdiff:
-                c = random.choice([0,1])
+                c = rng.choice([0,1])
                 dellist.add([dotpos[i], dotpos[i-1]][c])
                 if i < size:
                     counts[0] -= 1
                 elif i > size:
                     counts[1] -= 1
             elif abs(dotpos[i]-dotpos[i+1]) <= maxonesideposdiff:
-                c = random.choice([0,1])
+                c = rng.choice([0,1])
                 dellist.add([dotpos[i], dotpos[i+1]][c])
                 if i < size:
                     counts[0] -= 1
@@ -110,7 +334,7 @@ def convertstack(size: int,dratio: float,onechance: float,twochance: float,maxco
                 # Check to see if the counts are winthin maxcountdiff of eachother
                 if abs(counts[0]-counts[1]) <= maxcountdiff:
                     # If they are, randomly select one to remove
-                    c = random.choice([0,1])
+                    c = rng.choice([0,1])
                     dellist.add([dotpos[i], dotpos[i+j+1]][c])
                     if c == 0 and dotpos[i] not in dellist:
                         counts[0] -= 1
@@ -131,7 +355,7 @@ def convertstack(size: int,dratio: float,onechance: float,twochance: float,maxco
     dotpos = [p for p in dotpos if p not in dellist]
 
     # Add either ., .., or ... based on random chance
-    dotchoice = random.random()
+    dotchoice = rng.random()
     for i in range(len(dotpos)):
         if dotchoice < onechance:
             temp.insert(dotpos[i] + i, ".")
@@ -0,0 +1,116 @@
+import helpers
+
+# Every structure stat, in the order they're documented in paramtype.md
+STATFIELDS = [
+    "Length", "Base Pairs", "Unpaired Bases", "Average Stack Length", "Largest Stack", "Smallest Stack",
+    "Hairpins", "Largest Hairpin", "Internal Loops", "Bulges", "Pair Density", "Pseudoknot Density",
+    "Pseudoknots", "Percent Involved", "Crossed Multiloop Proportion", "Multiloops",
+]
+STACKFIELDS = {"Average Stack Length", "Largest Stack", "Smallest Stack"}
+PKFIELDS = {"Percent Involved", "Crossed Multiloop Proportion"}
+
+OPEN_PK = {"[", "{", "<"}
+CLOSE_PK = {"]", "}", ">"}
+
+def structurestats(structure: str, fields=None, table=None):
+    '''
+    Computes the stats of a dot-bracket structure (see paramtype.md) in one pass over it and its pair table.
+    Only the requested fields are computed, and they're returned as a dict in the order asked for.
+    Parameters:
+    Structure (string): The given structure
+    Fields (list): The stats to compute, None for all of them (see STATFIELDS)
+    Table (helpers.PairTable): An already built index of the structure, to skip building one
+    '''
+    fields = STATFIELDS if fields is None else fields
+    wanted = set(fields)
+    if not wanted.issubset(STATFIELDS):
+        raise ValueError(f'Unknown stat(s): {", ".join(sorted(wanted.difference(STATFIELDS)))}')
+    if not wanted:
+        return {}
+    needstacks = not wanted.isdisjoint(STACKFIELDS)
+    needpk = not wanted.isdisjoint(PKFIELDS)
+    if table is None:
+        table = helpers.PairTable(structure)
+    partner = table.partner
+
+    n = len(structure)
+    basepairs = pkpairs = pseudoknots = hairpins = largesthairpin = internalloops = bulges = 0
+    firstinside = {} # "(" -> the "(" straight inside it, if nothing but "."s come between them
+    stacklength = {} # "(" -> the number of pairs in its stack, from it inwards
+    continued = set() # "("s whose stack carries on in the pair around them
+    affected = [0] * n if needpk else None
+    pkdepth = 0
+    lastpaired = -1
+    prev = None
+    for i, char in enumerate(structure):
+        if char == "(":
+            basepairs += 1
+            if lastpaired >= 0 and structure[lastpaired] == "(":
+                firstinside[lastpaired] = i
+            lastpaired = i
+        elif char == ")":
+            opener = partner[i]
+            if lastpaired == opener:
+                # Nothing paired inside, so it closes a hairpin
+                hairpins += 1
+                largesthairpin = max(largesthairpin, i - opener - 1)
+            length = 1
+            inner = firstinside.get(opener)
+            if inner is not None and structure[lastpaired] == ")" and partner[lastpaired] == inner:
+                # Exactly one pair inside, with only "."s on each side of it
+                left = inner - opener - 1
+                right = i - lastpaired - 1
+                if left and right:
+                    internalloops += 1
+                else:
+                    if left or right:
+                        bulges += 1
+                    length = stacklength[inner] + 1
+                    continued.add(inner)
+            stacklength[opener] = length
+            lastpaired = i
+        elif char in OPEN_PK:
+            basepairs += 1
+            pkpairs += 1
+            if prev != char:
+                pseudoknots += 1
+            lastpaired = i
+        elif char in CLOSE_PK:
+            lastpaired = i
+
+        if needpk:
+            # The same rules as helpers.findbasesinpks
+            if char in OPEN_PK:
+                if prev not in OPEN_PK:
+                    pkdepth += 1
+                affected[i] = 1
+            elif char in CLOSE_PK:
+                if prev not in CLOSE_PK:
+                    pkdepth -= 1
+                affected[i] = 1
+            elif pkdepth > 0:
+                affected[i] = 1
+        prev = char
+
+    stats = {}
+    if needstacks:
+        stacklengths = [length for opener, length in stacklength.items() if opener not in continued] or [0]
+        stats["Average Stack Length"] = round(sum(stacklengths)/len(stacklengths), 3)
+        stats["Largest Stack"] = max(stacklengths)
+        stats["Smallest Stack"] = min(stacklengths)
+    stats["Length"] = n
+    stats["Base Pairs"] = basepairs
+    stats["Unpaired Bases"] = n - 2*basepairs
+    stats["Hairpins"] = hairpins
+    stats["Largest Hairpin"] = largesthairpin
+    stats["Internal Loops"] = internalloops
+    stats["Bulges"] = bulges
+    stats["Pair Density"] = round(basepairs*2/n, 3) if n else 0
+    stats["Pseudoknot Density"] = round(pkpairs*2/n, 3) if n else 0
+    stats["Pseudoknots"] = pseudoknots
+    stats["Multiloops"] = len(table.multiloops)
+    if needpk:
+        stats["Percent Involved"] = round(sum(affected)/n, 3) if n else 0
+        crossed = sum(1 for multiloop in table.multiloops if any(affected[pos] for pos in multiloop))
+        stats["Crossed Multiloop Proportion"] = round(crossed/len(table.multiloops), 3) if table.multiloops else 0
+    return {field: stats[field] for field in fields}
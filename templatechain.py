@@ -0,0 +1,356 @@
+import argparse
+import functools
+import math
+import random
+import stackfuncs
+
+# The templates generatetemp makes are a Markov chain over (previous character, depth): after a "(" or a ")" at depth d,
+# it opens with stackfuncs.openchance and closes otherwise, and it stops when the depth gets back to 0. Everything here
+# works on that chain directly, with rows indexed [steps left][previous character (0 = "(", 1 = ")")][depth] like
+# stackfuncs.templatetable. A template of length L (not counting "*"s) is the first "(" plus L-1 steps.
+
+def rangelengths(minlen: int, maxlen: int):
+    '''
+    Returns the template lengths generatetempinrange can give for a range, minlen < length < maxlen (always even).
+    Parameters:
+    Minlen, Maxlen (integer): The range, as in temprange
+    '''
+    return [length for length in range(max(minlen + 1, 2), maxlen) if length % 2 == 0]
+
+def steps(template):
+    '''
+    Turns a template into its steps, "(" and ")" after the first "(", checking it's one generatetemp could make
+    (balanced, one domain, and a "*" exactly where a ")" comes straight after a "(").
+    Parameters:
+    Template (list/string): The given template
+    '''
+    chars = "".join(template)
+    bare = chars.replace("*", "")
+    if not bare.startswith("("):
+        raise ValueError("Templates start with (")
+    if "".join(buildtemplate(bare[1:])) != chars:
+        raise ValueError("Hairpins have to be written as (*), and only there")
+    depth = 0
+    for i, char in enumerate(bare):
+        if char not in "()":
+            raise ValueError(f'Unexpected character "{char}" in the template')
+        depth += 1 if char == "(" else -1
+        if depth < 0 or (depth == 0 and i < len(bare) - 1):
+            raise ValueError("Templates are one balanced domain")
+    if depth:
+        raise ValueError("Unbalanced template")
+    return bare[1:]
+
+def walkprobability(template, matrix: list, bias: float):
+    '''
+    Returns the chance that generatetemp (without a length limit) makes exactly this template.
+    Parameters:
+    Template (list/string): The given template
+    Matrix (list): A matrix of probabilities for appending characters based on the previous one (tempchances)
+    Bias (float): The bias towards ")"
+    '''
+    matrix = tuple(matrix)
+    probability = 1.0
+    prev, depth = "(", 1
+    for char in steps(template):
+        p_open = stackfuncs.openchance(matrix, bias, prev, depth)
+        probability *= p_open if char == "(" else 1 - p_open
+        depth += 1 if char == "(" else -1
+        prev = char
+    return probability
+
+@functools.lru_cache(maxsize=16)
+def lengthlogmass(matrix: tuple, bias: float, maxlen: int):
+    '''
+    Returns the log of the chance that generatetemp's walk closes at exactly each length from 0 to maxlen
+    (-inf where it can't), from stackfuncs.templatetable.
+    Parameters:
+    Matrix (tuple): A matrix of probabilities for appending characters based on the previous one
+    Bias (float): The bias towards ")"
+    Maxlen (integer): The longest length
+    '''
+    rows, logscales = stackfuncs.templatetable(matrix, bias, max(maxlen - 1, 1))
+    logmass = [-math.inf] * (maxlen + 1)
+    for length in range(2, maxlen + 1, 2):
+        weight = rows[length - 1][0][1]
+        logmass[length] = math.log(weight) + logscales[length - 1] if weight > 0 else -math.inf
+    return logmass
+
+def lengthmass(matrix: list, bias: float, maxlen: int):
+    '''
+    Returns the chance that generatetemp's walk closes at exactly each length from 0 to maxlen, as a list.
+    The rest of the chance (1 - the sum) is the walk going on past maxlen.
+    Parameters:
+    Matrix (list): A matrix of probabilities for appending characters based on the previous one (tempchances)
+    Bias (float): The bias towards ")"
+    Maxlen (integer): The longest length
+    '''
+    return [math.exp(value) for value in lengthlogmass(tuple(matrix), bias, maxlen)]
+
+def templateprobability(template, matrix: list, bias: float, temprange=None):
+    '''
+    Returns the exact chance of drawing a template: from maketemplate (stackfuncs.generatetempinrange) if temprange is
+    given, which is 0 outside it, otherwise from generatetemp without a length limit.
+    Parameters:
+    Template (list/string): The given template
+    Matrix (list): A matrix of probabilities for appending characters based on the previous one (tempchances)
+    Bias (float): The bias towards ")"
+    Temprange (list): The [minimum, maximum] length range (see temprange), None for no range
+    '''
+    probability = walkprobability(template, matrix, bias)
+    if temprange is None:
+        return probability
+    lengths = rangelengths(*temprange)
+    length = len(steps(template)) + 1
+    if length not in lengths:
+        return 0.0
+    logmass = lengthlogmass(tuple(matrix), bias, lengths[-1])
+    peak = max(logmass[length] for length in lengths)
+    if peak == -math.inf:
+        return 0.0
+    total = sum(math.exp(logmass[length] - peak) for length in lengths)
+    return math.exp(math.log(probability) - peak - math.log(total)) if probability > 0 else 0.0
+
+@functools.lru_cache(maxsize=16)
+def depthmass(matrix: tuple, bias: float, maxlen: int):
+    '''
+    Returns the chance that generatetemp's walk closes at each length up to maxlen with each deepest depth, as a
+    dict of (length, deepest depth) -> chance. Depths where opening can no longer happen (bias) cap the table.
+    Parameters:
+    Matrix (tuple): A matrix of probabilities for appending characters based on the previous one
+    Bias (float): The bias towards ")"
+    Maxlen (integer): The longest length
+    '''
+    # The deepest the walk can go: one past the last depth it can still open at
+    deepest = 1
+    while deepest < maxlen // 2 and max(stackfuncs.openchance(matrix, bias, prev, deepest) for prev in "()") > 0:
+        deepest += 1
+    # below[cap][length] is the chance of closing at that length without ever going deeper than cap
+    below = []
+    for cap in range(1, deepest + 1):
+        # Forward over the chain, cut off above cap, collecting whatever gets back to depth 0
+        chances = {(0, 1): 1.0}
+        closed = [0.0] * (maxlen + 1)
+        for step in range(1, maxlen):
+            following = {}
+            for (prev, depth), chance in chances.items():
+                p_open = stackfuncs.openchance(matrix, bias, "()"[prev], depth)
+                if depth < cap and p_open > 0:
+                    following[(0, depth + 1)] = following.get((0, depth + 1), 0.0) + chance * p_open
+                if p_open < 1:
+                    if depth == 1:
+                        closed[step + 1] += chance * (1 - p_open)
+                    else:
+                        following[(1, depth - 1)] = following.get((1, depth - 1), 0.0) + chance * (1 - p_open)
+            chances = following
+        below.append(closed)
+    mass = {}
+    for cap in range(1, deepest + 1):
+        for length in range(2, maxlen + 1, 2):
+            chance = below[cap - 1][length] - (below[cap - 2][length] if cap > 1 else 0.0)
+            if chance > 0:
+                mass[(length, cap)] = chance
+    return mass
+
+@functools.lru_cache(maxsize=16)
+def counttable(matrix: tuple, bias: float, maxsteps: int):
+    '''
+    Builds (and caches) the number of ways to close in exactly r more steps from every state, counting only steps
+    generatetemp can actually take (ones with a chance above 0). Same layout as stackfuncs.templatetable, with exact integers.
+    Parameters:
+    Matrix (tuple): A matrix of probabilities for appending characters based on the previous one
+    Bias (float): The bias towards ")"
+    Maxsteps (integer): The largest number of steps to build the table up to
+    '''
+    rows = [[[1] + [0] * (maxsteps + 1), [1] + [0] * (maxsteps + 1)]]
+    for r in range(1, maxsteps + 1):
+        prevrow = rows[-1]
+        row = [[0] * (maxsteps + 2), [0] * (maxsteps + 2)]
+        for d in range(1, min(r, maxsteps - r + 1) + 1):
+            for p, prev in enumerate("()"):
+                p_open = stackfuncs.openchance(matrix, bias, prev, d)
+                row[p][d] = (prevrow[0][d + 1] if p_open > 0 else 0) + (prevrow[1][d - 1] if p_open < 1 else 0)
+        rows.append(row)
+    return rows
+
+def counttemplates(matrix: list, bias: float, minlen: int, maxlen: int):
+    '''
+    Returns the number of different templates generatetemp can make with minlen < length < maxlen (as in temprange,
+    not counting "*"s). Use (length - 1, length + 1) for a single length.
+    Parameters:
+    Matrix (list): A matrix of probabilities for appending characters based on the previous one (tempchances)
+    Bias (float): The bias towards ")"
+    Minlen, Maxlen (integer): The length range
+    '''
+    lengths = rangelengths(minlen, maxlen)
+    if not lengths:
+        return 0
+    rows = counttable(tuple(matrix), bias, lengths[-1] - 1)
+    return sum(rows[length - 1][0][1] for length in lengths)
+
+def buildtemplate(stepchars: str):
+    '''
+    Turns steps (see steps) back into a template list like generatetemp's, with "*"s for hairpins.
+    Parameters:
+    Stepchars (string): The steps after the first "("
+    '''
+    template = ["("]
+    for char in stepchars:
+        if char == ")" and template[-1] == "(":
+            template.append("*")
+        template.append(char)
+    return template
+
+def enumeratetemplates(matrix: list, bias: float, minlen: int, maxlen: int):
+    '''
+    Yields every template generatetemp can make with minlen < length < maxlen (as in temprange), shortest first.
+    There are exponentially many, so keep the range small (counttemplates tells you how many there are).
+    Parameters:
+    Matrix (list): A matrix of probabilities for appending characters based on the previous one (tempchances)
+    Bias (float): The bias towards ")"
+    Minlen, Maxlen (integer): The length range
+    '''
+    matrix = tuple(matrix)
+    lengths = rangelengths(minlen, maxlen)
+    if not lengths:
+        return
+    rows = counttable(matrix, bias, lengths[-1] - 1)
+    for length in lengths:
+        # Depth first, only down branches that can still close in exactly the steps left
+        stack = [("", 0, 1, length - 1)]
+        while stack:
+            chars, prev, depth, left = stack.pop()
+            if left == 0:
+                yield buildtemplate(chars)
+                continue
+            p_open = stackfuncs.openchance(matrix, bias, "()"[prev], depth)
+            if p_open < 1 and rows[left - 1][1][depth - 1]:
+                stack.append((chars + ")", 1, depth - 1, left - 1))
+            if p_open > 0 and rows[left - 1][0][depth + 1]:
+                stack.append((chars + "(", 0, depth + 1, left - 1))
+
+def sampleuniform(matrix: list, bias: float, minlen: int, maxlen: int, rng=random):
+    '''
+    Draws a template uniformly from every template generatetemp can make with minlen < length < maxlen, ignoring how
+    likely generatetemp is to make each one. Returns it along with its number of multiloops, like maketemplate.
+    Parameters:
+    Matrix (list): A matrix of probabilities for appending characters based on the previous one (tempchances)
+    Bias (float): The bias towards ")"
+    Minlen, Maxlen (integer): The length range
+    Rng (random.Random): The random number generator to draw from
+    '''
+    matrix = tuple(matrix)
+    lengths = rangelengths(minlen, maxlen)
+    if not lengths:
+        raise ValueError("No template length fits in the given range")
+    rows = counttable(matrix, bias, lengths[-1] - 1)
+    counts = [rows[length - 1][0][1] for length in lengths]
+    total = sum(counts)
+    if not total:
+        raise ValueError("No template in the given range can be generated with these parameters")
+    # Pick the length in proportion to how many templates it has, then each step in proportion to what's left below it
+    pick = rng.randrange(total)
+    for length, count in zip(lengths, counts):
+        if pick < count:
+            break
+        pick -= count
+    chars = []
+    prev, depth = 0, 1
+    nummultis = 0
+    for left in range(length - 1, 0, -1):
+        p_open = stackfuncs.openchance(matrix, bias, "()"[prev], depth)
+        opens = rows[left - 1][0][depth + 1] if p_open > 0 else 0
+        closes = rows[left - 1][1][depth - 1] if p_open < 1 else 0
+        if rng.randrange(opens + closes) < opens:
+            if prev == 1:
+                nummultis += 1
+            chars.append("(")
+            prev, depth = 0, depth + 1
+        else:
+            chars.append(")")
+            prev, depth = 1, depth - 1
+    return buildtemplate("".join(chars)), nummultis
+
+def expectedstats(matrix: list, bias: float, minlen: int, maxlen: int):
+    '''
+    Returns the exact mean template stats (see generator.templatestats) of the templates maketemplate draws from a
+    temprange, without drawing any, by running the chain forwards and weighing every step by the chance of still closing
+    at a length in range. Hairpins are a "(" followed by a ")", and multiloops a ")" followed by a "(".
+    Parameters:
+    Matrix (list): A matrix of probabilities for appending characters based on the previous one (tempchances)
+    Bias (float): The bias towards ")"
+    Minlen, Maxlen (integer): The length range
+    '''
+    matrix = tuple(matrix)
+    lengths = rangelengths(minlen, maxlen)
+    if not lengths:
+        raise ValueError("No template length fits in the given range")
+    longest = lengths[-1]
+    rows, logscales = stackfuncs.templatetable(matrix, bias, longest - 1)
+    logmass = lengthlogmass(matrix, bias, longest)
+    offset = max(logmass[length] for length in lengths)
+    if offset == -math.inf:
+        raise ValueError("No template in the given range can be generated with these parameters")
+    # ending[r][p][d]: chance of closing in exactly r more steps (scaled by the offset), summed into runs over r so any
+    # window of lengths is one subtraction
+    scales = [math.exp(logscale - offset) for logscale in logscales]
+    width = len(rows[0][0])
+    cumulative = [[[0.0] * width, [0.0] * width]]
+    for r in range(longest):
+        cumulative.append([[cumulative[-1][p][d] + rows[r][p][d] * scales[r] for d in range(width)] for p in range(2)])
+
+    def ending(p, d, stepsdone):
+        # Chance (scaled) of closing from (p, d) after stepsdone steps at a length in range
+        low = max(lengths[0] - 1 - stepsdone, 0)
+        high = longest - 1 - stepsdone
+        if high < low:
+            return 0.0
+        return cumulative[high + 1][p][d] - cumulative[low][p][d]
+
+    total = sum(math.exp(logmass[length] - offset) for length in lengths)
+    meanlength = sum(length * math.exp(logmass[length] - offset) for length in lengths) / total
+    hairpins = multiloops = 0.0
+    chances = {(0, 1): 1.0}
+    for step in range(longest - 1):
+        following = {}
+        for (prev, depth), chance in chances.items():
+            p_open = stackfuncs.openchance(matrix, bias, "()"[prev], depth)
+            if p_open > 0:
+                weight = chance * p_open
+                following[(0, depth + 1)] = following.get((0, depth + 1), 0.0) + weight
+                if prev == 1:
+                    multiloops += weight * ending(0, depth + 1, step + 1)
+            if p_open < 1:
+                weight = chance * (1 - p_open)
+                if prev == 0:
+                    hairpins += weight * ending(1, depth - 1, step + 1)
+                if depth > 1:
+                    following[(1, depth - 1)] = following.get((1, depth - 1), 0.0) + weight
+        chances = following
+    return {
+        "Length": meanlength,
+        "Hairpins": hairpins / total,
+        "Stacks": meanlength / 2,
+        "Multiloops": multiloops / total,
+    }
+
+if __name__ == "__main__":
+    # Only needed here, generator imports this module
+    import generator
+    parser = argparse.ArgumentParser(description="Exact template length, depth and stat distributions for a set of parameters")
+    parser.add_argument("-p", "--params", default=None, help="JSON or TOML preset to use, instead of the defaults")
+    parser.add_argument("--max-length", type=int, default=None, help="Longest length to show the distribution up to (default temprange's maximum)")
+    args = parser.parse_args()
+    params = generator.loadparams(args.params) if args.params is not None else generator.makeparams()
+    matrix, bias, temprange = params["tempchances"], params["bias"], params["temprange"]
+    maxlen = args.max_length or temprange[1]
+    print(f'Mean template stats for temprange {list(temprange)}:')
+    for name, value in expectedstats(matrix, bias, *temprange).items():
+        print(f'  {name}: {value:.3f}')
+    print("Length: chance from generatetemp, chance in temprange, templates")
+    lengths = rangelengths(*temprange)
+    mass = lengthmass(matrix, bias, max([maxlen] + lengths))
+    rangetotal = sum(mass[length] for length in lengths)
+    for length in range(2, maxlen + 1, 2):
+        share = mass[length] / rangetotal if length in lengths and rangetotal else 0
+        print(f'  {length:>4}: {mass[length]:.3e}  {share:.4f}  {counttemplates(matrix, bias, length - 1, length + 1)}')
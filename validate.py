@@ -0,0 +1,423 @@
+import argparse
+import json
+import sys
+import numpy as np
+import packed
+from helpers import CLOSERS, MATCHING, OPENERS
+
+# Unpaired runs at least this long count as long unpaired stretches (as in the old difficultyrating.py)
+LONGUNPAIRED = 6
+# Features the difficulty score is made of, and how much each one adds per occurrence
+DIFFICULTYWEIGHTS = {
+    "Short Stems": 2.0,
+    "Triloops": 1.0,
+    "Long Unpaired": 1.0,
+    "Junctions": 1.0,
+    "Pseudoknot Stems": 2.0,
+}
+FEATURES = list(DIFFICULTYWEIGHTS)
+# Position codes (indexes into packed.CHARS)
+DOT = 0
+ROUNDOPEN, ROUNDCLOSE = 1, 2
+
+def difficulty(features: dict, weights=None):
+    '''
+    Returns the difficulty score of a structure: the weighted sum of its features (see validatestructure).
+    Parameters:
+    Features (dict): Feature name -> count (numbers or NumPy arrays)
+    Weights (dict): Feature name -> weight, None for DIFFICULTYWEIGHTS
+    '''
+    weights = DIFFICULTYWEIGHTS if weights is None else weights
+    return sum(weight * features[name] for name, weight in weights.items())
+
+def topology(structure: str):
+    '''
+    Returns the branching of a structure or template as a string of "()"s, with every pair that just continues the one
+    around it (stacks, internal loops, bulges) left out, so a structure and the template it was made from give the same one.
+    Only "()" pairs count; anything else is skipped. Raises a ValueError if the "()"s aren't balanced.
+    Parameters:
+    Structure (string): The structure or template
+    '''
+    children = [[]]
+    for char in structure:
+        if char == "(":
+            children.append([])
+        elif char == ")":
+            if len(children) < 2:
+                raise ValueError("Unbalanced structure")
+            inside = children.pop()
+            # A pair with exactly one pair inside is the same branch as that pair
+            children[-1].append(inside[0] if len(inside) == 1 else "(" + "".join(inside) + ")")
+    if len(children) > 1:
+        raise ValueError("Unbalanced structure")
+    return "".join(children[0])
+
+def validatestructure(structure: str, template=None, minhairpin=3, weights=None):
+    '''
+    Checks a dot-bracket structure (pseudoknots included) in one pass, and scores how hard it is.
+    Returns a dict with "valid", "errors" (a list of what's wrong), every feature (see FEATURES) and "difficulty".
+    The features are None when the brackets don't pair up or there's an unknown character, and so is the difficulty
+    for any invalid structure (the same as validatecodes gives).
+    Features: Short Stems: Runs of 1-2 stacked pairs, Triloops: Hairpins of 3 bases, Long Unpaired: Unpaired runs of at
+    least LONGUNPAIRED, Junctions: "()" pairs with two or more stems inside, Pseudoknot Stems: Stems of "[]", "{}" or "<>"
+    Parameters:
+    Structure (string): The given structure
+    Template (string/list): The template it was made from, to check it has the same branching, None to skip that
+    Minhairpin (integer): The fewest unpaired bases a hairpin can have
+    Weights (dict): Feature name -> weight for the difficulty, None for DIFFICULTYWEIGHTS
+    '''
+    errors = []
+    stacks = {opener: [] for opener in OPENERS}
+    partner = {}
+    stemlength = {}
+    features = dict.fromkeys(FEATURES, 0)
+    children = [[]] # Branches inside each open "(" (see topology)
+    lastbracket = -1
+    run = 0
+    broken = False
+    for i, char in enumerate(structure):
+        if char == ".":
+            run += 1
+            continue
+        if run >= LONGUNPAIRED:
+            features["Long Unpaired"] += 1
+        run = 0
+        if char in OPENERS:
+            stacks[char].append(i)
+            if char == "(":
+                children.append([])
+        elif char in CLOSERS:
+            if not stacks[MATCHING[char]]:
+                errors.append(f'Unmatched "{char}" at {i}')
+                broken = True
+                lastbracket = i
+                continue
+            opener = stacks[MATCHING[char]].pop()
+            partner[opener] = i
+            if lastbracket == opener:
+                if i - opener - 1 < minhairpin:
+                    errors.append(f'Hairpin at {opener} has {i - opener - 1} unpaired bases (minimum {minhairpin})')
+                elif i - opener - 1 == 3:
+                    features["Triloops"] += 1
+            inner = opener + 1
+            if partner.get(inner) == i - 1 and structure[inner] == structure[opener]:
+                # Stacked on the pair inside it, so the stem gets longer
+                stemlength[opener] = stemlength[inner] + 1
+                if stemlength[opener] == 3:
+                    features["Short Stems"] -= 1
+            else:
+                stemlength[opener] = 1
+                features["Short Stems"] += 1
+                if char != ")":
+                    features["Pseudoknot Stems"] += 1
+            if char == ")":
+                if len(children) > 1:
+                    inside = children.pop()
+                    if len(inside) >= 2:
+                        features["Junctions"] += 1
+                    if template is not None:
+                        children[-1].append(inside[0] if len(inside) == 1 else "(" + "".join(inside) + ")")
+                    else:
+                        children[-1].append("")
+        else:
+            errors.append(f'Unexpected character "{char}" at {i}')
+            broken = True
+        lastbracket = i
+    if run >= LONGUNPAIRED:
+        features["Long Unpaired"] += 1
+    for opener, positions in stacks.items():
+        errors.extend(f'Unclosed "{opener}" at {pos}' for pos in positions)
+        broken = broken or bool(positions)
+    if template is not None and not errors:
+        try:
+            if topology(template) != "".join(children[0]):
+                errors.append("Doesn't have the same branching as its template")
+        except ValueError:
+            errors.append("The template is unbalanced")
+    if broken:
+        # Without real pairs the counts don't mean anything
+        features = dict.fromkeys(FEATURES)
+    return {"valid": not errors, "errors": errors, **features, "difficulty": None if errors else difficulty(features, weights)}
+
+def segmentcounts(segment, mask, count: int):
+    '''
+    Returns how many True values of mask fall in each of count segments.
+    Parameters:
+    Segment (array): The segment of each position
+    Mask (array): The values to count
+    Count (integer): The number of segments
+    '''
+    return np.bincount(segment[mask], minlength=count)
+
+def pairarrays(flat, segment, starts, ends, count: int):
+    '''
+    Pairs up every bracket of a flattened batch (see validatecodes), and returns (partner, balanced), where partner is
+    the position each bracket is paired with (-1 if unpaired or in an unbalanced structure) and balanced says which
+    structures have every bracket type balanced.
+    Parameters:
+    Flat (array): Position codes, with packed.PAD after every structure
+    Segment (array): The structure each position belongs to
+    Starts, Ends (array): Where each structure's segment starts and ends (exclusive, separator included)
+    Count (integer): The number of structures
+    '''
+    balanced = np.ones(count, dtype=bool)
+    depths = []
+    for kind in range(1, len(packed.CHARS), 2):
+        delta = (flat == kind).astype(np.int64) - (flat == kind + 1)
+        depth = np.cumsum(delta)
+        # Depth within each structure, counted from its own start
+        base = np.concatenate(([0], depth))[starts]
+        depth -= np.repeat(base, ends - starts)
+        lowest = np.minimum.reduceat(depth, starts) if len(flat) else np.zeros(0, dtype=np.int64)
+        balanced &= (lowest >= 0) & (depth[ends - 1] == 0)
+        depths.append(depth)
+    partner = np.full(len(flat), -1, dtype=np.int64)
+    for kind, depth in zip(range(1, len(packed.CHARS), 2), depths):
+        positions = np.flatnonzero(((flat == kind) | (flat == kind + 1)) & balanced[segment])
+        # An opener and its closer are the next two brackets of their type at the same level in the same structure
+        level = depth[positions] + (flat[positions] == kind + 1)
+        order = positions[np.lexsort((positions, level, segment[positions]))]
+        partner[order[0::2]] = order[1::2]
+        partner[order[1::2]] = order[0::2]
+    return partner, balanced
+
+def flatten(codes, lengths):
+    '''
+    Lays a batch of structures out as one array with packed.PAD after each one, and returns (flat, segment, starts, ends).
+    Parameters:
+    Codes (array): Every structure's position codes, one after another
+    Lengths (array): The length of each structure
+    '''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    count = len(lengths)
+    ends = np.cumsum(lengths + 1)
+    starts = ends - lengths - 1
+    flat = np.full(int(ends[-1]) if count else 0, packed.PAD, dtype=np.uint8)
+    # Structure k is shifted along by the k separators before it
+    flat[np.arange(len(codes)) + np.repeat(np.arange(count), lengths)] = codes
+    segment = np.repeat(np.arange(count), lengths + 1)
+    return flat, segment, starts, ends
+
+def branching(flat, partner, count: int, segment):
+    '''
+    Returns the "()" brackets of a flattened batch that topology would keep (as a mask), and which "("s open a junction.
+    Parameters:
+    Flat (array): Position codes, with packed.PAD after every structure
+    Partner (array): The pairs (see pairarrays)
+    Count (integer): The number of structures
+    Segment (array): The structure each position belongs to
+    '''
+    # Only "()"s and the separators, so each one's neighbours are the next "()" brackets in the same structure
+    roundpos = np.flatnonzero((flat == ROUNDOPEN) | (flat == ROUNDCLOSE) | (flat == packed.PAD))
+    rounds = flat[roundpos]
+    index = np.full(len(flat), -1, dtype=np.int64)
+    index[roundpos] = np.arange(len(roundpos))
+    opens = np.flatnonzero((rounds == ROUNDOPEN) & (partner[roundpos] >= 0))
+    # The first pair inside each "(", if the next "()" bracket opens one
+    firstinside = opens + 1
+    hasinside = rounds[firstinside] == ROUNDOPEN
+    afterfirst = np.zeros(len(opens), dtype=bool)
+    closer = index[partner[roundpos[firstinside[hasinside]]]]
+    afterfirst[hasinside] = rounds[closer + 1] == ROUNDOPEN
+    # A "(" with one pair inside just carries on that pair, and one with two or more opens a junction
+    keep = np.zeros(len(flat), dtype=bool)
+    kept = roundpos[opens[~(hasinside & ~afterfirst)]]
+    keep[kept] = True
+    keep[partner[kept]] = True
+    junctions = np.bincount(segment[roundpos[opens[hasinside & afterfirst]]], minlength=count)
+    return keep, junctions
+
+def validatecodes(codes, lengths, templatecodes=None, templatelengths=None, minhairpin=3, weights=None):
+    '''
+    Checks and scores a whole batch of structures at once with NumPy, the same way as validatestructure.
+    Returns a dict of arrays with one value per structure: "valid", "balanced", "characters" (no unknown characters),
+    "hairpins" (no hairpin below minhairpin), "template" (same branching as the template, only with templates),
+    every feature (see FEATURES, NaN for structures that aren't balanced or have unknown characters) and "difficulty"
+    (NaN for invalid structures).
+    Parameters:
+    Codes (array): Every structure's position codes (indexes into packed.CHARS, 255 for anything else), one after another
+    Lengths (array): The length of each structure
+    Templatecodes, Templatelengths (array): The same for each structure's template ("*"s as "."), None to skip that check
+    Minhairpin (integer): The fewest unpaired bases a hairpin can have
+    Weights (dict): Feature name -> weight for the difficulty, None for DIFFICULTYWEIGHTS
+    '''
+    codes = np.asarray(codes, dtype=np.uint8)
+    count = len(lengths)
+    flat, segment, starts, ends = flatten(codes, lengths)
+    characters = segmentcounts(segment, (flat >= len(packed.CHARS)) & (flat != packed.PAD), count) == 0
+    partner, balanced = pairarrays(flat, segment, starts, ends, count)
+    balanced &= characters
+    positions = np.arange(len(flat))
+    isbracket = (flat != DOT) & (flat != packed.PAD)
+    isopen = partner > positions
+
+    # A pair with no brackets between its two sides closes a hairpin
+    opens = np.flatnonzero(isopen)
+    brackets = np.cumsum(isbracket)
+    hairpin = brackets[partner[opens]] - brackets[opens] == 1
+    size = partner[opens] - opens - 1
+    hairpins = np.bincount(segment[opens[hairpin & (size < minhairpin)]], minlength=count) == 0
+    features = {"Triloops": np.bincount(segment[opens[hairpin & (size == 3)]], minlength=count)}
+
+    # Runs of "."s, which the separators keep from running on into the next structure
+    dots = np.concatenate(([False], flat == DOT, [False]))
+    runstarts = np.flatnonzero(dots[1:] & ~dots[:-1])
+    runends = np.flatnonzero(dots[:-1] & ~dots[1:])
+    features["Long Unpaired"] = np.bincount(segment[runstarts[runends - runstarts >= LONGUNPAIRED]], minlength=count)
+
+    # A stem carries on inwards while the next position pairs with the position before the partner, with the same bracket
+    carries = np.zeros(len(flat), dtype=bool)
+    carries[:-1] = isopen[:-1] & isopen[1:] & (partner[1:] == partner[:-1] - 1) & (flat[1:] == flat[:-1])
+    stemstarts = np.flatnonzero(isopen & ~np.concatenate(([False], carries[:-1])))
+    stops = np.where(carries, len(flat), positions)
+    laststop = np.minimum.accumulate(stops[::-1])[::-1]
+    stemlengths = laststop[stemstarts] - stemstarts + 1
+    features["Short Stems"] = np.bincount(segment[stemstarts[stemlengths <= 2]], minlength=count)
+    features["Pseudoknot Stems"] = np.bincount(segment[stemstarts[flat[stemstarts] != ROUNDOPEN]], minlength=count)
+
+    keep, features["Junctions"] = branching(flat, partner, count, segment)
+    valid = balanced & hairpins
+    result = {"valid": valid, "balanced": balanced, "characters": characters, "hairpins": hairpins}
+    if templatecodes is not None:
+        tflat, tsegment, tstarts, tends = flatten(np.asarray(templatecodes, dtype=np.uint8), templatelengths)
+        tpartner, tbalanced = pairarrays(tflat, tsegment, tstarts, tends, count)
+        tkeep = branching(tflat, tpartner, count, tsegment)[0]
+        # Same branching means the same kept brackets, in the same order
+        signature, tsignature = flat[keep], tflat[tkeep]
+        sizes = np.bincount(segment[keep], minlength=count)
+        same = (sizes == np.bincount(tsegment[tkeep], minlength=count)) & tbalanced
+        chosen = same[segment[keep]]
+        mismatches = np.bincount(segment[keep][chosen], signature[chosen] != tsignature[same[tsegment[tkeep]]], minlength=count)
+        result["template"] = same & (mismatches == 0)
+        valid &= result["template"]
+    # Unpaired brackets get no partner, so the counts for those would look fine but mean nothing
+    result.update({name: np.where(balanced, features[name], np.nan) for name in FEATURES})
+    result["difficulty"] = np.where(valid, difficulty(result, weights), np.nan)
+    return result
+
+def encode(structures):
+    '''
+    Turns a list of structures (or templates, whose "*"s become "."s) into (codes, lengths) for validatecodes.
+    Parameters:
+    Structures (list): The given structures
+    '''
+    lengths = np.fromiter((len(structure) for structure in structures), dtype=np.int64, count=len(structures))
+    text = "".join(structures).replace("*", ".").encode("latin-1", "replace")
+    return packed.ENCODE[np.frombuffer(text, dtype=np.uint8)], lengths
+
+def validatestrings(structures: list, templates=None, minhairpin=3, weights=None):
+    '''
+    Checks and scores a list of structures at once (see validatecodes).
+    Parameters:
+    Structures (list): The given structures
+    Templates (list): The template of each structure, None to skip that check
+    Minhairpin (integer): The fewest unpaired bases a hairpin can have
+    Weights (dict): Feature name -> weight for the difficulty, None for DIFFICULTYWEIGHTS
+    '''
+    codes, lengths = encode(structures)
+    templatecodes = templatelengths = None
+    if templates is not None:
+        templatecodes, templatelengths = encode(["".join(template) for template in templates])
+    return validatecodes(codes, lengths, templatecodes, templatelengths, minhairpin, weights)
+
+def readchunks(path: str, chunksize=100000):
+    '''
+    Reads a corpus in chunks, yielding (structures, templates) with templates None when the file has none, or for a
+    packed file, (codes, lengths) so nothing has to be decoded. Handles packed files and the plain, jsonl and fasta
+    formats (see export.py), gzipped or not.
+    Parameters:
+    Path (string): The corpus
+    Chunksize (integer): The most structures per chunk
+    '''
+    with open(path, "rb") as f:
+        magic = f.read(len(packed.MAGIC))
+    if magic == packed.MAGIC:
+        with packed.PackedReader(path) as reader:
+            for start in range(0, len(reader), chunksize):
+                stop = min(start + chunksize, len(reader))
+                # Structures sit back to back, and only odd-length ones end in a PAD, so dropping those joins them up
+                data = reader.map[int(reader.offsets[start]):int(reader.offsets[stop])]
+                codes = packed.unpackcodes(data, 2 * len(data))
+                yield codes[codes != packed.PAD], reader.lengths[start:stop].astype(np.int64)
+        return
+    import gzip
+    opener = gzip.open if magic[:2] == b"\x1f\x8b" else open
+    structures, templates = [], []
+    with opener(path, "rt") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(">"):
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                structures.append(record["structure"])
+                templates.append(record.get("template"))
+            else:
+                structures.append(line)
+                templates.append(None)
+            if len(structures) == chunksize:
+                yield structures, templates if None not in templates else None
+                structures, templates = [], []
+    if structures:
+        yield structures, templates if None not in templates else None
+
+def validatefile(path: str, chunksize=100000, minhairpin=3, weights=None):
+    '''
+    Checks and scores every structure in a corpus, yielding one result dict (see validatecodes) per chunk.
+    Parameters:
+    Path (string): The corpus (see readchunks)
+    Chunksize (integer): The most structures per chunk
+    Minhairpin (integer): The fewest unpaired bases a hairpin can have
+    Weights (dict): Feature name -> weight for the difficulty, None for DIFFICULTYWEIGHTS
+    '''
+    for first, second in readchunks(path, chunksize):
+        if isinstance(first, np.ndarray):
+            yield validatecodes(first, second, minhairpin=minhairpin, weights=weights)
+        else:
+            yield validatestrings(first, second, minhairpin, weights)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks and scores every structure in a corpus, exiting with 1 if any fail")
+    parser.add_argument("path", help="Corpus to check (packed, plain, jsonl or fasta, optionally gzipped)")
+    parser.add_argument("-m", "--min-hairpin", type=int, default=3, help="Fewest unpaired bases a hairpin can have")
+    parser.add_argument("-d", "--max-difficulty", type=float, default=None, help="Also fail structures scoring above this")
+    parser.add_argument("-c", "--chunk-size", type=int, default=100000, help="Structures to check at once")
+    parser.add_argument("-o", "--output", default=None, help="File to write each structure's validity and score to (CSV)")
+    args = parser.parse_args()
+
+    total = failed = 0
+    reasons = dict.fromkeys(["balanced", "characters", "hairpins", "template", "difficulty"], 0)
+    scores = []
+    output = open(args.output, "w") if args.output is not None else None
+    try:
+        if output is not None:
+            output.write("index,valid," + ",".join(FEATURES) + ",difficulty\n")
+        for result in validatefile(args.path, args.chunk_size, args.min_hairpin):
+            valid = result["valid"].copy()
+            for reason in ("balanced", "characters", "hairpins", "template"):
+                if reason in result:
+                    reasons[reason] += int((~result[reason]).sum())
+            if args.max_difficulty is not None:
+                hard = valid & (result["difficulty"] > args.max_difficulty)
+                reasons["difficulty"] += int(hard.sum())
+                valid &= ~hard
+            if output is not None:
+                columns = [result[name] for name in FEATURES]
+                for i in range(len(valid)):
+                    # Failed structures get blank cells instead of "nan"
+                    cells = [f'{column[i]:g}' if column[i] == column[i] else "" for column in columns + [result["difficulty"]]]
+                    output.write(f'{total + i},{int(valid[i])},' + ",".join(cells) + "\n")
+            scores.append(result["difficulty"][result["valid"]])
+            total += len(valid)
+            failed += int((~valid).sum())
+    finally:
+        if output is not None:
+            output.close()
+    scores = np.concatenate(scores) if scores else np.zeros(0)
+    print(f'{total} structures, {total - failed} passed, {failed} failed')
+    for reason, amount in reasons.items():
+        if amount:
+            print(f'  {amount} failed: {reason}')
+    if len(scores):
+        print(f'Difficulty: mean {scores.mean():.2f}, median {np.median(scores):.2f}, max {scores.max():.2f}')
+    sys.exit(1 if failed else 0)